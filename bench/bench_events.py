@@ -0,0 +1,111 @@
+# python3 -m bench.bench_events (from the repo root)
+import datetime as dt
+import json
+import pathlib
+import timeit
+import typing as tp
+
+import events
+
+_FIXTURES = pathlib.Path(__file__).parent / 'fixtures'
+_REPEAT = 5
+_NUMBER = 200
+
+
+# the parsing as it was before events.parse_timeline, for the comparison
+class _LegacyEvent:
+    __slots__ = ('_type', 'reviewer', 'event_at')
+
+    def __init__(self, event: tp.Dict[str, tp.Any], author: str):
+        self._type = self._get_type(event['__typename'])
+        if self._type == 'NONE':
+            return
+
+        if self._type == 'REVIEWED':
+            self.reviewer = event['author']['login']
+        elif self._type == 'REMOVED' or (
+            self._type == 'REQUESTED' and event['actor']['login'] == author
+        ):
+            reviewer = event.get('requestedReviewer')
+            if not reviewer:
+                self._type = 'NONE'
+                return
+            self.reviewer = reviewer['login']
+        else:
+            self.reviewer = None
+
+        last_at = event.get('submittedAt') or event.get('createdAt')
+        if not last_at:
+            self._type = 'NONE'
+            return
+
+        self.event_at = dt.datetime.strptime(
+            last_at, '%Y-%m-%dT%H:%M:%SZ',
+        ).replace(tzinfo=dt.timezone.utc)
+
+    @staticmethod
+    def _get_type(event_type_str: str) -> str:
+        if event_type_str == 'ReviewRequestedEvent':
+            return 'REQUESTED'
+        if event_type_str == 'PullRequestReview':
+            return 'REVIEWED'
+        if event_type_str == 'ReviewRequestRemovedEvent':
+            return 'REMOVED'
+        if event_type_str == 'MergedEvent':
+            return 'MERGED'
+        if event_type_str == 'ClosedEvent':
+            return 'CLOSED'
+        return 'NONE'
+
+
+def _legacy_convert(nodes: tp.List[dict], author: str) -> list:
+    result = []
+    for node in nodes:
+        event = _LegacyEvent(node, author)
+        if event._type != 'NONE':
+            result.append(event)
+            if event._type in ('MERGED', 'CLOSED'):
+                break
+    return result
+
+
+def load_timelines() -> tp.List[dict]:
+    with open(_FIXTURES / 'timelines.json') as fixture:
+        return json.load(fixture)
+
+
+def _check(timelines: tp.List[dict]) -> None:
+    for timeline in timelines:
+        legacy = _legacy_convert(timeline['nodes'], timeline['author'])
+        batch = events.parse_timeline(timeline['nodes'], timeline['author'])
+        assert [event.reviewer for event in legacy] == batch.get_reviewers()
+        assert [event.event_at for event in legacy] == batch.get_event_ats()
+
+
+def _best(func: tp.Callable[[], tp.Any]) -> float:
+    return min(timeit.repeat(func, repeat=_REPEAT, number=_NUMBER)) / _NUMBER
+
+
+def main() -> None:
+    timelines = load_timelines()
+    _check(timelines)
+    nodes_count = sum(len(timeline['nodes']) for timeline in timelines)
+
+    def legacy():
+        for timeline in timelines:
+            _legacy_convert(timeline['nodes'], timeline['author'])
+
+    def fast():
+        for timeline in timelines:
+            events.parse_timeline(timeline['nodes'], timeline['author'])
+
+    legacy_secs = _best(legacy)
+    fast_secs = _best(fast)
+    print(f'{len(timelines)} timelines, {nodes_count} nodes')
+    print(f'legacy: {legacy_secs * 1e6 / nodes_count:.3f} us/node')
+    print(f'batch:  {fast_secs * 1e6 / nodes_count:.3f} us/node')
+    print(f'speedup: {legacy_secs / fast_secs:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# python3 -m bench.bench_logging (from the repo root)
+import logging
+import logging.handlers
+import pathlib
+import tempfile
+import time
+import typing as tp
+
+import logs
+
+_RECORDS = 20000
+
+# the shape of a telegram update as logged by telegram.Update.__init__
+_MESSAGE = {
+    'message_id': 4242,
+    'from': {'id': 1234567, 'is_bot': False, 'username': 'someone'},
+    'chat': {'id': 1234567, 'username': 'someone', 'type': 'private'},
+    'date': 1600000000,
+    'text': '/stats',
+}
+
+
+def _make_logger(handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f'bench.{id(handler)}')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+# seconds per call spent by the caller, i.e. by the event loop
+def _measure(func: tp.Callable[[], None]) -> float:
+    started = time.perf_counter()
+    for _ in range(_RECORDS):
+        func()
+    return (time.perf_counter() - started) / _RECORDS
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        direct = logging.FileHandler(pathlib.Path(tmp) / 'direct.log')
+        direct.setFormatter(logging.Formatter(logs.TSKV_FORMAT))
+        before = _make_logger(direct)
+
+        rotating = logging.handlers.RotatingFileHandler(
+            pathlib.Path(tmp) / 'queued.log',
+            maxBytes=10 * 1024 * 1024,
+            backupCount=1,
+        )
+        rotating.setFormatter(logging.Formatter(logs.TSKV_FORMAT))
+        after = _make_logger(logs.queued(rotating))
+
+        message = _MESSAGE
+        results = {
+            'debug at INFO, f-string': _measure(
+                lambda: before.debug(f'message = {message}'),
+            ),
+            'debug at INFO, lazy %s': _measure(
+                lambda: after.debug('message = %s', message),
+            ),
+            'info, file handler': _measure(
+                lambda: before.info(f'message = {message}'),
+            ),
+            'info, queue handler': _measure(
+                lambda: after.info('message = %s', message),
+            ),
+        }
+        logs.stop()
+        direct.close()
+        rotating.close()
+
+    for name, secs in results.items():
+        print(f'{name:<26} {secs * 1e6:8.2f} us/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+# python3 -m bench.bench_paths --dsn postgresql://localhost/reviews_bench
+# runs the real code paths with the recorded responses from bench/fixtures
+# against a local postgresql, the database is overwritten, so a dedicated one;
+# --backend memory runs them on storage_memory.py without a database
+import argparse
+import asyncio
+import dataclasses
+import datetime as dt
+import json
+import os
+import pathlib
+import random
+import statistics as stat
+import sys
+import time
+import tracemalloc
+import typing as tp
+
+import asyncpg
+
+import calendarm
+import cluster
+import common
+import configs
+import github
+import loop_notify
+import loop_stats
+import loop_telegram
+import stats
+import storage
+import storage_memory
+from bench import fakes
+
+_ROOT = pathlib.Path(__file__).parent.parent
+# per backend, the numbers are not comparable
+_BASELINES = {
+    'pg': pathlib.Path(__file__).parent / 'baselines.json',
+    'memory': pathlib.Path(__file__).parent / 'baselines_memory.json',
+}
+
+_USERS = [f'user{index:03d}' for index in range(50)]
+_CHAT_ID_BASE = 100000
+_SEED_PR = github.PullRequest('bench', 'seed', 0)
+
+
+class Context:
+    staff_token: str
+    github_token: str
+    tg_token: str
+    config: configs.Config
+    session: fakes.FakeSession
+    # or both are one storage_memory.MemoryStorage
+    conn: asyncpg.Connection
+    pool: asyncpg.pool.Pool
+    cluster: cluster.Cluster
+    org_tree: None
+    runtime_config: None
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str
+    run: tp.Callable[[Context], tp.Awaitable[None]]
+    reset: tp.Optional[tp.Callable[[Context], tp.Awaitable[None]]] = None
+
+
+async def _seed(ctx: Context) -> None:
+    rnd = random.Random(40)
+    now = dt.datetime.now(dt.timezone.utc)
+    async with ctx.pool.acquire() as conn:
+        if not isinstance(conn, storage.Backend):
+            await conn.execute((_ROOT / 'schema.sql').read_text())
+        for index, login in enumerate(_USERS):
+            await storage.save_user_mappings(
+                login, f'tg_{login}', str(_CHAT_ID_BASE + index), conn,
+            )
+            await storage.set_hours(list(range(27)), login, conn)
+        # four subordinates per chief
+        await storage.set_staff_chiefs(
+            {
+                login: _USERS[(index - 1) // 4] if index else None
+                for index, login in enumerate(_USERS)
+            },
+            'bench',
+            conn,
+        )
+        for number in range(1, 400):
+            await storage.save_times(
+                dataclasses.replace(_SEED_PR, number=number),
+                [
+                    {
+                        'reviewer': rnd.choice(_USERS),
+                        'minutes': rnd.randint(15, 2000),
+                        'review_at': now - dt.timedelta(
+                            minutes=rnd.randint(0, 60 * 24 * 56),
+                        ),
+                    }
+                    for _ in range(3)
+                ],
+                conn,
+            )
+
+
+async def _reset_stats(ctx: Context) -> None:
+    if isinstance(ctx.pool, storage_memory.MemoryStorage):
+        # no sql to delete with, the seeded state again
+        ctx.pool = ctx.conn = storage_memory.MemoryStorage()
+        await _seed(ctx)
+    else:
+        async with ctx.pool.acquire() as conn:
+            for table in (
+                    'processed_prs', 'pr_events', 'review_stats', 'cursors',
+            ):
+                await conn.execute(
+                    f'DELETE FROM reviews.{table} WHERE owner <> $1;',
+                    _SEED_PR.owner,
+                )
+    async with ctx.pool.acquire() as conn:
+        # any cursor, the fake session always answers with the same page
+        for owner, repos in common.REPOS.items():
+            for repo in repos:
+                await storage.save_cursor(
+                    'start', github.PullRequest(owner, repo, 0), None, conn,
+                )
+
+
+# every run claims the same hour again
+async def _reset_notify(ctx: Context) -> None:
+    if isinstance(ctx.pool, storage_memory.MemoryStorage):
+        ctx.pool._notify_claims.clear()
+    else:
+        async with ctx.pool.acquire() as conn:
+            await conn.execute('DELETE FROM reviews.notify_claims;')
+
+
+async def _run_subordinated(ctx: Context) -> None:
+    now = dt.datetime.now(dt.timezone.utc)
+    async with ctx.pool.acquire() as conn:
+        for is_nearest in (True, False):
+            await stats.get_subordinated_stats_to_show(
+                _USERS[0], is_nearest, now - dt.timedelta(weeks=8), now, conn,
+            )
+
+
+_WORKING_TIME_PAIRS = [
+    (
+        dt.datetime(2021, 3, 1, tzinfo=dt.timezone.utc)
+        + dt.timedelta(minutes=37 * index),
+        dt.datetime(2021, 3, 1, tzinfo=dt.timezone.utc)
+        + dt.timedelta(minutes=37 * index + 53 * (index % 97)),
+    )
+    for index in range(1000)
+]
+
+
+# 1000 pairs per op
+async def _run_working_time(ctx: Context) -> None:
+    for begin, end in _WORKING_TIME_PAIRS:
+        calendarm.get_working_time_between(begin, end, 'user000')
+
+
+_SCENARIOS = [
+    Scenario('process_stats', loop_stats.process_stats, _reset_stats),
+    Scenario('process_notify', loop_notify.process_notify, _reset_notify),
+    Scenario('process_telegram_input', loop_telegram.process_telegram_input),
+    Scenario('get_subordinated_stats_to_show', _run_subordinated),
+    Scenario('get_working_time_between', _run_working_time),
+]
+
+
+async def _measure(
+        scenario: Scenario, iterations: int, ctx: Context,
+) -> tp.Dict[str, float]:
+    async def _run_once() -> float:
+        if scenario.reset is not None:
+            await scenario.reset(ctx)
+        started = time.perf_counter()
+        await scenario.run(ctx)
+        return time.perf_counter() - started
+
+    # warms up the pool and the caches
+    await _run_once()
+
+    requests, sent = ctx.session.requests, len(ctx.session.sent)
+    latencies = [await _run_once() for _ in range(iterations)]
+    requests = (ctx.session.requests - requests) / iterations
+    sent = (len(ctx.session.sent) - sent) / iterations
+
+    # a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    await _run_once()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': len(latencies) / sum(latencies),
+        'p50_ms': stat.median(latencies) * 1000,
+        'p99_ms': (
+            stat.quantiles(latencies, n=100)[98] * 1000
+            if len(latencies) > 1
+            else latencies[0] * 1000
+        ),
+        'peak_alloc_kib': peak / 1024,
+        # not comparable if these differ, e.g. no digests on weekends
+        'requests_per_op': requests,
+        'messages_per_op': sent,
+    }
+
+
+def _compare(
+        results: tp.Dict[str, tp.Dict[str, float]],
+        baselines_path: pathlib.Path,
+        tolerance: float,
+) -> bool:
+    if not baselines_path.exists():
+        print(f'no baselines at {baselines_path}, run with --save')
+        return True
+    with open(baselines_path) as baselines_file:
+        baselines = json.load(baselines_file)
+
+    ok = True
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        if baseline['messages_per_op'] != result['messages_per_op']:
+            print(f'{name}: different workload than the baseline, skipped')
+            continue
+        for key in ('p50_ms', 'p99_ms', 'peak_alloc_kib'):
+            ratio = result[key] / baseline[key] if baseline[key] else 1.0
+            regressed = ratio > 1 + tolerance
+            ok = ok and not regressed
+            print(
+                f'{name}: {key} {baseline[key]:.2f} -> {result[key]:.2f}'
+                f' ({ratio:.2f}x){" REGRESSION" if regressed else ""}',
+            )
+    return ok
+
+
+async def _run_scenarios(
+        args: argparse.Namespace, ctx: Context,
+) -> tp.Dict[str, tp.Dict[str, float]]:
+    results: tp.Dict[str, tp.Dict[str, float]] = {}
+    await _seed(ctx)
+    for scenario in _SCENARIOS:
+        if args.only and scenario.name not in args.only:
+            continue
+        result = await _measure(scenario, args.iterations, ctx)
+        results[scenario.name] = result
+        print(
+            f'{scenario.name:<32}'
+            f' {result["ops_per_sec"]:8.2f} ops/s'
+            f'  p50 {result["p50_ms"]:8.2f} ms'
+            f'  p99 {result["p99_ms"]:8.2f} ms'
+            f'  peak {result["peak_alloc_kib"]:9.1f} KiB'
+            f'  {result["requests_per_op"]:.0f} requests'
+            f', {result["messages_per_op"]:.0f} messages',
+        )
+    return results
+
+
+async def run_bench(args: argparse.Namespace) -> bool:
+    ctx = Context()
+    ctx.config = configs.Config(is_test=True)
+    ctx.session = fakes.FakeSession()
+    ctx.staff_token = ctx.github_token = ctx.tg_token = 'bench'
+    ctx.org_tree = None
+    ctx.runtime_config = None
+    # every run sends the digests again and searches github again, the
+    # workload of the baselines
+    ctx.config.notify_repeat_after = dt.timedelta(0)
+    ctx.config.result_cache_ttl = dt.timedelta(0)
+    # never heartbeats, so owns every user and repo
+    ctx.cluster = cluster.Cluster({'dsn': args.dsn}, ctx.config)
+
+    if args.backend == 'memory':
+        ctx.pool = ctx.conn = storage_memory.MemoryStorage()
+        results = await _run_scenarios(args, ctx)
+    else:
+        ctx.conn = await asyncpg.connect(args.dsn)
+        async with asyncpg.create_pool(
+                args.dsn, min_size=10, max_size=10,
+        ) as pool:
+            ctx.pool = pool
+            results = await _run_scenarios(args, ctx)
+        await ctx.conn.close()
+
+    baselines_path = _BASELINES[args.backend]
+    if args.save:
+        with open(baselines_path, 'w') as baselines_file:
+            json.dump(results, baselines_file, indent=2, sort_keys=True)
+        print(f'baselines saved to {baselines_path}')
+        return True
+    return _compare(results, baselines_path, args.tolerance)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='benchmark the loops on recorded api responses',
+    )
+    parser.add_argument('--backend', choices=_BASELINES, default='pg')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_PG_DSN'))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--only', nargs='*', default=None)
+    parser.add_argument('--save', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    if args.backend == 'pg' and (not args.dsn or 'bench' not in args.dsn):
+        parser.error('--dsn of a dedicated database with "bench" in its name')
+    return args
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(run_bench(_parse_args())) else 1)
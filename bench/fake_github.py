@@ -0,0 +1,543 @@
+# python3 -m bench.fake_github --port 8081 --users 500 --extra-repos 10
+# then run the bot with GITHUB_GRAPHQL_ENDPOINT=http://127.0.0.1:8081/graphql
+#
+# a stand-in for api.github.com/graphql that understands the queries of
+# queries.py only, the repos, prs and reviews are generated from the seed
+import argparse
+import asyncio
+import base64
+import collections
+import dataclasses
+import datetime as dt
+import random
+import re
+import time
+import typing as tp
+
+from aiohttp import web
+
+import common
+
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+_SEARCH = re.compile(r'search\(query:"((?:[^"\\]|\\.)*)"([^)]*)\)')
+_REPOSITORY = re.compile(r'repository\(owner:"([^"]+)", name:"([^"]+)"\)')
+_PULL_REQUESTS = re.compile(r'pullRequests\((.*?)\)\s*\{')
+_PULL_REQUEST = re.compile(r'pullRequest\(number:(\d+)\)')
+_STATES = re.compile(r'states:\[(\w+)\]')
+_AFTER = re.compile(r'after:"([^"]*)"')
+_FIRST = re.compile(r'first:(\d+)')
+_LAST = re.compile(r'last:(\d+)')
+_DATE = r'(\d{4}-\d{2}-\d{2})'
+_UPDATED = re.compile(rf'updated:([<>]?){_DATE}(?:\.\.{_DATE})?')
+
+
+def _format_time(moment: dt.datetime) -> str:
+    return moment.strftime(_TIME_FORMAT)
+
+
+@dataclasses.dataclass
+class _Review:
+    author: str
+    state: str  # APPROVED or COMMENTED
+    commit: str
+    submitted_at: dt.datetime
+
+
+# compared by identity, kept in sets
+@dataclasses.dataclass(eq=False)
+class _PullRequest:
+    owner: str
+    repo: str
+    number: int
+    author: str
+    title: str
+    labels: tp.List[str]
+    is_draft: bool
+    additions: int
+    deletions: int
+    created_at: dt.datetime
+    requested: tp.List[str]  # still waiting for their review
+    reviews: tp.List[_Review]
+    merged_at: tp.Optional[dt.datetime]
+
+    @property
+    def updated_at(self) -> dt.datetime:
+        moments = [self.created_at] + [r.submitted_at for r in self.reviews]
+        if self.merged_at:
+            moments.append(self.merged_at)
+        return max(moments)
+
+    def to_search_node(self) -> dict:
+        return {
+            'repository': {'name': self.repo, 'owner': {'login': self.owner}},
+            'author': {'login': self.author},
+            'additions': self.additions,
+            'deletions': self.deletions,
+            'isDraft': self.is_draft,
+            'title': self.title,
+            'reviews': {
+                'nodes': [
+                    {
+                        'author': {'login': review.author},
+                        'commit': {
+                            'abbreviatedOid': review.commit[:7],
+                            'oid': review.commit,
+                        },
+                        'submittedAt': _format_time(review.submitted_at),
+                    }
+                    for review in self.reviews[-10:]
+                ],
+            },
+            'merged': self.merged_at is not None,
+            'mergedAt': self.merged_at and _format_time(self.merged_at),
+            'number': self.number,
+            'url': (
+                f'https://github.com/{self.owner}/{self.repo}'
+                f'/pull/{self.number}'
+            ),
+            'labels': {'nodes': [{'name': name} for name in self.labels[:10]]},
+        }
+
+    def to_timeline(self) -> tp.List[dict]:
+        nodes: tp.List[tp.Tuple[dt.datetime, dict]] = []
+        reviewers = {review.author for review in self.reviews}
+        for index, reviewer in enumerate(sorted(reviewers) + self.requested):
+            requested_at = self.created_at + dt.timedelta(minutes=index)
+            nodes.append(
+                (
+                    requested_at,
+                    {
+                        '__typename': 'ReviewRequestedEvent',
+                        'actor': {'login': self.author},
+                        'createdAt': _format_time(requested_at),
+                        'requestedReviewer': {'login': reviewer},
+                    },
+                ),
+            )
+        for review in self.reviews:
+            nodes.append(
+                (
+                    review.submitted_at,
+                    {
+                        '__typename': 'PullRequestReview',
+                        'author': {'login': review.author},
+                        'submittedAt': _format_time(review.submitted_at),
+                        'state': review.state,
+                    },
+                ),
+            )
+        if self.merged_at:
+            nodes.append(
+                (
+                    self.merged_at,
+                    {
+                        '__typename': 'MergedEvent',
+                        'actor': {'login': self.author},
+                        'createdAt': _format_time(self.merged_at),
+                    },
+                ),
+            )
+        nodes.sort(key=lambda item: item[0])
+        return [node for _, node in nodes]
+
+
+class FakeGithub:
+    def __init__(
+            self,
+            seed: int,
+            repos: tp.List[tp.Tuple[str, str]],
+            prs_per_repo: int,
+            users: int,
+            now: dt.datetime,
+    ):
+        self.users = [f'user{index:04d}' for index in range(users)]
+        self.prs: tp.Dict[tp.Tuple[str, str, int], _PullRequest] = {}
+        self._merged: tp.Dict[tp.Tuple[str, str], tp.List[_PullRequest]] = {}
+        self._open: tp.Dict[tp.Tuple[str, str], tp.List[_PullRequest]] = {}
+        self._by_login: tp.Dict[str, tp.Set[_PullRequest]] = (
+            collections.defaultdict(set)
+        )
+        for owner, repo in repos:
+            self._generate_repo(seed, owner, repo, prs_per_repo, now)
+
+    def _generate_repo(
+            self,
+            seed: int,
+            owner: str,
+            repo: str,
+            prs_count: int,
+            now: dt.datetime,
+    ) -> None:
+        rnd = random.Random(f'{seed}/{owner}/{repo}')
+        merged: tp.List[_PullRequest] = []
+        opened: tp.List[_PullRequest] = []
+        for number in range(1, prs_count + 1):
+            created_at = now - dt.timedelta(
+                minutes=rnd.randint(60, 90 * 24 * 60),
+            )
+            author = rnd.choice(self.users)
+            others = rnd.sample(self.users, min(4, len(self.users)))
+            reviewers = [login for login in others if login != author][:3]
+            is_merged = rnd.random() < 0.8
+            reviews: tp.List[_Review] = []
+            requested: tp.List[str] = []
+            for reviewer in reviewers:
+                if is_merged or rnd.random() < 0.5:
+                    reviews.append(
+                        _Review(
+                            reviewer,
+                            rnd.choice(['APPROVED', 'COMMENTED']),
+                            '%040x' % rnd.getrandbits(160),
+                            min(
+                                now,
+                                created_at + dt.timedelta(
+                                    minutes=rnd.randint(10, 3 * 24 * 60),
+                                ),
+                            ),
+                        ),
+                    )
+                else:
+                    requested.append(reviewer)
+            reviews.sort(key=lambda review: review.submitted_at)
+            merged_at = (
+                min(
+                    now,
+                    (reviews[-1].submitted_at if reviews else created_at)
+                    + dt.timedelta(minutes=rnd.randint(5, 600)),
+                )
+                if is_merged
+                else None
+            )
+            pull_request = _PullRequest(
+                owner=owner,
+                repo=repo,
+                number=number,
+                author=author,
+                title=f'Synthetic change {number} in {repo}',
+                labels=rnd.sample(
+                    ['wip', 'backlog', 'backend', 'frontend', 'urgent'],
+                    rnd.randint(0, 2),
+                ),
+                is_draft=rnd.random() < 0.05,
+                additions=rnd.randint(1, 2000),
+                deletions=rnd.randint(0, 800),
+                created_at=created_at,
+                requested=requested,
+                reviews=reviews,
+                merged_at=merged_at,
+            )
+            self.prs[(owner, repo, number)] = pull_request
+            (merged if is_merged else opened).append(pull_request)
+            for login in {author, *reviewers}:
+                self._by_login[login].add(pull_request)
+
+        merged.sort(key=lambda pull_request: pull_request.merged_at)
+        self._merged[(owner, repo)] = merged
+        self._open[(owner, repo)] = opened
+
+    def search(self, query: str, first: int, last: int) -> tp.List[dict]:
+        terms = query.split()
+        candidates: tp.Optional[tp.Set[_PullRequest]] = None
+        checks: tp.List[tp.Callable[[_PullRequest], bool]] = []
+        for term in terms:
+            negate = term.startswith('-')
+            key, _, value = term.lstrip('-').partition(':')
+            if key in ('author', 'review-requested', 'reviewed-by'):
+                if not negate:
+                    candidates = set(self._by_login.get(value, ()))
+                checks.append(_LOGIN_CHECKS[key](value, negate))
+            elif key == 'is' and value in ('open', 'merged'):
+                checks.append(
+                    (lambda pr: pr.merged_at is None)
+                    if value == 'open'
+                    else (lambda pr: pr.merged_at is not None),
+                )
+            elif key == 'draft':
+                checks.append(lambda pr: not pr.is_draft)
+            elif key == 'label':
+                checks.append(
+                    lambda pr, label=value, negate=negate: (
+                        label in pr.labels
+                    ) != negate,
+                )
+            elif key == 'review' and value == 'approved':
+                checks.append(
+                    lambda pr, negate=negate: any(
+                        review.state == 'APPROVED' for review in pr.reviews
+                    ) != negate,
+                )
+        match = _UPDATED.search(query)
+        if match:
+            checks.append(_updated_check(*match.groups()))
+
+        pool = candidates if candidates is not None else self.prs.values()
+        found = sorted(
+            (pr for pr in pool if all(check(pr) for check in checks)),
+            key=lambda pr: pr.updated_at,
+        )
+        found = found[-last:] if last else found[:first or 100]
+        return [{'node': pr.to_search_node()} for pr in found]
+
+    def pull_requests(
+            self,
+            owner: str,
+            repo: str,
+            state: str,
+            after: tp.Optional[str],
+            first: int,
+            last: int,
+    ) -> tp.List[dict]:
+        prs = (
+            self._merged.get((owner, repo), [])
+            if state == 'MERGED'
+            else self._open.get((owner, repo), [])
+        )
+        if after:
+            try:
+                begin = int(base64.b64decode(after).split(b':')[-1]) + 1
+            except ValueError:
+                begin = 0  # not ours, e.g. saved from the real api
+            indexes = range(begin, min(begin + first, len(prs)))
+        else:
+            indexes = range(max(len(prs) - last, 0), len(prs))
+        return [
+            {
+                'node': {
+                    'number': prs[index].number,
+                    'mergedAt': (
+                        prs[index].merged_at
+                        and _format_time(prs[index].merged_at)
+                    ),
+                },
+                'cursor': base64.b64encode(f'c:{index}'.encode()).decode(),
+            }
+            for index in indexes
+        ]
+
+    def timeline(
+            self, owner: str, repo: str, number: int,
+    ) -> tp.Optional[dict]:
+        pull_request = self.prs.get((owner, repo, number))
+        if pull_request is None:
+            return None
+        nodes = pull_request.to_timeline()
+        return {
+            'author': {'login': pull_request.author},
+            'timelineItems': {
+                'updatedAt': _format_time(pull_request.updated_at),
+                'totalCount': len(nodes),
+                'nodes': nodes,
+            },
+        }
+
+
+_LOGIN_CHECKS: tp.Dict[
+    str, tp.Callable[[str, bool], tp.Callable[[_PullRequest], bool]]
+] = {
+    'author': lambda login, negate: lambda pr: (pr.author == login) != negate,
+    'review-requested': lambda login, negate: lambda pr: (
+        login in pr.requested
+    ) != negate,
+    'reviewed-by': lambda login, negate: lambda pr: any(
+        review.author == login for review in pr.reviews
+    ) != negate,
+}
+
+
+def _updated_check(
+        sign: str, date_from: str, date_to: tp.Optional[str],
+) -> tp.Callable[[_PullRequest], bool]:
+    begin = dt.date.fromisoformat(date_from)
+    if date_to:
+        end = dt.date.fromisoformat(date_to)
+        return lambda pr: begin <= pr.updated_at.date() <= end
+    if sign == '>':
+        return lambda pr: pr.updated_at.date() > begin
+    if sign == '<':
+        return lambda pr: pr.updated_at.date() < begin
+    return lambda pr: pr.updated_at.date() == begin
+
+
+# a rough take on the github formula: a point per 100 requested nodes
+def _get_cost(query: str) -> int:
+    limits = re.findall(r'(?:first|last):(\d+)', query)
+    return max(1, sum(int(limit) for limit in limits) // 100)
+
+
+class _Server:
+    def __init__(self, github: FakeGithub, args: argparse.Namespace):
+        self._github = github
+        self._args = args
+        self._rnd = random.Random(args.seed)
+        # token -> (window start, points spent)
+        self._budgets: tp.Dict[str, tp.Tuple[float, int]] = {}
+        self.stats: tp.Dict[str, int] = collections.Counter()
+
+    def _spend(self, token: str, cost: int) -> tp.Tuple[bool, int, int]:
+        now = time.time()
+        window_start, spent = self._budgets.get(token, (now, 0))
+        if now - window_start >= self._args.rate_window:
+            window_start, spent = now, 0
+        allowed = spent + cost <= self._args.rate_limit
+        if allowed:
+            spent += cost
+        self._budgets[token] = (window_start, spent)
+        reset_at = int(window_start + self._args.rate_window)
+        return allowed, self._args.rate_limit - spent, reset_at
+
+    def _resolve(self, query: str) -> tp.Optional[dict]:
+        match = _SEARCH.search(query)
+        if match:
+            self.stats['search'] += 1
+            first = _FIRST.search(match.group(2))
+            last = _LAST.search(match.group(2))
+            return {
+                'search': {
+                    'edges': self._github.search(
+                        match.group(1),
+                        int(first.group(1)) if first else 0,
+                        int(last.group(1)) if last else 0,
+                    ),
+                },
+            }
+
+        match = _REPOSITORY.search(query)
+        if not match:
+            return None
+        owner, repo = match.groups()
+
+        number = _PULL_REQUEST.search(query)
+        if number:
+            self.stats['timeline'] += 1
+            return {
+                'repository': {
+                    'pullRequest': self._github.timeline(
+                        owner, repo, int(number.group(1)),
+                    ),
+                },
+            }
+
+        params = _PULL_REQUESTS.search(query)
+        if params:
+            self.stats['pull_requests'] += 1
+            args = params.group(1)
+            state = _STATES.search(args)
+            after = _AFTER.search(args)
+            first = _FIRST.search(args)
+            last = _LAST.search(args)
+            return {
+                'repository': {
+                    'pullRequests': {
+                        'edges': self._github.pull_requests(
+                            owner,
+                            repo,
+                            state.group(1) if state else 'OPEN',
+                            after.group(1) if after else None,
+                            int(first.group(1)) if first else 0,
+                            int(last.group(1)) if last else 0,
+                        ),
+                    },
+                },
+            }
+        return None
+
+    async def handle_graphql(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        args = self._args
+        delay = args.latency_ms + self._rnd.uniform(0, args.jitter_ms)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        if self._rnd.random() < args.error_rate:
+            self.stats['injected_errors'] += 1
+            if self._rnd.random() < 0.5:
+                return web.Response(status=502, text='Bad Gateway')
+            return web.json_response(
+                {'errors': [{'message': 'Something went wrong (injected)'}]},
+            )
+
+        query = (await request.json())['query']
+        cost = _get_cost(query)
+        token = request.headers.get('Authorization', '')
+        allowed, remaining, reset_at = self._spend(token, cost)
+        headers = {
+            'X-RateLimit-Limit': str(args.rate_limit),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': str(reset_at),
+            'X-RateLimit-Used': str(args.rate_limit - remaining),
+        }
+        if not allowed:
+            self.stats['rate_limited'] += 1
+            return web.json_response(
+                {
+                    'errors': [
+                        {
+                            'type': 'RATE_LIMITED',
+                            'message': 'API rate limit exceeded',
+                        },
+                    ],
+                },
+                headers=headers,
+            )
+        self.stats['cost'] += cost
+
+        data = self._resolve(query)
+        if data is None:
+            self.stats['unknown_queries'] += 1
+            return web.json_response(
+                {'errors': [{'message': f'unsupported query: {query[:200]}'}]},
+                status=400,
+            )
+        return web.json_response({'data': data}, headers=headers)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='fake github graphql api')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--seed', type=int, default=41)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--prs-per-repo', type=int, default=2000)
+    # load/repo-N in addition to common.REPOS, loop_stats visits
+    # only the repos listed there
+    parser.add_argument('--extra-repos', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=5000)  # points
+    parser.add_argument('--rate-window', type=float, default=3600.0)  # secs
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    repos = [
+        (owner, repo)
+        for owner, owner_repos in common.REPOS.items()
+        for repo in owner_repos
+    ] + [('load', f'repo-{index}') for index in range(args.extra_repos)]
+    github = FakeGithub(
+        args.seed,
+        repos,
+        args.prs_per_repo,
+        args.users,
+        dt.datetime.utcnow().replace(microsecond=0),
+    )
+    print(
+        f'{len(github.prs)} prs in {len(repos)} repos, {len(github.users)}'
+        f' users, serving http://{args.host}:{args.port}/graphql',
+    )
+
+    server = _Server(github, args)
+    app = web.Application()
+    app.router.add_post('/graphql', server.handle_graphql)
+    app.router.add_get('/stats', server.handle_stats)
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
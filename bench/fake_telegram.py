@@ -0,0 +1,301 @@
+# python3 -m bench.fake_telegram --port 8082 --chats 2000 --rate 50
+# then run the bot with TELEGRAM_API_ENDPOINT=http://127.0.0.1:8082/bot
+#
+# a stand-in for the telegram bot api (getUpdates, sendMessage with or
+# without reply_markup, editMessageText) with telegram-like 429 answers,
+# and a load generator: synthetic chats send commands through getUpdates,
+# the first bot message to the chat after it ends the command latency
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import statistics as stat
+import time
+import typing as tp
+
+import asyncpg
+from aiohttp import web
+
+import storage
+
+_CHAT_ID_BASE = 200000
+
+# (kind, message text or callback data)
+_COMMANDS = [
+    ('get_stats', '/get_stats'),
+    ('week', 'week_0'),
+    ('week', 'week_1'),
+    ('what_can_i_review', '/what_can_i_review'),
+]
+
+
+def get_login(index: int) -> str:
+    return f'user{index:04d}'  # the same as in bench/fake_github.py
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    # seconds to wait if there is no token now
+    def take(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._rate,
+        )
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+
+class FakeTelegram:
+    def __init__(self, args: argparse.Namespace):
+        self._args = args
+        self._updates: tp.List[dict] = []
+        self._condition: tp.Optional[asyncio.Condition] = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._global = _Bucket(args.global_rate, args.global_rate)
+        self._chats: tp.Dict[int, _Bucket] = {}
+        # chat_id -> (kind, enqueued at)
+        self._pending: tp.Dict[int, tp.Tuple[str, float]] = {}
+        self.latencies: tp.Dict[str, tp.List[float]] = (
+            collections.defaultdict(list)
+        )
+        self.stats: tp.Dict[str, int] = collections.Counter()
+
+    # created in the loop of the server
+    @property
+    def _new_update(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _chat(self, index: int) -> dict:
+        return {
+            'id': _CHAT_ID_BASE + index,
+            'username': f'tg_{get_login(index)}',
+            'type': 'private',
+        }
+
+    async def push_command(self, index: int, kind: str, text: str) -> None:
+        chat = self._chat(index)
+        message = {
+            'message_id': next(self._message_ids),
+            'from': {
+                'id': chat['id'],
+                'is_bot': False,
+                'username': chat['username'],
+            },
+            'chat': chat,
+            'date': int(time.time()),
+        }
+        update: dict = {'update_id': next(self._update_ids)}
+        if text.startswith('/'):
+            update['message'] = {**message, 'text': text}
+        else:
+            update['callback_query'] = {
+                'id': str(update['update_id']),
+                'from': message['from'],
+                'message': {**message, 'text': 'Choose'},
+                'data': text,
+            }
+        self._pending[chat['id']] = (kind, time.monotonic())
+        self.stats['commands'] += 1
+        async with self._new_update:
+            self._updates.append(update)
+            self._new_update.notify_all()
+
+    def is_pending(self, index: int) -> bool:
+        return _CHAT_ID_BASE + index in self._pending
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters) -> web.Response:
+        body: dict = {
+            'ok': False, 'error_code': code, 'description': description,
+        }
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=code)
+
+    async def _get_updates(self, params: dict) -> web.Response:
+        offset = int(params.get('offset') or 0)
+        timeout = min(float(params.get('timeout') or 0), self._args.max_poll)
+        # the updates before the offset are confirmed
+        self._updates = [
+            update for update in self._updates if update['update_id'] >= offset
+        ]
+        async with self._new_update:
+            if not self._updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_update.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        self.stats['get_updates'] += 1
+        return web.json_response({'ok': True, 'result': self._updates[:100]})
+
+    async def _send(self, method: str, params: dict) -> web.Response:
+        chat_id = int(params.get('chat_id') or 0)
+        if not params.get('text'):
+            return self._error(400, 'Bad Request: message text is empty')
+        if len(params['text']) > 4096:
+            return self._error(400, 'Bad Request: message is too long')
+        if 'reply_markup' in params:
+            json.loads(params['reply_markup'])  # 400 if broken, like telegram
+
+        bucket = self._chats.setdefault(
+            chat_id, _Bucket(self._args.chat_rate, self._args.chat_burst),
+        )
+        retry_after = max(self._global.take(), bucket.take())
+        if retry_after:
+            self.stats['429'] += 1
+            seconds = max(1, int(retry_after + 0.999))
+            return self._error(
+                429,
+                f'Too Many Requests: retry after {seconds}',
+                retry_after=seconds,
+            )
+
+        self.stats[method] += 1
+        pending = self._pending.pop(chat_id, None)
+        if pending is not None:
+            kind, enqueued_at = pending
+            self.latencies[kind].append(time.monotonic() - enqueued_at)
+        return web.json_response(
+            {
+                'ok': True,
+                'result': {
+                    'message_id': next(self._message_ids),
+                    'chat': {'id': chat_id},
+                    'date': int(time.time()),
+                    'text': params['text'],
+                },
+            },
+        )
+
+    async def handle(self, request: web.Request) -> web.Response:
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        method = request.match_info['method']
+        if self._args.latency_ms:
+            await asyncio.sleep(self._args.latency_ms / 1000)
+
+        try:
+            if method == 'getUpdates':
+                return await self._get_updates(params)
+            if method in ('sendMessage', 'editMessageText'):
+                return await self._send(method, params)
+        except (ValueError, TypeError):
+            return self._error(400, 'Bad Request: wrong parameters')
+        return self._error(404, 'Not Found: method not found')
+
+    def report(self) -> dict:
+        now = time.monotonic()
+        result: dict = {'counters': dict(self.stats), 'latency': {}}
+        for kind, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            result['latency'][kind] = {
+                'count': len(ordered),
+                'p50': stat.median(ordered),
+                # nearest rank, never above the max on a few samples
+                'p99': ordered[int(0.99 * (len(ordered) - 1))],
+                'max': ordered[-1],
+            }
+        result['counters']['lost'] = sum(
+            1
+            for _, enqueued_at in self._pending.values()
+            if now - enqueued_at > self._args.command_timeout
+        )
+        return result
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.report())
+
+
+async def _generate_load(telegram: FakeTelegram, args: argparse.Namespace):
+    rnd = random.Random(args.seed)
+    started = time.monotonic()
+    while time.monotonic() - started < args.duration:
+        await asyncio.sleep(rnd.expovariate(args.rate))
+        index = rnd.randrange(args.chats)
+        # one command at a time per chat, the answers are matched by chat
+        if telegram.is_pending(index):
+            telegram.stats['skipped_busy_chat'] += 1
+            continue
+        kind, text = rnd.choice(_COMMANDS)
+        await telegram.push_command(index, kind, text)
+
+    await asyncio.sleep(args.command_timeout)
+    print(json.dumps(telegram.report(), indent=2))
+
+
+# registers the chats in the bot database, a dedicated one
+async def _seed_users(dsn: str, chats: int) -> None:
+    conn = await asyncpg.connect(dsn)
+    try:
+        for index in range(chats):
+            await storage.save_user_mappings(
+                get_login(index),
+                f'tg_{get_login(index)}',
+                str(_CHAT_ID_BASE + index),
+                conn,
+            )
+    finally:
+        await conn.close()
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='fake telegram bot api')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--max-poll', type=float, default=30.0)  # secs
+    # the documented limits: ~30 messages/s overall, ~1/s per chat
+    parser.add_argument('--global-rate', type=float, default=30.0)
+    parser.add_argument('--chat-rate', type=float, default=1.0)
+    parser.add_argument('--chat-burst', type=float, default=3.0)
+    # the load, 0 chats for the api only
+    parser.add_argument('--chats', type=int, default=0)
+    parser.add_argument('--rate', type=float, default=10.0)  # commands/s
+    parser.add_argument('--duration', type=float, default=60.0)  # secs
+    parser.add_argument('--command-timeout', type=float, default=30.0)
+    parser.add_argument('--seed-dsn', default=None)
+    args = parser.parse_args()
+    if args.seed_dsn and 'bench' not in args.seed_dsn:
+        parser.error('--seed-dsn of a dedicated database with "bench" in it')
+    return args
+
+
+def main() -> None:
+    args = _parse_args()
+    if args.seed_dsn and args.chats:
+        asyncio.run(_seed_users(args.seed_dsn, args.chats))
+
+    telegram = FakeTelegram(args)
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', telegram.handle)
+    app.router.add_get('/stats', telegram.handle_stats)
+
+    async def _start_load(app: web.Application) -> None:
+        if args.chats:
+            app['load'] = asyncio.ensure_future(_generate_load(telegram, args))
+
+    app.on_startup.append(_start_load)
+    print(f'serving http://{args.host}:{args.port}/bot<token>/<method>')
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import json
+import pathlib
+import re
+import typing as tp
+
+import graphql
+import staff
+import telegram
+
+_FIXTURES = pathlib.Path(__file__).parent / 'fixtures'
+
+_PR_NUMBER = re.compile(r'pullRequest\(number:(\d+)\)')
+
+
+def load_fixture(name: str) -> tp.Any:
+    with open(_FIXTURES / name) as fixture:
+        return json.load(fixture)
+
+
+class FakeResponse:
+    def __init__(self, payload: tp.Any, status: int = 200):
+        self.status = status
+        self._payload = payload
+
+    async def json(self) -> tp.Any:
+        return self._payload
+
+    async def text(self) -> str:
+        return (
+            self._payload
+            if isinstance(self._payload, str)
+            else json.dumps(self._payload)
+        )
+
+
+# answers the requests of github/telegram/staff.py with the fixtures,
+# the way ctx.session (aiohttp.ClientSession) is used by them
+class FakeSession:
+    def __init__(self):
+        self._timelines = {
+            timeline['number']: timeline
+            for timeline in load_fixture('timelines.json')
+        }
+        self._search = load_fixture('search.json')
+        self._pr_numbers = load_fixture('pr_numbers.json')
+        self.updates = load_fixture('updates.json')
+        self._staff = load_fixture('staff.json')
+        self.sent: tp.List[tp.Dict] = []
+        self.requests = 0
+
+    def _graphql(self, query: str) -> tp.Any:
+        match = _PR_NUMBER.search(query)
+        if match:
+            timeline = self._timelines[int(match.group(1))]
+            return {
+                'data': {
+                    'repository': {
+                        'pullRequest': {
+                            'author': {'login': timeline['author']},
+                            'timelineItems': {'nodes': timeline['nodes']},
+                        },
+                    },
+                },
+            }
+        if 'pullRequests(' in query:
+            return self._pr_numbers
+        if 'search(' in query:
+            return self._search
+        raise ValueError(f'no fixture for the query {query[:100]}')
+
+    async def post(self, url: str, **kwargs) -> FakeResponse:
+        self.requests += 1
+        if url == graphql.ENDPOINT:
+            return FakeResponse(self._graphql(kwargs['json']['query']))
+        if url.startswith(telegram.ENDPOINT):
+            method = url.rsplit('/', 1)[-1]
+            if method == 'getUpdates':
+                return FakeResponse(self.updates)
+            self.sent.append(kwargs.get('params') or kwargs.get('json') or {})
+            return FakeResponse(
+                {'ok': True, 'result': {'message_id': len(self.sent)}},
+            )
+        raise ValueError(f'unexpected POST {url}')
+
+    async def get(self, url: str, **kwargs) -> FakeResponse:
+        self.requests += 1
+        if url.startswith(staff._GAP_API_PREFIX):
+            return FakeResponse(self._staff['gaps'])
+        if url.startswith(staff._STAFF_API_PREFIX):
+            return FakeResponse(self._staff['persons'])
+        raise ValueError(f'unexpected GET {url}')
@@ -2,6 +2,7 @@ import datetime as dt
 import typing as tp
 
 import storage
+import tracing
 
 # TODO deal with timezone
 # 11 am in Moscow
@@ -40,6 +41,7 @@ def _is_holiday(tim: dt.datetime) -> bool:
     ) or tim.date() in _HOLIDAYS
 
 
+@tracing.traced
 async def is_working_day(
         input_time: dt.datetime, staff_login: str, ctx,
 ) -> bool:
@@ -47,7 +49,8 @@ async def is_working_day(
         return False
 
     utc = input_time.astimezone(dt.timezone.utc).replace(tzinfo=None)
-    gaps = await storage.get_gaps(staff_login, ctx.conn)
+    async with ctx.pool.acquire() as conn:
+        gaps = await storage.get_gaps(staff_login, conn)
     for (begin, end) in gaps:
         if begin <= utc <= end:
             return False
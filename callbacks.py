@@ -4,10 +4,13 @@ import typing as tp
 
 import calendarm
 import github
+import pages
+import result_cache
 import staff
 import stats
 import storage
 import telegram
+import tracing
 import user_settings
 
 
@@ -62,17 +65,8 @@ async def _show_subordinated_stats(
 ) -> None:
     date_from, date_to = _get_period(num_weeks_ago)
 
-    subs_both = await storage.get_subordinated(staff_login, conn)
-    if not subs_both:
-        await telegram.send_message(telegram.no_stats_message(), chat_id, ctx)
-        return
-    subs = subs_both[0 if is_nearest else 1]
-    if not subs:
-        await telegram.send_message(telegram.no_stats_message(), chat_id, ctx)
-        return
-
     stats_dict: dict = await stats.get_subordinated_stats_to_show(
-        subs, date_from, date_to, ctx,
+        staff_login, is_nearest, date_from, date_to, conn,
     )
     if not stats_dict:
         await telegram.send_message(telegram.no_stats_message(), chat_id, ctx)
@@ -109,21 +103,34 @@ async def _show_reviewed(
 ) -> None:
     date_from, date_to = _get_period(num_weeks_ago)
 
-    prs = await github.get_reviewed_prs(
-        staff_login, date_from, date_to, None, ctx,
-    )
-    await telegram.send_message(
-        await telegram.show_reviewed_message(prs, staff_login, ctx),
-        chat_id,
+    prs = await result_cache.get_pull_requests(
+        'reviewed',
+        staff_login,
+        (num_weeks_ago,),
+        lambda: github.get_reviewed_prs(
+            staff_login, date_from, date_to, None, ctx,
+        ),
         ctx,
     )
+    if not prs:
+        await telegram.send_message(
+            telegram.no_reviewed_message(), chat_id, ctx,
+        )
+        return
+    await pages.send_pr_list(telegram.REVIEWED_HEADER, prs, chat_id, ctx)
 
 
 async def _show_want_review(
         staff_login: str, action_value: int, chat_id: str, ctx, conn,
 ) -> None:
     authors = await staff.get_fellow_authors(staff_login, action_value, ctx)
-    prs = await github.get_open_prs(authors, staff_login, ctx)
+    prs = await result_cache.get_pull_requests(
+        'want_review',
+        staff_login,
+        (action_value,),
+        lambda: github.get_open_prs(authors, staff_login, ctx),
+        ctx,
+    )
     settings = await storage.get_reviewer_settings(staff_login, conn)
 
     if not settings:
@@ -131,12 +138,10 @@ async def _show_want_review(
     elif not settings['wip']:
         prs = [pr for pr in prs if not pr.is_wip]
 
-    msg = (
-        await telegram.want_review_message(prs, ctx)
-        if prs
-        else 'Nothing to review here'
-    )
-    await telegram.send_message(msg, chat_id, ctx)
+    if not prs:
+        await telegram.send_message('Nothing to review here', chat_id, ctx)
+        return
+    await pages.send_pr_list(telegram.WANT_REVIEW_HEADER, prs, chat_id, ctx)
 
 
 async def _myprs(
@@ -176,30 +181,37 @@ async def invoke_callback(
         chat_id: str,
         ctx,
 ) -> None:
-    async with ctx.pool.acquire() as conn:
-        if action_name == 'week':
-            await _show_stats(staff_login, action_value, chat_id, ctx)
-        elif action_name == 'reviewed':
-            await _show_reviewed(staff_login, action_value, chat_id, ctx)
-        elif action_name == 'stats_sub_nearest':
-            await _show_subordinated_stats(
-                staff_login, True, action_value, chat_id, ctx, conn,
-            )
-        elif action_name == 'stats_sub_all':
-            await _show_subordinated_stats(
-                staff_login, False, action_value, chat_id, ctx, conn,
-            )
-        elif action_name == 'notify':
-            await set_notifications(staff_login, action_value, chat_id, ctx)
-        elif action_name == 'want_review':
-            await _show_want_review(
-                staff_login, action_value, chat_id, ctx, conn,
-            )
-        elif action_name == 'myprs':
-            await _myprs(staff_login, action_value, chat_id, ctx, conn)
-        elif action_name == 'wipprs':
-            await _wipprs(staff_login, action_value, chat_id, ctx, conn)
-        elif action_name == 'startrek':
-            await _startrek(staff_login, action_value, chat_id, ctx, conn)
-        else:
-            raise Exception(f'unsupported action_name: {action_name}')
+    with tracing.span(f'callback {action_name}', value=action_value):
+        async with ctx.pool.acquire() as conn:
+            if action_name == 'week':
+                await _show_stats(staff_login, action_value, chat_id, ctx)
+            elif action_name == 'reviewed':
+                await _show_reviewed(staff_login, action_value, chat_id, ctx)
+            elif action_name == 'stats_sub_nearest':
+                await _show_subordinated_stats(
+                    staff_login, True, action_value, chat_id, ctx, conn,
+                )
+            elif action_name == 'stats_sub_all':
+                await _show_subordinated_stats(
+                    staff_login, False, action_value, chat_id, ctx, conn,
+                )
+            elif action_name == 'notify':
+                await set_notifications(
+                    staff_login, action_value, chat_id, ctx,
+                )
+            elif action_name == 'want_review':
+                await _show_want_review(
+                    staff_login, action_value, chat_id, ctx, conn,
+                )
+            elif action_name == 'myprs':
+                await _myprs(staff_login, action_value, chat_id, ctx, conn)
+            elif action_name == 'wipprs':
+                await _wipprs(staff_login, action_value, chat_id, ctx, conn)
+            elif action_name == 'startrek':
+                await _startrek(staff_login, action_value, chat_id, ctx, conn)
+            elif action_name == 'page_next':
+                await pages.turn_page(action_value, 1, chat_id, ctx)
+            elif action_name == 'page_prev':
+                await pages.turn_page(action_value, -1, chat_id, ctx)
+            else:
+                raise Exception(f'unsupported action_name: {action_name}')
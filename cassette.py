@@ -0,0 +1,218 @@
+# records the outbound http of the bot into gzipped jsonl cassettes, one
+# per service (see metrics.register_service), and serves them back offline:
+# CASSETTE_MODE=record|replay CASSETTE_DIR=... python3 main.py
+import asyncio
+import collections
+import gzip
+import json
+import logging
+import pathlib
+import time
+import typing as tp
+
+import aiohttp
+
+import metrics
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+_SCRUBBED = '<scrubbed>'
+_SUFFIX = '.jsonl.gz'
+
+logger = logging.getLogger()
+
+
+class CassetteError(Exception):
+    pass
+
+
+# the part of aiohttp.ClientResponse used by the bot
+class CassetteResponse:
+    def __init__(self, status: int, headers: tp.Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self) -> str:
+        return self._body.decode('utf-8')
+
+    async def json(self) -> tp.Any:
+        return json.loads(self._body)
+
+
+def _scrub(text: str, secrets: tp.Sequence[str]) -> str:
+    for secret in secrets:
+        text = text.replace(secret, _SCRUBBED)
+    return text
+
+
+class CassetteSession:
+    def __init__(
+            self,
+            session: tp.Optional[aiohttp.ClientSession],
+            mode: str,
+            directory: str,
+            secrets: tp.Sequence[str],
+            time_scale: float = 1.0,
+    ):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f'unknown cassette mode {mode}')
+        self._session = session
+        self._mode = mode
+        self._directory = pathlib.Path(directory)
+        self._secrets = tuple(secret for secret in secrets if secret)
+        self._time_scale = time_scale
+        self._started = time.monotonic()
+        self._files: tp.Dict[str, tp.TextIO] = {}
+        # the same request is answered in the recorded order, the requests
+        # with the current time in them are matched by the url only
+        self._exact: tp.Dict[str, tp.Deque[dict]] = (
+            collections.defaultdict(collections.deque)
+        )
+        self._loose: tp.Dict[str, tp.Deque[dict]] = (
+            collections.defaultdict(collections.deque)
+        )
+        if mode == REPLAY:
+            self._load()
+
+    def _get_request(
+            self, method: str, url: str, kwargs: dict,
+    ) -> tp.Dict[str, tp.Any]:
+        params = kwargs.get('params') or {}
+        return {
+            'method': method,
+            'url': _scrub(url, self._secrets),
+            'params': {
+                key: _scrub(str(value), self._secrets)
+                for key, value in sorted(params.items())
+            },
+            'json': json.loads(
+                _scrub(json.dumps(kwargs.get('json')), self._secrets),
+            ),
+        }
+
+    @staticmethod
+    def _exact_key(request: tp.Dict[str, tp.Any]) -> str:
+        return json.dumps(
+            [
+                request['method'],
+                request['url'],
+                request['params'],
+                request['json'],
+            ],
+            sort_keys=True,
+        )
+
+    @staticmethod
+    def _loose_key(request: tp.Dict[str, tp.Any]) -> str:
+        return f'{request["method"]} {request["url"]}'
+
+    def _load(self) -> None:
+        paths = sorted(self._directory.glob(f'*{_SUFFIX}'))
+        if not paths:
+            raise CassetteError(f'no cassettes in {self._directory}')
+        interactions: tp.List[dict] = []
+        for path in paths:
+            with gzip.open(path, 'rt', encoding='utf-8') as cassette:
+                interactions.extend(json.loads(line) for line in cassette)
+        # the order of the recording across the services
+        interactions.sort(key=lambda interaction: interaction['started'])
+        for interaction in interactions:
+            interaction['used'] = False
+            request = interaction['request']
+            self._exact[self._exact_key(request)].append(interaction)
+            self._loose[self._loose_key(request)].append(interaction)
+        logger.info(
+            'loaded %s interactions from %s',
+            len(interactions),
+            self._directory,
+        )
+
+    @staticmethod
+    def _pop(queue: tp.Deque[dict]) -> tp.Optional[dict]:
+        while queue and queue[0]['used']:
+            queue.popleft()
+        if not queue:
+            return None
+        interaction = queue.popleft()
+        interaction['used'] = True
+        return interaction
+
+    async def _replay(self, request: tp.Dict[str, tp.Any]) -> CassetteResponse:
+        interaction = self._pop(self._exact[self._exact_key(request)])
+        if interaction is None:
+            interaction = self._pop(self._loose[self._loose_key(request)])
+        if interaction is None:
+            raise CassetteError(
+                f'no recorded {request["method"]} {request["url"]} left',
+            )
+        if self._time_scale:
+            await asyncio.sleep(interaction['duration'] * self._time_scale)
+        response = interaction['response']
+        return CassetteResponse(
+            response['status'],
+            response['headers'],
+            response['body'].encode('utf-8'),
+        )
+
+    def _write(self, service: str, interaction: tp.Dict[str, tp.Any]) -> None:
+        cassette = self._files.get(service)
+        if cassette is None:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            # a fast level, the event loop compresses
+            cassette = gzip.open(
+                self._directory / f'{service}{_SUFFIX}',
+                'wt',
+                encoding='utf-8',
+                compresslevel=5,
+            )
+            self._files[service] = cassette
+        cassette.write(json.dumps(interaction, ensure_ascii=False))
+        cassette.write('\n')
+
+    async def _request(self, method: str, url: str, **kwargs) -> tp.Any:
+        request = self._get_request(method, url, kwargs)
+        if self._mode == REPLAY:
+            return await self._replay(request)
+
+        started = time.monotonic()
+        response = await self._session.request(method, url, **kwargs)
+        body = await response.read()  # cached, .json() and .text() work
+        self._write(
+            metrics.get_service(url),
+            {
+                'request': request,
+                'response': {
+                    'status': response.status,
+                    'headers': {
+                        key: _scrub(value, self._secrets)
+                        for key, value in response.headers.items()
+                    },
+                    'body': _scrub(
+                        body.decode('utf-8', errors='replace'), self._secrets,
+                    ),
+                },
+                'started': started - self._started,
+                'duration': time.monotonic() - started,
+            },
+        )
+        return response
+
+    async def get(self, url: str, **kwargs) -> tp.Any:
+        return await self._request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> tp.Any:
+        return await self._request('POST', url, **kwargs)
+
+    # flushes the recorded cassettes, gzip needs its trailer
+    def close_cassettes(self) -> None:
+        for cassette in self._files.values():
+            cassette.close()
+        self._files.clear()
+
+    def __getattr__(self, name: str):
+        return getattr(self._session, name)
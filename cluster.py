@@ -0,0 +1,116 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import socket
+import typing as tp
+import uuid
+
+import asyncpg
+
+import storage
+
+
+logger = logging.getLogger()
+
+# any constant shared by all the instances
+_LEADER_LOCK_ID = 0x7265766965777300  # 'reviews\0'
+
+
+def _weight(instance_id: str, key: str) -> bytes:
+    return hashlib.md5(f'{instance_id}/{key}'.encode()).digest()
+
+
+class Cluster:
+    def __init__(self, pg_dsn: dict, config):
+        self.instance_id = (
+            f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        )
+        self.is_leader = False
+        self.instances: tp.List[str] = [self.instance_id]
+        self._pg_dsn = pg_dsn
+        self._config = config
+        # the advisory lock lives as long as this session
+        self._lock_conn: tp.Optional[asyncpg.Connection] = None
+
+    async def _update_leadership(self) -> None:
+        try:
+            if self._lock_conn is None or self._lock_conn.is_closed():
+                self.is_leader = False
+                self._lock_conn = await asyncpg.connect(**self._pg_dsn)
+
+            if self.is_leader:
+                await self._lock_conn.fetchval('SELECT 1;')
+            else:
+                self.is_leader = await self._lock_conn.fetchval(
+                    'SELECT pg_try_advisory_lock($1);', _LEADER_LOCK_ID,
+                )
+                if self.is_leader:
+                    logger.warning(f'{self.instance_id} became the leader')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f'{self.instance_id} lost the leader lock')
+            self.is_leader = False
+            if self._lock_conn is not None:
+                self._lock_conn.terminate()
+            self._lock_conn = None
+
+    # a scheduler job, call it once before the others start
+    async def heartbeat(self, ctx) -> None:
+        await self._update_leadership()
+
+        async with ctx.pool.acquire() as conn:
+            await storage.save_heartbeat(self.instance_id, conn)
+            instances = await storage.get_live_instances(
+                self._config.cluster_instance_ttl, conn,
+            )
+
+        if self.instance_id not in instances:
+            instances.append(self.instance_id)
+        instances.sort()
+        if instances != self.instances:
+            logger.warning(f'cluster instances: {instances}')
+        self.instances = instances
+
+    # rendezvous hashing, a dead instance moves only its own keys; among
+    # the given instances, e.g. a snapshot taken before a run, or the live
+    # ones
+    def owns(
+            self, key: str, instances: tp.Optional[tp.List[str]] = None,
+    ) -> bool:
+        if instances is None:
+            instances = self.instances
+        if len(instances) == 1:
+            return instances[0] == self.instance_id
+        owner = max(instances, key=lambda instance: _weight(instance, key))
+        return owner == self.instance_id
+
+    async def leave(self, ctx) -> None:
+        async with ctx.pool.acquire() as conn:
+            await storage.delete_heartbeat(self.instance_id, conn)
+        if self._lock_conn is not None:
+            await self._lock_conn.close()
+        self._lock_conn = None
+        self.is_leader = False
+
+
+# runs the job on the leader only, the others skip their slots;
+# sleep_if_skipped is for back-to-back jobs not to spin on followers
+def singleton(
+        func: tp.Callable[[tp.Any], tp.Awaitable[None]],
+        sleep_if_skipped: bool = False,
+) -> tp.Callable[[tp.Any], tp.Awaitable[None]]:
+    @functools.wraps(func)
+    async def wrapper(ctx) -> None:
+        if not ctx.cluster.is_leader:
+            logger.debug(f'not a leader, skip {func.__name__}')
+            if sleep_if_skipped:
+                await asyncio.sleep(
+                    ctx.config.cluster_heartbeat.total_seconds(),
+                )
+            return
+        await func(ctx)
+
+    return wrapper
@@ -1,4 +1,5 @@
 import datetime as dt
+import os
 
 
 class Config:
@@ -9,3 +10,92 @@ class Config:
         self.process_gaps_delta = dt.timedelta(hours=6)
         self.process_subordinated_delta = dt.timedelta(days=1)
         self.process_logins_delta = dt.timedelta(days=1)
+        # monday, local time
+        self.notify_startrek_cron = {'weekday': 0, 'hour': 10, 'minute': 45}
+        # local time, DETACH blocks the stats queries for a moment
+        self.maintain_partitions_cron = {'hour': 4, 'minute': 30}
+
+        # scheduler.py
+        self.timezone = dt.timezone(dt.timedelta(hours=3), 'MSK')
+        self.scheduler_jitter = dt.timedelta(seconds=30)  # background jobs
+        self.scheduler_misfire_grace = dt.timedelta(minutes=5)
+        self.scheduler_retry_delay = dt.timedelta(seconds=5)
+        self.scheduler_retry_delay_max = dt.timedelta(minutes=5)
+
+        # cluster.py
+        self.cluster_heartbeat = dt.timedelta(seconds=15)
+        # an instance without heartbeats is dead, its users move to others
+        self.cluster_instance_ttl = dt.timedelta(seconds=60)
+
+        # loop_notify.py
+        self.notify_concurrency = 8  # keep below the pg pool size
+        self.notify_prefetch = dt.timedelta(minutes=5)  # before the hour
+        # keep below notify_prefetch: the digests prepared early in the
+        # prefetch are refreshed at the hour, the last ones are sent as is
+        self.notify_digest_ttl = dt.timedelta(minutes=3)
+        # the unchanged digests are edited in place or skipped, sent anew
+        # after this as a reminder, None never
+        self.notify_repeat_after = dt.timedelta(days=1)
+
+        # loop_gaps.py
+        self.gaps_concurrency = 8
+        self.gaps_request_timeout = dt.timedelta(seconds=20)
+
+        # loop_partitions.py, review_stats months
+        self.stats_partitions_ahead = 3
+        # None keeps everything in review_stats
+        self.stats_retention = dt.timedelta(days=2 * 365)
+        # a month stays for the next night if the lock is not taken in time
+        self.stats_archive_lock_timeout = dt.timedelta(seconds=5)
+
+        # runtime_config.py, reviews.key_value is also watched by NOTIFY
+        self.runtime_config_ttl = dt.timedelta(minutes=5)
+
+        # result_cache.py, the github searches of the interactive commands
+        self.result_cache_ttl = dt.timedelta(minutes=2)
+        self.result_cache_max_entries = 1000
+
+        # pages.py, the long pr lists of the bot menu
+        self.message_page_size = 10  # prs, fewer if over 4096 characters
+        self.pages_ttl = dt.timedelta(hours=1)
+        self.pages_max_lists = 1000
+
+        # staff.py paginated requests
+        self.staff_concurrency = 4
+        # the persons missing in the daily org dump
+        self.chiefs_cache_ttl = dt.timedelta(days=1)
+
+        # review time outliers, minutes
+        self.min_review_minutes = 15
+        self.max_review_minutes = 5 * 9 * 60
+
+        # metrics.py, local scrapes only
+        self.metrics_host = '127.0.0.1'
+        self.metrics_port = 9108
+
+        # statements.py slow-query log, None to disable it
+        self.slow_query_threshold = dt.timedelta(milliseconds=500)
+        # EXPLAIN ANALYZE runs the statement again, at most once per interval
+        self.slow_query_explain_interval = dt.timedelta(minutes=10)
+        self.slow_query_explain_timeout = dt.timedelta(seconds=10)
+
+        # logs.py
+        self.log_file = '/tmp/server.log'
+        self.log_max_bytes = 100 * 1024 * 1024
+        self.log_backups = 5
+
+        # tracing.py
+        self.tracing_file = '/tmp/traces.jsonl'
+        self.tracing_max_bytes = 50 * 1024 * 1024
+        self.tracing_backups = 3
+
+        # cassette.py, record or replay the outbound http
+        self.cassette_mode = os.environ.get('CASSETTE_MODE')  # None is off
+        self.cassette_dir = os.environ.get('CASSETTE_DIR', '/tmp/cassettes')
+        # 0 replays without the recorded delays
+        self.cassette_time_scale = float(
+            os.environ.get('CASSETTE_TIME_SCALE', '1.0'),
+        )
+
+        # replay.py
+        self.replay_workers = 4
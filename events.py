@@ -1,92 +1,155 @@
+import array
 import datetime as dt
 import enum
 import typing as tp
 
 
-class EventType(enum.Enum):
-    REQUESTED = 'REQUESTED'
-    REVIEWED = 'REVIEWED'
-    REMOVED = 'REMOVED'
-    MERGED = 'MERGED'
-    CLOSED = 'CLOSED'
-    NONE = 'NONE'
+# the values are stored in reviews.pr_events, don't renumber
+class EventType(enum.IntEnum):
+    NONE = 0
+    REQUESTED = 1
+    REVIEWED = 2
+    REMOVED = 3
+    MERGED = 4
+    CLOSED = 5
 
 
-class Event:
-    __slots__ = ('_type', 'reviewer', 'event_at')
+# plain ints for the hot loops, enum attribute lookups are slow
+REQUESTED = int(EventType.REQUESTED)
+REVIEWED = int(EventType.REVIEWED)
+REMOVED = int(EventType.REMOVED)
+MERGED = int(EventType.MERGED)
+CLOSED = int(EventType.CLOSED)
 
-    _type: EventType
-    reviewer: tp.Optional[str]
-    event_at: dt.datetime
+_TYPENAMES: tp.Dict[str, int] = {
+    'ReviewRequestedEvent': REQUESTED,
+    'PullRequestReview': REVIEWED,
+    'ReviewRequestRemovedEvent': REMOVED,
+    'MergedEvent': MERGED,
+    'ClosedEvent': CLOSED,
+}
 
-    def __init__(self, event: tp.Dict[str, tp.Any], author: str):
-        self._type = self._get_type(event['__typename'])
-        if not self.is_ok:
-            return
+_EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
 
-        if self.is_reviewed:
-            self.reviewer = event['author']['login']
-        elif self.is_removed or (
-            self.is_requested
-            and event['actor']['login'] == author  # only author can remove?
-        ):
-            reviewer = event.get('requestedReviewer')
-            if not reviewer:
-                self._type = EventType.NONE
-                return
 
-            self.reviewer = reviewer['login']
-        else:
-            self.reviewer = None
+# github timestamps are always '%Y-%m-%dT%H:%M:%SZ', no need in strptime
+def parse_timestamp(value: str) -> int:
+    days = (
+        dt.date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal()
+        - _EPOCH_ORDINAL
+    )
+    return (
+        days * 86400
+        + int(value[11:13]) * 3600
+        + int(value[14:16]) * 60
+        + int(value[17:19])
+    )
 
-        last_at = event.get('submittedAt') or event.get('createdAt')
-        if not last_at:
-            self._type = EventType.NONE
-            return
 
-        self.event_at = dt.datetime.strptime(
-            last_at, '%Y-%m-%dT%H:%M:%SZ',
-        ).replace(tzinfo=dt.timezone.utc)
+def to_datetime(timestamp: int) -> dt.datetime:
+    return dt.datetime.fromtimestamp(timestamp, dt.timezone.utc)
+
+
+class EventBatch:
+    __slots__ = ('types', 'reviewers', 'timestamps', 'logins', '_login_ids')
+
+    types: array.array  # EventType values
+    reviewers: array.array  # index in logins, -1 for no reviewer
+    timestamps: array.array  # epoch seconds
+    logins: tp.List[str]
+    _login_ids: tp.Dict[str, int]
+
+    def __init__(self):
+        self.types = array.array('b')
+        self.reviewers = array.array('i')
+        self.timestamps = array.array('q')
+        self.logins = []
+        self._login_ids = {}
+
+    def __len__(self) -> int:
+        return len(self.types)
 
     def __repr__(self):
         return str(
-            {
-                'type': str(self._type),
-                'reviewer': self.reviewer if self.reviewer else 'None',
-                'event_at': self.event_at.isoformat(),
-            },
+            [
+                {
+                    'type': EventType(event_type).name,
+                    'reviewer': str(self.get_login(reviewer_id)),
+                    'event_at': to_datetime(timestamp).isoformat(),
+                }
+                for event_type, reviewer_id, timestamp in zip(
+                    self.types, self.reviewers, self.timestamps,
+                )
+            ],
         )
 
-    @staticmethod
-    def _get_type(event_type_str: str) -> EventType:
-        if event_type_str == 'ReviewRequestedEvent':
-            return EventType.REQUESTED
-        if event_type_str == 'PullRequestReview':
-            return EventType.REVIEWED
-        if event_type_str == 'ReviewRequestRemovedEvent':
-            return EventType.REMOVED
-        if event_type_str == 'MergedEvent':
-            return EventType.MERGED
-        if event_type_str == 'ClosedEvent':
-            return EventType.CLOSED
-        return EventType.NONE
-
-    @property
-    def is_ok(self) -> bool:
-        return self._type != EventType.NONE
-
-    @property
-    def is_requested(self) -> bool:
-        return self._type == EventType.REQUESTED
-
-    @property
-    def is_reviewed(self) -> bool:
-        return self._type == EventType.REVIEWED
-
-    @property
-    def is_removed(self) -> bool:
-        return self._type == EventType.REMOVED
-
-    @property
-    def is_terminal(self) -> bool:
-        return self._type == EventType.MERGED or self._type == EventType.CLOSED
+    @classmethod
+    def from_columns(
+            cls,
+            types: tp.Iterable[int],
+            reviewers: tp.Iterable[tp.Optional[str]],
+            event_ats: tp.Iterable[dt.datetime],
+    ) -> 'EventBatch':
+        result = cls()
+        for event_type, reviewer, event_at in zip(types, reviewers, event_ats):
+            result.append(event_type, reviewer, int(event_at.timestamp()))
+        return result
+
+    def append(
+            self, event_type: int, reviewer: tp.Optional[str], timestamp: int,
+    ) -> None:
+        reviewer_id = -1
+        if reviewer is not None:
+            reviewer_id = self._login_ids.get(reviewer, -1)
+            if reviewer_id < 0:
+                reviewer_id = len(self.logins)
+                self._login_ids[reviewer] = reviewer_id
+                self.logins.append(reviewer)
+
+        self.types.append(event_type)
+        self.reviewers.append(reviewer_id)
+        self.timestamps.append(timestamp)
+
+    def get_login(self, reviewer_id: int) -> tp.Optional[str]:
+        return self.logins[reviewer_id] if reviewer_id >= 0 else None
+
+    def get_reviewers(self) -> tp.List[tp.Optional[str]]:
+        return [self.get_login(reviewer_id) for reviewer_id in self.reviewers]
+
+    def get_event_ats(self) -> tp.List[dt.datetime]:
+        return [to_datetime(timestamp) for timestamp in self.timestamps]
+
+
+def parse_timeline(
+        nodes: tp.Iterable[tp.Dict[str, tp.Any]], author: str,
+) -> EventBatch:
+    result = EventBatch()
+    typenames = _TYPENAMES
+
+    for node in nodes:
+        event_type = typenames.get(node['__typename'])
+        if event_type is None:
+            continue
+
+        reviewer: tp.Optional[str] = None
+        if event_type == REVIEWED:
+            reviewer = (node.get('author') or {}).get('login')
+        elif event_type == REMOVED or (
+            event_type == REQUESTED
+            # only author can remove?
+            and (node.get('actor') or {}).get('login') == author
+        ):
+            requested = node.get('requestedReviewer')
+            if not requested:
+                continue
+            reviewer = requested['login']
+
+        last_at = node.get('submittedAt') or node.get('createdAt')
+        if not last_at:
+            continue
+
+        result.append(event_type, reviewer, parse_timestamp(last_at))
+        if event_type == MERGED or event_type == CLOSED:
+            break
+
+    return result
@@ -8,6 +8,7 @@ import common
 import graphql
 import queries
 import staff
+import tracing
 
 
 GITHUB_PREFIX = 'https://github.com'
@@ -161,6 +162,7 @@ async def get_new_pr_cursor(
     )
 
 
+@tracing.traced
 async def _get_search_results(
         query: dict,
         github_login: tp.Optional[str],
@@ -173,8 +175,6 @@ async def _get_search_results(
         return dt.datetime.strptime(timestring, '%Y-%m-%dT%H:%M:%SZ')
 
     response_json = await graphql.perform_request(query, ctx)
-    print(f'response_json = {response_json}')
-    # logger.info(f'{response_json}')
     edges = response_json['data']['search']['edges']
 
     result: tp.List[PullRequest] = []
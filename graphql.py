@@ -1,4 +1,12 @@
-ENDPOINT = 'https://api.github.com/graphql'
+import os
+
+import metrics
+
+# e.g. bench/fake_github.py for the load tests
+ENDPOINT = os.environ.get(
+    'GITHUB_GRAPHQL_ENDPOINT', 'https://api.github.com/graphql',
+)
+metrics.register_service('github', ENDPOINT)
 
 
 async def perform_request(graphql_query: dict, ctx) -> dict:
@@ -8,7 +16,4 @@ async def perform_request(graphql_query: dict, ctx) -> dict:
         json=graphql_query,
         headers={'Authorization': f'Bearer {ctx.github_token}'},
     )
-    response_json = await response.json()
-    print(f'response_code={response.status}')
-
-    return response_json
+    return await response.json()
@@ -0,0 +1,61 @@
+import copy
+import logging
+import logging.handlers
+import queue
+import typing as tp
+
+
+TSKV_FORMAT = (
+    'tskv'
+    '\ttimestamp=%(asctime)s'
+    '\tlevel=%(levelname)s'
+    '\tfile=%(filename)s'
+    '\tfunc=%(funcName)s'
+    '\tline=%(lineno)s'
+    '\ttext=%(message)s'
+)
+
+_FORMATTER = logging.Formatter()
+_listeners: tp.List[logging.handlers.QueueListener] = []
+
+
+class _ThreadQueueHandler(logging.handlers.QueueHandler):
+    # the args and the traceback may change before the listener thread gets
+    # to them, so the message is merged here; the line itself (TSKV_FORMAT)
+    # is still formatted and written in the thread
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# the returned handler only enqueues, the given one writes in a thread
+def queued(handler: logging.Handler) -> logging.Handler:
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        records, handler, respect_handler_level=True,
+    )
+    listener.start()
+    _listeners.append(listener)
+    return _ThreadQueueHandler(records)
+
+
+def setup(filename: str, max_bytes: int, backup_count: int, level: int) -> None:
+    handler = logging.handlers.RotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backup_count,
+    )
+    handler.setFormatter(logging.Formatter(TSKV_FORMAT))
+    root = logging.getLogger()
+    root.addHandler(queued(handler))
+    root.setLevel(level)
+
+
+# writes out what is still in the queues
+def stop() -> None:
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
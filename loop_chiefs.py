@@ -1,5 +1,7 @@
+import datetime as dt
 import logging
 
+import orgtree
 import staff
 import storage
 
@@ -7,23 +9,34 @@ logger = logging.getLogger()
 
 
 async def update_subordinated(ctx):
+    if not ctx.cluster.is_leader:
+        # the leader dumps the org, the others reload it from pg lazily
+        # once the dump version changes; orgtree.listen notices it at once,
+        # this is for a missed NOTIFY
+        if ctx.org_tree is not None:
+            async with ctx.pool.acquire() as conn:
+                version = await orgtree.get_version(conn)
+            if version != ctx.org_tree.version:
+                ctx.org_tree = None
+        return
+
+    logger.info('start update_subordinated')
+    chiefs = await staff.get_all_chiefs(ctx)
+    if not chiefs:
+        logger.error('empty staff dump, keep the current org tree')
+        return
+
+    version = dt.datetime.now(dt.timezone.utc).isoformat()
+    tree = orgtree.OrgTree(chiefs, version)
+    logger.info(f'org tree built, {len(tree)} persons')
+
     async with ctx.pool.acquire() as conn:
-        logger.info('start update_subordinated')
-        subjects_with_settings = await storage.get_reviewers_settings(conn)
-
-        for staff_login in subjects_with_settings.keys():
-            subordinated_n = await staff.get_subordinated_nearest(
-                staff_login, ctx,
-            )
-            if not subordinated_n:
-                continue
-
-            subordinated_a = await staff.get_subordinated_all(staff_login, ctx)
-            logger.info(
-                f'{staff_login} got {len(subordinated_n)} direct subordinates'
-                f' and {len(subordinated_a)} total subordinates',
-            )
-
-            await storage.set_subordinated(
-                staff_login, subordinated_n, subordinated_a, conn,
-            )
+        await storage.set_staff_chiefs(chiefs, version, conn)
+        # the dump covers them now
+        await storage.clear_chiefs_cache(
+            chiefs.keys(),
+            dt.datetime.now(dt.timezone.utc) - ctx.config.chiefs_cache_ttl,
+            conn,
+        )
+
+    ctx.org_tree = tree
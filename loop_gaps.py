@@ -1,16 +1,51 @@
+import asyncio
 import datetime as dt
+import hashlib
+import logging
+import typing as tp
 
 import staff
 import storage
 
 
+logger = logging.getLogger()
+
+
 async def update_gaps_info(ctx):
     async with ctx.pool.acquire() as conn:
         subjects_with_settings = await storage.get_reviewers_settings(conn)
+        old_hashes = await storage.get_gaps_hashes(conn)
+    subjects_with_settings = {
+        login: settings
+        for login, settings in subjects_with_settings.items()
+        if ctx.cluster.owns(login)
+    }
+
+    today = dt.date.today()
+    semaphore = asyncio.Semaphore(ctx.config.gaps_concurrency)
+    changed: tp.Dict[str, tp.Tuple[str, str]] = {}
+    failed: tp.List[str] = []
 
-        for staff_login in subjects_with_settings.keys():
-            today = dt.date.today()
+    async def _fetch(staff_login: str) -> None:
+        async with semaphore:
             gaps = await staff.get_absent_time(
                 staff_login, today, today + dt.timedelta(days=14), ctx,
             )
-            await storage.set_gaps(staff_login, gaps, conn)
+        if gaps is None:
+            failed.append(staff_login)
+            return
+
+        json_gaps = storage.gaps_to_json(gaps)
+        gaps_hash = hashlib.sha1(json_gaps.encode()).hexdigest()
+        if old_hashes.get(staff_login) != gaps_hash:
+            changed[staff_login] = (json_gaps, gaps_hash)
+
+    await asyncio.gather(*[_fetch(login) for login in subjects_with_settings])
+
+    if changed:
+        async with ctx.pool.acquire() as conn:
+            await storage.set_gaps(changed, conn)
+    logger.info(
+        f'gaps updated for {len(changed)} of {len(subjects_with_settings)}'
+        f' users, failed {failed}',
+    )
@@ -1,78 +1,363 @@
+import asyncio
+import collections
 import datetime as dt
+import hashlib
 import logging
+import statistics as stat
+import typing as tp
 
 import calendarm
 import github
+import metrics
 import storage
 import telegram
+import tracing
 
 
 logger = logging.getLogger()
 
+# the last process_notify run, seconds after the hour boundary
+last_run: tp.Dict[str, float] = {}
+
+
+class _Digest:
+    __slots__ = ('chat_id', 'message', 'fingerprint', 'prepared_at')
+
+    chat_id: tp.Optional[str]
+    message: tp.Optional[str]  # None if there is nothing to send
+    fingerprint: tp.Optional[str]
+    prepared_at: dt.datetime
+
+    def __init__(
+            self,
+            chat_id: tp.Optional[str],
+            message: tp.Optional[str],
+            fingerprint: tp.Optional[str] = None,
+    ):
+        self.chat_id = chat_id
+        self.message = message
+        self.fingerprint = fingerprint
+        self.prepared_at = dt.datetime.utcnow()
+
+
+# what the digest is about and not its wording ("last reviewed 2 days ago")
+def _get_fingerprint(
+        prs: tp.List[github.PullRequest],
+        prs_abandoned: tp.List[github.PullRequest],
+) -> str:
+    items = sorted(
+        f'{pr.get_short_slug()}'
+        f' {pr.last_review.commit if pr.last_review else ""}'
+        for pr in prs
+    )
+    items += sorted(f'abandoned {pr.get_short_slug()}' for pr in prs_abandoned)
+    return hashlib.sha1('\n'.join(items).encode()).hexdigest()
+
+
+def _get_text_hash(message: str) -> str:
+    return hashlib.sha1(message.encode()).hexdigest()
+
+
+_SEND = 'sent'
+_EDIT = 'edited'
+_SUPPRESS = 'suppressed'
+_BLOCKED = 'blocked'
+
+
+# a new message only if the prs changed (or for a reminder after
+# notify_repeat_after), the same prs with another wording edit the last one
+def _get_action(
+        digest: _Digest, previous: tp.Optional[tp.Dict], now: dt.datetime, ctx,
+) -> str:
+    if (
+            previous is None
+            or previous['chat_id'] != digest.chat_id
+            or previous['fingerprint'] != digest.fingerprint
+            or previous['message_id'] is None  # nothing to edit
+    ):
+        return _SEND
+    repeat_after = ctx.config.notify_repeat_after
+    if repeat_after is not None and now - previous['sent_at'] >= repeat_after:
+        return _SEND
+    if previous['text_hash'] == _get_text_hash(digest.message):
+        return _SUPPRESS
+    return _EDIT
+
+
+# hour_start (utc) -> github_login -> digest, filled by prefetch_notify
+_prefetched: tp.Dict[dt.datetime, tp.Dict[str, _Digest]] = {}
+# hour_start (utc) -> the cluster instances at the prefetch: the heartbeat
+# also runs at the hour, the users are not moved between instances then
+_instances: tp.Dict[dt.datetime, tp.List[str]] = {}
+
+
+async def _prepare_user(
+        github_login: str, settings: dict, hour_start: dt.datetime, ctx,
+) -> _Digest:
+    if not await calendarm.is_working_day(hour_start, github_login, ctx):
+        return _Digest(None, None)
+    logger.debug(f'processing user {github_login}')
 
-async def process_notify(ctx):
+    async with ctx.pool.acquire() as conn:
+        tg_login = await storage.get_telegram_login_pg(github_login, conn)
+        if not tg_login:
+            logger.debug(f'tg_login not found, login = {github_login}')
+            return _Digest(None, None)
+
+        chat_id: str = await storage.get_chat_id(tg_login, conn)
+        if not chat_id:
+            logger.debug('chat_id not found')
+            return _Digest(None, None)
+
+    # TODO reviews.show_requested
+
+    prs = await github.get_requested_reviews(github_login, ctx)
+    if not settings['wip']:
+        prs = [pr for pr in prs if not pr.is_wip]
+
+    if not prs:
+        logger.debug(f'no prs to notify {github_login}')
+    else:
+        logger.info(
+            f'notify {github_login} on {len(prs)} prs: '
+            f'{[pr.get_short_slug() for pr in prs]}',
+        )
+
+    prs_abandoned = (
+        (
+            await github.get_abandoned_prs(
+                github_login, dt.timedelta(days=14), ctx,  # config
+            )
+        )
+        if settings['my']
+        else []
+    )
+
+    if not prs and not prs_abandoned:
+        logger.debug('nothing to notify about')
+        return _Digest(str(chat_id), None)
+
+    return _Digest(
+        str(chat_id),
+        await telegram.hourly_notification(prs, prs_abandoned, ctx),
+        _get_fingerprint(prs, prs_abandoned),
+    )
+
+
+async def _get_due_settings(
+        hour_start: dt.datetime, instances: tp.List[str], ctx,
+) -> tp.Dict[str, tp.Dict]:
     async with ctx.pool.acquire() as conn:
         subjects_with_settings = await storage.get_reviewers_settings(conn)
-        utcnow = dt.datetime.utcnow()
-        current_hour = utcnow.hour + 3  # TODO timezone via settings
-
-        github_logins = {
-            login
-            for login, settings in subjects_with_settings.items()
-            if current_hour in settings['hours']
-            and await calendarm.is_working_day(utcnow, login, ctx)
-        }
-        # github_logins = {'artfulvampire'}  # for test
-        if github_logins:
-            logger.info(f'users to notify {github_logins}')
-
-        for github_login, settings in subjects_with_settings.items():
-            if github_login not in github_logins:
-                continue
-            logger.debug(f'processing user {github_login}')
-
-            # TODO reviews.show_requested
-
-            prs = await github.get_requested_reviews(github_login, ctx)
-            if not settings['wip']:
-                prs = [pr for pr in prs if not pr.is_wip]
-
-            if not prs:
-                logger.debug(f'no prs to notify {github_login}')
-            else:
-                logger.info(
-                    f'notify {github_login} on {len(prs)} prs: '
-                    f'{[pr.get_short_slug() for pr in prs]}',
-                )
+    current_hour = hour_start.hour + 3  # TODO timezone via settings
+
+    return {
+        login: settings
+        for login, settings in subjects_with_settings.items()
+        if current_hour in settings['hours']
+        and ctx.cluster.owns(login, instances)
+    }
 
-            prs_abandoned = (
-                (
-                    await github.get_abandoned_prs(
-                        github_login, dt.timedelta(days=14), ctx,  # config
+
+async def _prepare_all(
+        due_settings: tp.Dict[str, tp.Dict],
+        hour_start: dt.datetime,
+        digests: tp.Dict[str, _Digest],
+        ctx,
+) -> tp.List[str]:
+    semaphore = asyncio.Semaphore(ctx.config.notify_concurrency)
+    failures: tp.List[str] = []
+
+    async def _prepare_bounded(github_login: str) -> None:
+        async with semaphore:
+            try:
+                with tracing.span('prepare_user', login=github_login):
+                    digests[github_login] = await _prepare_user(
+                        github_login,
+                        due_settings[github_login],
+                        hour_start,
+                        ctx,
                     )
-                )
-                if settings['my']
-                else []
-            )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                failures.append(github_login)
+                logger.exception(f'failed to prepare digest {github_login}')
 
-            tg_login = await storage.get_telegram_login_pg(
-                github_login, conn,
-            )
-            if not tg_login:
-                logger.debug(f'tg_login not found, login = {github_login}')
-                continue
-
-            chat_id: str = await storage.get_chat_id(tg_login, conn)
-            if not chat_id:
-                logger.debug('chat_id not found')
-                continue
-
-            if not prs and not prs_abandoned:
-                logger.debug('nothing to notify about')
-                continue
-
-            await telegram.send_message(
-                await telegram.hourly_notification(prs, prs_abandoned, ctx),
-                str(chat_id),
-                ctx,
+    await asyncio.gather(*[_prepare_bounded(login) for login in due_settings])
+    return failures
+
+
+# runs config.notify_prefetch before the hour
+async def prefetch_notify(ctx):
+    utcnow = dt.datetime.utcnow()
+    hour_start = utcnow.replace(
+        minute=0, second=0, microsecond=0,
+    ) + dt.timedelta(hours=1)
+
+    instances = list(ctx.cluster.instances)
+    due_settings = await _get_due_settings(hour_start, instances, ctx)
+    digests: tp.Dict[str, _Digest] = {}
+    failures = await _prepare_all(due_settings, hour_start, digests, ctx)
+    _prefetched[hour_start] = digests
+    _instances[hour_start] = instances
+    logger.info(
+        f'prefetched {len(digests)} digests for {hour_start.isoformat()}'
+        f', failed {failures}',
+    )
+
+
+async def process_notify(ctx):
+    utcnow = dt.datetime.utcnow()
+    hour_start = utcnow.replace(minute=0, second=0, microsecond=0)
+    digests = _prefetched.pop(hour_start, {})
+    # started after the prefetch, the claims below keep it from duplicates
+    instances = _instances.pop(hour_start, ctx.cluster.instances)
+    for stale_hour in [hour for hour in _prefetched if hour < hour_start]:
+        _prefetched.pop(stale_hour)
+    for stale_hour in [hour for hour in _instances if hour < hour_start]:
+        _instances.pop(stale_hour)
+
+    # settings may have changed since the prefetch
+    due_settings = await _get_due_settings(hour_start, instances, ctx)
+    # github_logins = {'artfulvampire': ...}  # for test
+    if due_settings:
+        logger.info(f'users to notify {list(due_settings)}')
+
+    stale_before = utcnow - ctx.config.notify_digest_ttl
+    stale_settings = {
+        login: settings
+        for login, settings in due_settings.items()
+        if login not in digests or digests[login].prepared_at < stale_before
+    }
+    failures = await _prepare_all(stale_settings, hour_start, digests, ctx)
+    logger.info(
+        f'{len(due_settings) - len(stale_settings)} digests prefetched'
+        f', {len(stale_settings)} refreshed',
+    )
+
+    async with ctx.pool.acquire() as conn:
+        previous_digests = await storage.get_notify_digests(due_settings, conn)
+        # the instances may disagree on who owns a user while one joins or
+        # leaves, only the first one to claim the hour sends
+        claimed = await storage.claim_notify_digests(
+            [
+                login
+                for login, digest in digests.items()
+                if login in due_settings and digest.chat_id and digest.message
+            ],
+            hour_start.replace(tzinfo=dt.timezone.utc),
+            conn,
+        )
+    now = dt.datetime.now(dt.timezone.utc)
+
+    semaphore = asyncio.Semaphore(ctx.config.notify_concurrency)
+    latencies: tp.List[float] = []
+    actions: tp.Dict[str, int] = collections.Counter()
+    # staff_login -> (chat_id, fingerprint, text_hash, message_id, sent_at)
+    sent_digests: tp.Dict[
+        str, tp.Tuple[str, str, str, tp.Optional[int], dt.datetime],
+    ] = {}
+    blocked: tp.List[str] = []
+
+    async def _send_bounded(github_login: str) -> None:
+        digest = digests.get(github_login)
+        if not digest or not digest.chat_id or not digest.message:
+            return
+        if github_login not in claimed:
+            logger.info(f'{github_login} is notified by another instance')
+            return
+        previous = previous_digests.get(github_login)
+        action = _get_action(digest, previous, now, ctx)
+        if action == _SUPPRESS:
+            actions[action] += 1
+            return
+        async with semaphore:
+            try:
+                if action == _EDIT and await telegram.edit_message(
+                        digest.message,
+                        digest.chat_id,
+                        previous['message_id'],
+                        ctx,
+                ):
+                    message_id = previous['message_id']
+                    sent_at = previous['sent_at']
+                else:
+                    action = _SEND
+                    message_id = await telegram.send_message(
+                        digest.message, digest.chat_id, ctx,
+                    )
+                    sent_at = now
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                failures.append(github_login)
+                logger.exception(f'failed to notify {github_login}')
+                return
+            if message_id == telegram.BOT_BLOCKED:
+                # no retries, the notifications are disabled below
+                actions[_BLOCKED] += 1
+                blocked.append(github_login)
+                return
+            if message_id is None:
+                # not delivered (429, 400, ...), the next run sends it again
+                failures.append(github_login)
+                return
+            actions[action] += 1
+            sent_digests[github_login] = (
+                digest.chat_id,
+                digest.fingerprint,
+                _get_text_hash(digest.message),
+                message_id,
+                sent_at,
             )
+            if action == _SEND:
+                latencies.append(
+                    (dt.datetime.utcnow() - hour_start).total_seconds(),
+                )
+
+    await asyncio.gather(*[_send_bounded(login) for login in due_settings])
+    # the same prs back later are a new message, not suppressed or edited
+    # into one sent before they were gone
+    emptied = [
+        login
+        for login in due_settings
+        if login in digests
+        and not digests[login].message
+        and login in previous_digests
+    ]
+    if sent_digests or blocked or emptied:
+        async with ctx.pool.acquire() as conn:
+            if sent_digests:
+                await storage.save_notify_digests(sent_digests, conn)
+            if emptied:
+                await storage.delete_notify_digests(emptied, conn)
+            for github_login in blocked:
+                await storage.disable_notifications(github_login, conn)
+    if blocked:
+        logger.info(f'the bot is blocked, notifications disabled {blocked}')
+    for action, count in actions.items():
+        metrics.NOTIFY_DIGESTS.inc(action, value=count)
+
+    last_run.clear()
+    last_run.update(
+        {
+            'users': len(due_settings),
+            'refreshed': len(stale_settings),
+            'sent': len(latencies),
+            'edited': actions[_EDIT],
+            'suppressed': actions[_SUPPRESS],
+            'blocked': len(blocked),
+            'failed': len(failures),
+            'latency_p50': stat.median(latencies) if latencies else 0.0,
+            'latency_max': max(latencies) if latencies else 0.0,
+        },
+    )
+    logger.info(
+        f'notified {len(latencies)} of {len(due_settings)} users'
+        f', unchanged {actions[_EDIT]} edited'
+        f' and {actions[_SUPPRESS]} suppressed'
+        f', failed {failures}'
+        f', latency after the hour p50 {last_run["latency_p50"]:.1f}s'
+        f', max {last_run["latency_max"]:.1f}s',
+    )
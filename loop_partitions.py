@@ -0,0 +1,40 @@
+import datetime as dt
+import logging
+
+import storage
+
+
+logger = logging.getLogger()
+
+
+# the months of review_stats: the next ones are created before their rows
+# arrive, the ones past the retention leave the stats queries
+async def maintain_stats_partitions(ctx):
+    now = dt.datetime.now(dt.timezone.utc)
+    date_to = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(ctx.config.stats_partitions_ahead):
+        date_to = (date_to + dt.timedelta(days=32)).replace(day=1)
+    async with ctx.pool.acquire() as conn:
+        # neither the default partition nor the months exist before it, and
+        # the months of review_stats_new are named the same during it
+        if not await storage.is_stats_partitioned(conn):
+            logger.info(
+                'review_stats is not partitioned, run migrate_stats.py',
+            )
+            return
+
+        created = await storage.create_stats_partitions(
+            'review_stats', now, date_to, conn,
+        )
+        if created:
+            logger.info('created review_stats partitions %s', created)
+
+        if ctx.config.stats_retention is None:
+            return
+        archived = await storage.archive_stats_partitions(
+            now - ctx.config.stats_retention,
+            ctx.config.stats_archive_lock_timeout.total_seconds(),
+            conn,
+        )
+        if archived:
+            logger.info('archived review_stats partitions %s', archived)
@@ -48,7 +48,7 @@ async def notify_startrek(ctx):
 
             # really notify
             is_partner_products = await staff.is_partner_product(
-                staff_login, conn,
+                staff_login, ctx,
             )
             counter += 1
             pp_counter += int(is_partner_products)
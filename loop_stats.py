@@ -3,6 +3,7 @@ import typing as tp
 
 import common
 import github
+import result_cache
 import stats
 import storage
 
@@ -15,9 +16,11 @@ async def process_stats(ctx):
         logger.debug('stats calculation started')
 
         for owner, repos in common.REPOS.items():
-            logger.debug(f'processing owner {owner}')
+            logger.debug('processing owner %s', owner)
             for repo in repos:
-                logger.debug(f'processing repo {repo}')
+                if not ctx.cluster.owns(f'{owner}/{repo}'):
+                    continue
+                logger.debug('processing repo %s', repo)
 
                 last_run_cursor = await storage.get_cursor(owner, repo, conn)
                 if not last_run_cursor:
@@ -53,24 +56,37 @@ async def process_stats(ctx):
                 )
 
                 if not new_pr_numbers:
-                    logger.debug(f'no new prs for owner {owner}, repo {repo}')
+                    logger.debug(
+                        'no new prs for owner %s, repo %s', owner, repo,
+                    )
                     continue
                 else:
-                    logger.debug(f'{len(new_pr_numbers)} new prs obtained')
+                    logger.debug('%s new prs obtained', len(new_pr_numbers))
 
                 for pr_number in new_pr_numbers:
                     pull_request = github.PullRequest(owner, repo, pr_number)
                     if await storage.is_pr_processed(pull_request, conn):
-                        logger.debug(f'{pull_request} already processed, skip')
+                        logger.debug(
+                            '%s already processed, skip', pull_request,
+                        )
                         continue
 
-                    pr_stats: tp.List[tp.Dict] = await stats.get_review_stats(
+                    review_events = await stats.get_review_events(
                         pull_request, ctx,
                     )
+                    pr_stats: tp.List[tp.Dict] = stats.get_review_stats(
+                        pull_request, review_events, ctx.config,
+                    )
 
+                    await storage.save_events(
+                        pull_request, review_events, conn,
+                    )
                     await storage.mark_as_processed(pull_request, conn)
                     await storage.save_times(pull_request, pr_stats, conn)
-                    logger.debug(f'{pull_request} successfully processed')
+                    result_cache.invalidate(
+                        pull_request, {item['reviewer'] for item in pr_stats},
+                    )
+                    logger.debug('%s successfully processed', pull_request)
 
                 await storage.save_cursor(
                     new_cursor,
@@ -79,5 +95,5 @@ async def process_stats(ctx):
                     conn,
                 )
                 logger.debug(
-                    f'cursor updated for owner {owner} and repo {repo}',
+                    'cursor updated for owner %s and repo %s', owner, repo,
                 )
@@ -1,19 +1,31 @@
 import asyncio
+import datetime as dt
 import logging
+import typing as tp
 
 import aiohttp
 import asyncpg
 
-import common
+import cassette
+import cluster
 import configs
+import logs
 import loop_chiefs
 import loop_gaps
 import loop_logins
 import loop_notify
+import loop_partitions
 import loop_startrek
 import loop_stats
 import loop_telegram
+import metrics
+import orgtree
+import result_cache
+import runtime_config
+import scheduler
 import secrets
+import statements
+import tracing
 
 logger = logging.getLogger()
 
@@ -23,8 +35,14 @@ class Context:
     github_token: str
     tg_token: str
     config: configs.Config
+    # or cassette.CassetteSession around it
     session: aiohttp.client.ClientSession
     conn: asyncpg.Connection
+    pool: metrics.TimedPool  # asyncpg.pool.Pool with the waits measured
+    scheduler: scheduler.Scheduler
+    cluster: cluster.Cluster
+    org_tree: tp.Optional[orgtree.OrgTree]
+    runtime_config: tp.Optional[runtime_config.RuntimeConfig]
 
 
 async def create_ctx(
@@ -32,102 +50,178 @@ async def create_ctx(
 ):
     ctx = Context()
     ctx.conn = await asyncpg.connect(**secrets_dict['pg_dsn'])
-    ctx.session = session
+    await statements.init_connection(ctx.conn)
     ctx.config = configs.Config(is_test=False)
     ctx.staff_token = secrets_dict['staff_token']
     ctx.github_token = secrets_dict['github_token']
     ctx.tg_token = secrets_dict['tg_token']
+    ctx.session = session
+    if ctx.config.cassette_mode:
+        ctx.session = cassette.CassetteSession(
+            session,
+            ctx.config.cassette_mode,
+            ctx.config.cassette_dir,
+            (ctx.staff_token, ctx.github_token, ctx.tg_token),
+            ctx.config.cassette_time_scale,
+        )
+    ctx.org_tree = None  # loaded on demand
+    ctx.runtime_config = None  # the same
+    await runtime_config.listen(ctx)
+    await orgtree.listen(ctx)
+    ctx.cluster = cluster.Cluster(secrets_dict['pg_dsn'], ctx.config)
     return ctx
 
 
-async def loop_wrapper(context, delta, func):
-    while True:
-        try:
-            if delta:
-                await asyncio.sleep(common.secs_to_next_round(delta))
-            await func(context)
-        except BaseException:
-            logger.exception(f'Exception during {func.__name__} iteration.')
-            await asyncio.sleep(30)
-
-
-async def cron_wrapper(context, func, **sleep_kwargs):
-    while True:
-        try:
-            await asyncio.sleep(common.seconds_till(**sleep_kwargs))
-            await func(context)
-            await asyncio.sleep(60)
-        except BaseException:
-            logger.exception(f'Exception during {func.__name__} iteration.')
-            await asyncio.sleep(30)
+def _register_gauges(ctx) -> None:
+    metrics.Gauge(
+        'review_job_state',
+        'scheduler.Scheduler.get_stats() counters',
+        ('job', 'stat'),
+        lambda: {
+            (job, stat): float(value)
+            for job, job_stats in ctx.scheduler.get_stats().items()
+            for stat, value in job_stats.items()
+            if stat in ('skipped', 'missed', 'running', 'max_lag')
+        },
+    )
+    metrics.Gauge(
+        'review_notify_last_run',
+        'loop_notify.last_run',
+        ('stat',),
+        lambda: {
+            (stat,): value for stat, value in loop_notify.last_run.items()
+        },
+    )
+    metrics.Gauge(
+        'review_result_cache',
+        'result_cache.get_stats(), the interactive commands',
+        ('stat',),
+        lambda: {
+            (stat,): value for stat, value in result_cache.get_stats().items()
+        },
+    )
+    metrics.Gauge(
+        'review_cluster_state',
+        'this instance leadership and the live instances',
+        ('stat',),
+        lambda: {
+            ('leader',): float(ctx.cluster.is_leader),
+            ('instances',): float(len(ctx.cluster.instances)),
+        },
+    )
 
 
 async def run_wrapper():
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(
+            trace_configs=[metrics.trace_config(), tracing.trace_config()],
+    ) as session:
         # set some "global" stuff
         secrets_dict = secrets.load_secrets()
         context = await create_ctx(secrets_dict, session)
         async with asyncpg.create_pool(
-                min_size=10, max_size=10, **secrets_dict['pg_dsn'],
+                min_size=10,
+                max_size=10,
+                init=statements.init_connection,
+                **secrets_dict['pg_dsn'],
         ) as pool:
-            context.pool = pool
-            logging_format = (
-                'tskv'
-                '\ttimestamp=%(asctime)s'
-                '\tlevel=%(levelname)s'
-                '\tfile=%(filename)s'
-                '\tfunc=%(funcName)s'
-                '\tline=%(lineno)s'
-                '\ttext=%(message)s'
+            context.pool = metrics.TimedPool(pool)
+            config = context.config
+            statements.setup(
+                context.pool,
+                (
+                    config.slow_query_threshold.total_seconds()
+                    if config.slow_query_threshold is not None
+                    else None
+                ),
+                config.slow_query_explain_interval.total_seconds(),
+                config.slow_query_explain_timeout.total_seconds(),
+            )
+            # written by a thread, not from the event loop
+            logs.setup(
+                context.config.log_file,
+                context.config.log_max_bytes,
+                context.config.log_backups,
+                logging.INFO,  # logging.DEBUG
             )
-            logging.basicConfig(
-                filename='/tmp/server.log',
-                format=logging_format,
-                # datefmt='%Y-%m-%dT%H-%M-%S%Z',
+            tracing.setup(
+                context.config.tracing_file,
+                context.config.tracing_max_bytes,
+                context.config.tracing_backups,
             )
-            logging.getLogger().setLevel(logging.INFO)
-            # logging.getLogger().setLevel(logging.DEBUG)
 
-            # what are you? a cron-task imitation? pathetic!
-            await asyncio.gather(
-                loop_wrapper(
-                    context,
-                    context.config.process_stats_delta,
-                    loop_stats.process_stats,
-                ),
-                loop_wrapper(
-                    context,
-                    context.config.process_notify_delta,
-                    loop_notify.process_notify,
+            jobs = scheduler.Scheduler(context)
+            jobs.add_job(
+                context.cluster.heartbeat,
+                scheduler.IntervalTrigger(config.cluster_heartbeat),
+            )
+            jobs.add_job(
+                loop_stats.process_stats,
+                scheduler.IntervalTrigger(config.process_stats_delta),
+                jitter=config.scheduler_jitter,
+            )
+            # users expect it right at the hour, no jitter
+            jobs.add_job(
+                loop_notify.process_notify,
+                scheduler.IntervalTrigger(config.process_notify_delta),
+            )
+            jobs.add_job(
+                loop_notify.prefetch_notify,
+                scheduler.IntervalTrigger(
+                    config.process_notify_delta,
+                    config.process_notify_delta - config.notify_prefetch,
                 ),
-                loop_wrapper(
-                    context,
-                    None,  # long polling, doesn't need sleep here
+            )
+            # long polling, doesn't need sleep here
+            jobs.add_job(
+                cluster.singleton(
                     loop_telegram.process_telegram_input,
+                    sleep_if_skipped=True,
                 ),
-                loop_wrapper(
-                    context,
-                    context.config.process_gaps_delta,
-                    loop_gaps.update_gaps_info,
-                ),
-                loop_wrapper(
-                    context,
-                    context.config.process_subordinated_delta,
-                    loop_chiefs.update_subordinated,
-                ),
-                loop_wrapper(
-                    context,
-                    context.config.process_logins_delta,
-                    loop_logins.update_logins,
-                ),
-                cron_wrapper(
-                    context,
-                    loop_startrek.notify_startrek,
-                    weekday=0,
-                    hour=10,  # local Moscow time
-                    minute=45,
-                ),
+                None,
+            )
+            jobs.add_job(
+                loop_gaps.update_gaps_info,
+                scheduler.IntervalTrigger(config.process_gaps_delta),
+                jitter=config.scheduler_jitter,
+                catch_up=True,
+            )
+            jobs.add_job(
+                loop_chiefs.update_subordinated,
+                scheduler.IntervalTrigger(config.process_subordinated_delta),
+                jitter=config.scheduler_jitter,
+                catch_up=True,
+            )
+            jobs.add_job(
+                cluster.singleton(loop_logins.update_logins),
+                scheduler.IntervalTrigger(config.process_logins_delta),
+                jitter=config.scheduler_jitter,
+                catch_up=True,
+            )
+            jobs.add_job(
+                cluster.singleton(loop_partitions.maintain_stats_partitions),
+                scheduler.CronTrigger(**config.maintain_partitions_cron),
+                misfire_grace=dt.timedelta(hours=1),
+            )
+            jobs.add_job(
+                cluster.singleton(loop_startrek.notify_startrek),
+                scheduler.CronTrigger(**config.notify_startrek_cron),
+                misfire_grace=dt.timedelta(hours=1),
+            )
+            context.scheduler = jobs
+            _register_gauges(context)
+            metrics_runner = await metrics.start_server(
+                config.metrics_host, config.metrics_port,
             )
+            # leadership and shards are known before the first job runs
+            await context.cluster.heartbeat(context)
+            try:
+                await jobs.run()
+            finally:
+                await context.cluster.leave(context)
+                await metrics_runner.cleanup()
+                if isinstance(context.session, cassette.CassetteSession):
+                    context.session.close_cassettes()
+                logs.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,291 @@
+import bisect
+import functools
+import logging
+import time
+import typing as tp
+
+import aiohttp
+from aiohttp import web
+
+
+logger = logging.getLogger()
+
+# seconds, from a fast pg query up to a long loop iteration
+_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0, 300.0,
+)
+
+_Labels = tp.Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: _Labels, values: _Labels, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: _Labels = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        _REGISTRY.append(self)
+
+    def _samples(self) -> tp.Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> tp.Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield from self._samples()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: _Labels = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: tp.Dict[_Labels, float] = {}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def _samples(self) -> tp.Iterator[str]:
+        for labels, value in self._values.items():
+            yield (
+                f'{self.name}{_format_labels(self.labelnames, labels)}'
+                f' {_format_value(value)}'
+            )
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: _Labels = (),
+            buckets: tp.Tuple[float, ...] = _BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = buckets
+        # labels -> [per bucket counts..., +Inf count, sum]
+        self._values: tp.Dict[_Labels, tp.List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0.0] * (len(self._buckets) + 2)
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        counts[-1] += value
+
+    def _samples(self) -> tp.Iterator[str]:
+        for labels, counts in self._values.items():
+            total = 0.0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket = _format_labels(self.labelnames, labels, f'le="{le}"')
+                yield f'{self.name}_bucket{bucket} {_format_value(total)}'
+            plain = _format_labels(self.labelnames, labels)
+            yield f'{self.name}_sum{plain} {_format_value(counts[-1])}'
+            yield f'{self.name}_count{plain} {_format_value(total)}'
+
+
+# the values are read from elsewhere only when scraped
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: _Labels,
+            collect: tp.Callable[[], tp.Dict[_Labels, float]],
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def _samples(self) -> tp.Iterator[str]:
+        for labels, value in self._collect().items():
+            yield (
+                f'{self.name}{_format_labels(self.labelnames, labels)}'
+                f' {_format_value(value)}'
+            )
+
+
+_REGISTRY: tp.List[_Metric] = []
+
+JOB_RUNS = Counter(
+    'review_job_runs_total', 'scheduler job iterations', ('job', 'status'),
+)
+JOB_DURATION = Histogram(
+    'review_job_duration_seconds', 'scheduler job iteration time', ('job',),
+)
+HTTP_REQUESTS = Counter(
+    'review_http_requests_total',
+    'outbound http requests by the response status',
+    ('service', 'status'),
+)
+HTTP_DURATION = Histogram(
+    'review_http_request_duration_seconds',
+    'outbound http requests, till the response headers',
+    ('service',),
+)
+QUERY_DURATION = Histogram(
+    'review_storage_query_duration_seconds',
+    'storage.py functions',
+    ('query',),
+)
+QUERY_ERRORS = Counter(
+    'review_storage_query_errors_total', 'storage.py exceptions', ('query',),
+)
+POOL_ACQUIRE = Histogram(
+    'review_pg_pool_acquire_seconds', 'waits for a pg pool connection',
+)
+STATEMENT_DURATION = Histogram(
+    'review_pg_statement_duration_seconds',
+    'statements.py statements',
+    ('statement',),
+)
+STATEMENT_ERRORS = Counter(
+    'review_pg_statement_errors_total',
+    'statements.py statements failed',
+    ('statement',),
+)
+SLOW_STATEMENTS = Counter(
+    'review_pg_slow_statements_total',
+    'statements.py statements slower than the slow-query threshold',
+    ('statement',),
+)
+NOTIFY_DIGESTS = Counter(
+    'review_notify_digests_total',
+    'loop_notify digests sent, edited in place, suppressed as unchanged or'
+    ' blocked by the user',
+    ('action',),
+)
+RESULT_CACHE = Counter(
+    'review_result_cache_requests_total',
+    'result_cache.py lookups by the command kind',
+    ('kind', 'result'),
+)
+
+
+def render() -> str:
+    lines: tp.List[str] = []
+    for metric in _REGISTRY:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            logger.exception(f'failed to render {metric.name}')
+    return '\n'.join(lines) + '\n'
+
+
+def timed_query(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            QUERY_ERRORS.inc(func.__name__)
+            raise
+        finally:
+            QUERY_DURATION.observe(time.monotonic() - started, func.__name__)
+
+    return wrapper
+
+
+class _TimedAcquire:
+    def __init__(self, acquire):
+        self._acquire = acquire
+
+    async def __aenter__(self):
+        started = time.monotonic()
+        conn = await self._acquire.__aenter__()
+        POOL_ACQUIRE.observe(time.monotonic() - started)
+        return conn
+
+    async def __aexit__(self, *exc_info):
+        return await self._acquire.__aexit__(*exc_info)
+
+
+# asyncpg pool with the acquire waits measured, the rest is as is
+class TimedPool:
+    def __init__(self, pool):
+        self._pool = pool
+
+    def acquire(self, *args, **kwargs) -> _TimedAcquire:
+        return _TimedAcquire(self._pool.acquire(*args, **kwargs))
+
+    def __getattr__(self, name: str):
+        return getattr(self._pool, name)
+
+
+# url prefix -> service label, filled by the modules making requests
+_SERVICES: tp.List[tp.Tuple[str, str]] = []
+
+
+def register_service(service: str, *url_prefixes: str) -> None:
+    _SERVICES.extend((prefix, service) for prefix in url_prefixes)
+
+
+def get_service(url: str) -> str:
+    for prefix, service in _SERVICES:
+        if url.startswith(prefix):
+            return service
+    return 'other'
+
+
+async def _on_request_start(session, trace_ctx, params) -> None:
+    trace_ctx.started = time.monotonic()
+
+
+async def _on_request_end(session, trace_ctx, params) -> None:
+    service = get_service(str(params.url))
+    HTTP_DURATION.observe(time.monotonic() - trace_ctx.started, service)
+    HTTP_REQUESTS.inc(service, str(params.response.status))
+
+
+async def _on_request_exception(session, trace_ctx, params) -> None:
+    service = get_service(str(params.url))
+    HTTP_DURATION.observe(time.monotonic() - trace_ctx.started, service)
+    HTTP_REQUESTS.inc(service, type(params.exception).__name__)
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_request_end.append(_on_request_end)
+    config.on_request_exception.append(_on_request_exception)
+    return config
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        text=render(), content_type='text/plain', charset='utf-8',
+    )
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f'metrics served at http://{host}:{port}/metrics')
+    return runner
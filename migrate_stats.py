@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import datetime as dt
+import logging
+
+import asyncpg
+
+import configs
+import secrets
+import storage
+
+
+logger = logging.getLogger()
+
+# converts an unpartitioned reviews.review_stats into the monthly partitions
+# of schema.sql while the bot keeps writing: the new table is filled by
+# batches, a trigger mirrors the writes made meanwhile, --swap renames
+#
+# python3 migrate_stats.py --batch-size 5000 --pause 0.1 --swap
+
+_CREATE_NEW_QUERIES = [
+    """
+    CREATE TABLE IF NOT EXISTS reviews.review_stats_new (
+      LIKE reviews.review_stats INCLUDING DEFAULTS,
+      PRIMARY KEY(owner, repo, number, review_at)
+    ) PARTITION BY RANGE (review_at);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reviews.review_stats_new_default
+      PARTITION OF reviews.review_stats_new DEFAULT;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_stats_new_by_reviewer_time
+      ON reviews.review_stats_new (reviewer, review_at) INCLUDE (minutes);
+    """,
+]
+
+# save_times and replace_times write during the copy, never update
+_CREATE_MIRROR_QUERIES = [
+    """
+    CREATE OR REPLACE FUNCTION reviews.mirror_review_stats() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+      IF TG_OP = 'DELETE' THEN
+        DELETE FROM reviews.review_stats_new
+        WHERE (owner, repo, number, review_at)
+          = (OLD.owner, OLD.repo, OLD.number, OLD.review_at);
+        RETURN OLD;
+      END IF;
+      INSERT INTO reviews.review_stats_new
+      VALUES (NEW.*)
+      ON CONFLICT DO NOTHING;
+      RETURN NEW;
+    END;
+    $$;
+    """,
+    'DROP TRIGGER IF EXISTS mirror_review_stats ON reviews.review_stats;',
+    """
+    CREATE TRIGGER mirror_review_stats
+    AFTER INSERT OR DELETE ON reviews.review_stats
+    FOR EACH ROW EXECUTE FUNCTION reviews.mirror_review_stats();
+    """,
+]
+
+# keyset pagination over the primary key, no long-running snapshot
+_COPY_BATCH_QUERY = """
+WITH batch AS (
+  SELECT *
+  FROM reviews.review_stats
+  WHERE (owner, repo, number, review_at) > ($1, $2, $3, $4)
+  ORDER BY owner, repo, number, review_at
+  LIMIT $5
+), copied AS (
+  INSERT INTO reviews.review_stats_new
+  SELECT * FROM batch
+  ON CONFLICT DO NOTHING
+)
+SELECT owner, repo, number, review_at, (SELECT COUNT(*) FROM batch) AS size
+FROM batch
+ORDER BY owner DESC, repo DESC, number DESC, review_at DESC
+LIMIT 1;
+"""
+
+# a batch may read a row, a concurrent delete removes it with its mirror,
+# then the batch inserts it: under the lock of the swap nothing writes, the
+# rows left only in the copy are these
+_DELETE_RESURRECTED_QUERY = """
+DELETE FROM reviews.review_stats_new AS new
+WHERE NOT EXISTS (
+  SELECT 1
+  FROM reviews.review_stats AS old
+  WHERE (old.owner, old.repo, old.number, old.review_at)
+    = (new.owner, new.repo, new.number, new.review_at)
+);
+"""
+
+_SWAP_QUERIES = [
+    'DROP TRIGGER mirror_review_stats ON reviews.review_stats;',
+    'ALTER TABLE reviews.review_stats RENAME TO review_stats_unpartitioned;',
+    'ALTER TABLE reviews.review_stats_new RENAME TO review_stats;',
+    """
+    ALTER TABLE reviews.review_stats_new_default
+    RENAME TO review_stats_default;
+    """,
+    """
+    ALTER INDEX reviews.idx_stats_new_by_reviewer_time
+    RENAME TO idx_stats_by_reviewer_time;
+    """,
+    'DROP FUNCTION reviews.mirror_review_stats();',
+]
+
+
+async def _copy(conn, batch_size: int, pause: float) -> int:
+    # below every key, review_at is in the primary key so never NULL
+    last = ('', '', -1, dt.datetime.min.replace(tzinfo=dt.timezone.utc))
+    copied = 0
+    while True:
+        row = await conn.fetchrow(_COPY_BATCH_QUERY, *last, batch_size)
+        if row is None:
+            return copied
+        last = tuple(row)[:4]
+        copied += row['size']
+        logger.info(f'copied up to {last}')
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def _swap(conn, lock_timeout: float) -> None:
+    async with conn.transaction():
+        await conn.execute(
+            f'SET LOCAL lock_timeout = {int(lock_timeout * 1000)};',
+        )
+        await conn.execute(
+            'LOCK TABLE reviews.review_stats IN ACCESS EXCLUSIVE MODE;',
+        )
+        resurrected = await conn.execute(_DELETE_RESURRECTED_QUERY)
+        logger.info(f'deleted from review_stats_new: {resurrected}')
+        old_count = await conn.fetchval(
+            'SELECT COUNT(*) FROM reviews.review_stats;',
+        )
+        new_count = await conn.fetchval(
+            'SELECT COUNT(*) FROM reviews.review_stats_new;',
+        )
+        if old_count != new_count:
+            raise RuntimeError(
+                f'{old_count} rows in review_stats,'
+                f' {new_count} in review_stats_new',
+            )
+        for query in _SWAP_QUERIES:
+            await conn.execute(query)
+    logger.info(
+        'swapped, drop reviews.review_stats_unpartitioned when not needed',
+    )
+
+
+async def run_migration(args: argparse.Namespace) -> None:
+    secrets_dict = secrets.load_secrets()
+    config = configs.Config(is_test=False)
+
+    conn = await asyncpg.connect(**secrets_dict['pg_dsn'])
+    try:
+        if await storage.is_stats_partitioned(conn):
+            logger.info('reviews.review_stats is already partitioned')
+            return
+
+        async with conn.transaction():
+            for query in _CREATE_NEW_QUERIES:
+                await conn.execute(query)
+            # the mirror goes first, the copy skips what it has inserted
+            for query in _CREATE_MIRROR_QUERIES:
+                await conn.execute(query)
+
+        now = dt.datetime.now(dt.timezone.utc)
+        date_from = await conn.fetchval(
+            'SELECT MIN(review_at) FROM reviews.review_stats;',
+        )
+        date_to = now + dt.timedelta(
+            days=31 * config.stats_partitions_ahead,
+        )
+        created = await storage.create_stats_partitions(
+            'review_stats_new', date_from or now, date_to, conn,
+        )
+        logger.info(f'created {len(created)} partitions')
+
+        copied = await _copy(conn, args.batch_size, args.pause)
+        logger.info(f'copied {copied} rows')
+
+        if args.swap:
+            await _swap(conn, args.lock_timeout)
+    finally:
+        await conn.close()
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='partition reviews.review_stats by month, online',
+    )
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--pause', type=float, default=0.0)  # secs
+    # without it the copy is kept in sync by the trigger, run again to swap
+    parser.add_argument('--swap', action='store_true')
+    parser.add_argument('--lock-timeout', type=float, default=5.0)  # secs
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_migration(_parse_args()))
@@ -1,13 +1,17 @@
 import logging
 
+import metrics
 import storage
+import tracing
 
 NDA_API_PREFIX = 'https://nda.ya.ru/--'
+metrics.register_service('nda', NDA_API_PREFIX)
 
 
 logger = logging.getLogger()
 
 
+@tracing.traced
 async def get_link(link: str, ctx) -> str:
     async with ctx.pool.acquire() as conn:
         from_db = await storage.get_nda_link(link, conn)
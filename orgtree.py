@@ -0,0 +1,121 @@
+import datetime as dt
+import logging
+import typing as tp
+
+import runtime_config
+import storage
+
+
+logger = logging.getLogger()
+
+# in reviews.key_value, written with staff_chiefs by loop_chiefs
+VERSION_KEY = 'staff_chiefs_version'
+
+
+# the whole organization from one staff dump, everything precomputed
+class OrgTree:
+    def __init__(
+            self,
+            chiefs: tp.Dict[str, tp.Optional[str]],
+            version: tp.Optional[str] = None,
+    ):
+        self.version = version  # of the staff_chiefs dump
+        self._direct: tp.Dict[str, tp.FrozenSet[str]] = {}
+        self._chiefs: tp.Dict[str, tp.Tuple[str, ...]] = {}  # nearest first
+        self._all: tp.Dict[str, tp.FrozenSet[str]] = {}
+
+        direct: tp.Dict[str, tp.Set[str]] = {}
+        for login, chief in chiefs.items():
+            if chief:
+                direct.setdefault(chief, set()).add(login)
+
+        every: tp.Dict[str, tp.Set[str]] = {}
+        for login in chiefs:
+            chain: tp.List[str] = []
+            seen: tp.Set[str] = {login}  # broken data may have cycles
+            chief = chiefs.get(login)
+            while chief and chief not in seen:
+                chain.append(chief)
+                seen.add(chief)
+                every.setdefault(chief, set()).add(login)
+                chief = chiefs.get(chief)
+            self._chiefs[login] = tuple(chain)
+
+        self._direct = {login: frozenset(subs) for login, subs in direct.items()}
+        self._all = {login: frozenset(subs) for login, subs in every.items()}
+
+    def __len__(self) -> int:
+        return len(self._chiefs)
+
+    def __contains__(self, login: str) -> bool:
+        return login in self._chiefs
+
+    # a person missing in the last dump, e.g. a newcomer
+    def add_person(self, login: str, chiefs: tp.Sequence[str]) -> None:
+        self._chiefs[login] = tuple(chiefs)
+        if chiefs:
+            self._direct[chiefs[0]] = self.get_direct(chiefs[0]) | {login}
+        for chief in chiefs:
+            self._all[chief] = self.get_all(chief) | {login}
+
+    def get_direct(self, login: str) -> tp.FrozenSet[str]:
+        return self._direct.get(login, frozenset())
+
+    def get_all(self, login: str) -> tp.FrozenSet[str]:
+        return self._all.get(login, frozenset())
+
+    def get_chiefs(self, login: str) -> tp.Tuple[str, ...]:
+        return self._chiefs.get(login, ())
+
+    # rng = 0 is the team of the nearest chief, 1 - of the chief's chief, ...
+    def get_team(self, login: str, rng: int) -> tp.Set[str]:
+        if rng == 0 and login in self._all:
+            # managers see their own subtree first
+            return set(self._all[login])
+
+        if login in self._all:
+            rng -= 1
+
+        chiefs = self.get_chiefs(login)
+        if not chiefs:
+            return set()
+        team = set(self._all.get(chiefs[min(rng, len(chiefs) - 1)], ()))
+        team.discard(login)
+        return team
+
+
+async def get_tree(ctx) -> OrgTree:
+    if ctx.org_tree is None:
+        updated_after = (
+            dt.datetime.now(dt.timezone.utc) - ctx.config.chiefs_cache_ttl
+        )
+        async with ctx.pool.acquire() as conn:
+            # before the dump, a newer dump in between only reloads again
+            version = await get_version(conn)
+            tree = OrgTree(await storage.get_staff_chiefs(conn), version)
+            cached = await storage.get_chiefs_cache(updated_after, conn)
+        for login, chiefs in cached.items():
+            if login not in tree:
+                tree.add_person(login, chiefs)
+        ctx.org_tree = tree
+        logger.info(
+            f'org tree loaded from pg, {len(tree)} persons'
+            f', {len(cached)} from the chiefs cache',
+        )
+    return ctx.org_tree
+
+
+async def get_version(conn) -> tp.Optional[str]:
+    return (await storage.get_key_values([VERSION_KEY], conn)).get(
+        VERSION_KEY,
+    )
+
+
+# the other instances reload the tree right after the leader's dump
+async def listen(ctx) -> None:
+    def _on_notify(conn, pid, channel, key) -> None:
+        if key == VERSION_KEY:
+            logger.info('staff_chiefs changed, the org tree is reloaded')
+            ctx.org_tree = None
+
+    await ctx.conn.add_listener(runtime_config.CHANNEL, _on_notify)
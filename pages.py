@@ -0,0 +1,124 @@
+# the long pr lists of callbacks.py are sent page by page: the first page
+# goes with next/prev buttons, the prs stay here and the buttons (callback
+# data page_next_<id> and page_prev_<id>) edit the same message without
+# asking github again; a page is rendered only when shown
+import itertools
+import logging
+import time
+import typing as tp
+
+import github
+import telegram
+
+
+logger = logging.getLogger()
+
+
+class _PrList:
+    __slots__ = (
+        'header', 'pull_requests', 'starts', 'page', 'chat_id', 'message_id',
+        'created_at',
+    )
+
+    def __init__(
+            self,
+            header: str,
+            pull_requests: tp.List[github.PullRequest],
+            chat_id: str,
+    ):
+        self.header = header
+        self.pull_requests = pull_requests
+        # starts[page] of the pages rendered so far and the end of the last
+        self.starts: tp.List[int] = [0]
+        self.page = 0
+        self.chat_id = chat_id
+        self.message_id: tp.Optional[int] = None
+        self.created_at = time.monotonic()
+
+
+# list id -> list, the oldest first; the lists of the leader only, it
+# polls telegram
+_lists: tp.Dict[int, _PrList] = {}
+_ids = itertools.count(1)
+
+
+def _get_keyboard(list_id: int, pr_list: _PrList) -> tp.List[tp.List[dict]]:
+    buttons: tp.List[dict] = []
+    if pr_list.page > 0:
+        buttons.append(
+            {'text': '< prev', 'callback_data': f'page_prev_{list_id}'},
+        )
+    if pr_list.starts[pr_list.page + 1] < len(pr_list.pull_requests):
+        buttons.append(
+            {'text': 'next >', 'callback_data': f'page_next_{list_id}'},
+        )
+    return [buttons]
+
+
+async def _render(pr_list: _PrList, ctx) -> str:
+    message, end = await telegram.pr_list_page(
+        pr_list.header,
+        pr_list.pull_requests,
+        pr_list.starts[pr_list.page],
+        ctx.config.message_page_size,
+        ctx,
+    )
+    del pr_list.starts[pr_list.page + 1 :]
+    pr_list.starts.append(end)
+    return message
+
+
+def _evict(ctx) -> None:
+    expired_before = time.monotonic() - ctx.config.pages_ttl.total_seconds()
+    while _lists and (
+            len(_lists) > ctx.config.pages_max_lists
+            or next(iter(_lists.values())).created_at < expired_before
+    ):
+        _lists.pop(next(iter(_lists)))
+
+
+async def send_pr_list(
+        header: str,
+        pull_requests: tp.List[github.PullRequest],
+        chat_id: str,
+        ctx,
+) -> None:
+    pr_list = _PrList(header, pull_requests, chat_id)
+    message = await _render(pr_list, ctx)
+    if pr_list.starts[1] >= len(pull_requests):
+        await telegram.send_message(message, chat_id, ctx)
+        return
+
+    list_id = next(_ids)
+    pr_list.message_id = await telegram.send_message(
+        message, chat_id, ctx, _get_keyboard(list_id, pr_list),
+    )
+    if pr_list.message_id in (None, telegram.BOT_BLOCKED):
+        return
+    _lists[list_id] = pr_list
+    _evict(ctx)
+
+
+# step 1 is the next page, -1 the previous one
+async def turn_page(list_id: int, step: int, chat_id: str, ctx) -> None:
+    _evict(ctx)
+    pr_list = _lists.get(list_id)
+    if pr_list is None or pr_list.chat_id != chat_id:
+        logger.info(f'no pr list {list_id} for chat {chat_id}')
+        await telegram.send_message(
+            telegram.expired_list_message(), chat_id, ctx,
+        )
+        return
+
+    page = pr_list.page + step
+    if page < 0 or pr_list.starts[page] >= len(pr_list.pull_requests):
+        return  # a button of an outdated keyboard
+    pr_list.page = page
+    message = await _render(pr_list, ctx)
+    await telegram.edit_message(
+        message,
+        chat_id,
+        pr_list.message_id,
+        ctx,
+        _get_keyboard(list_id, pr_list),
+    )
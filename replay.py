@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import concurrent.futures
+import datetime as dt
+import logging
+import typing as tp
+
+import asyncpg
+
+import common
+import configs
+import events
+import github
+import secrets
+import statements
+import stats
+import storage
+
+
+logger = logging.getLogger()
+
+_CHUNK_SIZE = 200  # prs per worker task
+
+
+class Context:
+    config: configs.Config
+    pool: asyncpg.pool.Pool
+
+
+# runs in a worker process, so only plain data in and out
+def _replay_chunk(
+        owner: str, repo: str, rows: tp.List[tuple], config: configs.Config,
+) -> tp.List[tp.Tuple[int, tp.List[tp.Dict]]]:
+    result: tp.List[tp.Tuple[int, tp.List[tp.Dict]]] = []
+    for number, types, reviewers, event_ats in rows:
+        review_events = events.EventBatch.from_columns(
+            types, reviewers, event_ats,
+        )
+        pr_stats = stats.get_review_stats(
+            github.PullRequest(owner, repo, number), review_events, config,
+        )
+        result.append((number, pr_stats))
+    return result
+
+
+async def replay_stats(
+        owner: str,
+        repo: str,
+        date_from: dt.datetime,
+        date_to: dt.datetime,
+        executor: concurrent.futures.Executor,
+        ctx,
+) -> int:
+    async with ctx.pool.acquire() as conn:
+        rows = await storage.get_events(owner, repo, date_from, date_to, conn)
+    if not rows:
+        logger.info(f'no stored events for {owner}/{repo}')
+        return 0
+
+    loop = asyncio.get_event_loop()
+    chunks = [
+        rows[index : index + _CHUNK_SIZE]
+        for index in range(0, len(rows), _CHUNK_SIZE)
+    ]
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                executor, _replay_chunk, owner, repo, chunk, ctx.config,
+            )
+            for chunk in chunks
+        ],
+    )
+
+    async with ctx.pool.acquire() as conn:
+        for prs_stats in results:
+            await storage.replace_times(owner, repo, prs_stats, conn)
+
+    logger.info(f'replayed {len(rows)} prs for {owner}/{repo}')
+    return len(rows)
+
+
+async def run_replay(args: argparse.Namespace) -> None:
+    secrets_dict = secrets.load_secrets()
+    ctx = Context()
+    ctx.config = configs.Config(is_test=False)
+
+    repos: tp.List[tp.Tuple[str, str]] = [
+        (owner, repo)
+        for owner, owner_repos in common.REPOS.items()
+        for repo in owner_repos
+        if (args.owner is None or owner == args.owner)
+        and (args.repo is None or repo == args.repo)
+    ]
+    date_from = dt.datetime.fromisoformat(args.date_from).replace(
+        tzinfo=dt.timezone.utc,
+    )
+    date_to = (
+        dt.datetime.fromisoformat(args.date_to).replace(tzinfo=dt.timezone.utc)
+        if args.date_to
+        else dt.datetime.now(dt.timezone.utc)
+    )
+
+    async with asyncpg.create_pool(
+            min_size=1,
+            max_size=2,
+            init=statements.init_connection,
+            **secrets_dict['pg_dsn'],
+    ) as pool:
+        ctx.pool = pool
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.workers or ctx.config.replay_workers,
+        ) as executor:
+            for owner, repo in repos:
+                await replay_stats(
+                    owner, repo, date_from, date_to, executor, ctx,
+                )
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='recalculate review_stats from stored pr events',
+    )
+    parser.add_argument('--owner', default=None)
+    parser.add_argument('--repo', default=None)
+    parser.add_argument('--date-from', default='2020-08-01')
+    parser.add_argument('--date-to', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_replay(_parse_args()))
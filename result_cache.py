@@ -0,0 +1,86 @@
+# the github searches behind the interactive commands, per user and for a
+# short time: the same button pressed again answers from here; loop_stats
+# drops the lists with a newly merged pr and the lists of its reviewers
+import logging
+import time
+import typing as tp
+
+import github
+import metrics
+
+
+logger = logging.getLogger()
+
+_Key = tp.Tuple[str, str, tp.Tuple]  # kind, github login, arguments
+
+
+class _Entry:
+    __slots__ = ('pull_requests', 'slugs', 'created_at')
+
+    def __init__(self, pull_requests: tp.List[github.PullRequest]):
+        self.pull_requests = pull_requests
+        # PullRequest with a last_review is not hashable
+        self.slugs = frozenset(
+            (pr.owner, pr.repo, pr.number) for pr in pull_requests
+        )
+        self.created_at = time.monotonic()
+
+
+# the oldest first
+_entries: tp.Dict[_Key, _Entry] = {}
+_counts: tp.Dict[str, int] = {'hits': 0, 'misses': 0}
+
+
+def _evict(ctx) -> None:
+    expired_before = (
+        time.monotonic() - ctx.config.result_cache_ttl.total_seconds()
+    )
+    while _entries and (
+            len(_entries) > ctx.config.result_cache_max_entries
+            or next(iter(_entries.values())).created_at < expired_before
+    ):
+        _entries.pop(next(iter(_entries)))
+
+
+async def get_pull_requests(
+        kind: str,
+        github_login: str,
+        args: tp.Tuple,
+        fetch: tp.Callable[[], tp.Awaitable[tp.List[github.PullRequest]]],
+        ctx,
+) -> tp.List[github.PullRequest]:
+    _evict(ctx)
+    key = (kind, github_login, args)
+    entry = _entries.get(key)
+    if entry is not None:
+        _counts['hits'] += 1
+        metrics.RESULT_CACHE.inc(kind, 'hit')
+        return entry.pull_requests
+
+    _counts['misses'] += 1
+    metrics.RESULT_CACHE.inc(kind, 'miss')
+    pull_requests = await fetch()
+    _entries[key] = _Entry(pull_requests)
+    return pull_requests
+
+
+# a pr has changed, e.g. merged with new reviews
+def invalidate(
+        pull_request: github.PullRequest, github_logins: tp.Iterable[str],
+) -> None:
+    slug = (pull_request.owner, pull_request.repo, pull_request.number)
+    logins = set(github_logins)
+    for key in [
+            key
+            for key, entry in _entries.items()
+            if key[1] in logins or slug in entry.slugs
+    ]:
+        _entries.pop(key)
+
+
+def get_stats() -> tp.Dict[str, float]:
+    requests = _counts['hits'] + _counts['misses']
+    return {
+        'entries': float(len(_entries)),
+        'hit_ratio': _counts['hits'] / requests if requests else 0.0,
+    }
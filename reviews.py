@@ -3,6 +3,7 @@ import logging
 import typing as tp
 
 import github
+import result_cache
 import storage
 import telegram
 
@@ -28,8 +29,14 @@ async def _show(
 
     prs_to_close = []
     if show_to_close:
-        prs_to_close = await github.get_abandoned_prs(
-            github_login, dt.timedelta(days=14), ctx,  # config
+        prs_to_close = await result_cache.get_pull_requests(
+            'abandoned',
+            github_login,
+            (),
+            lambda: github.get_abandoned_prs(
+                github_login, dt.timedelta(days=14), ctx,  # config
+            ),
+            ctx,
         )
 
     if not prs and not prs_to_close:
@@ -47,18 +54,30 @@ async def _show(
 async def show_requested(
         github_login: str, chat_id: str, show_to_close: bool, ctx,
 ) -> bool:
-    prs = await github.get_requested_reviews(github_login, ctx)
+    prs = await result_cache.get_pull_requests(
+        'requested',
+        github_login,
+        (),
+        lambda: github.get_requested_reviews(github_login, ctx),
+        ctx,
+    )
 
     return await _show(prs, github_login, chat_id, show_to_close, ctx)
 
 
 async def get_current(github_login: str, chat_id: str, ctx) -> bool:
     now = dt.datetime.utcnow()
-    prs = await github.get_reviewed_prs(
+    prs = await result_cache.get_pull_requests(
+        'current',
         github_login,
-        now - dt.timedelta(days=10),  # TODO config
-        now,
-        False,
+        (),
+        lambda: github.get_reviewed_prs(
+            github_login,
+            now - dt.timedelta(days=10),  # TODO config
+            now,
+            False,
+            ctx,
+        ),
         ctx,
     )
     return await _show(prs, github_login, chat_id, False, ctx)
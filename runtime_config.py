@@ -0,0 +1,67 @@
+# the settings edited at runtime in reviews.key_value, parsed once into
+# ctx.runtime_config and shared by every loop; reloaded after
+# runtime_config_ttl or right after a NOTIFY from the key_value trigger
+import dataclasses
+import json
+import logging
+import time
+import typing as tp
+
+import storage
+
+
+logger = logging.getLogger()
+
+CHANNEL = 'reviews_key_value'  # see schema.sql
+
+_PARTNER_PRODUCT_LOGINS = 'partner_product_logins'  # a json list
+KEYS = (_PARTNER_PRODUCT_LOGINS,)
+
+
+@dataclasses.dataclass(frozen=True)
+class RuntimeConfig:
+    partner_product_logins: tp.FrozenSet[str]
+    loaded_at: float  # time.monotonic()
+
+    @classmethod
+    def from_values(
+            cls, values: tp.Dict[str, str], loaded_at: float,
+    ) -> 'RuntimeConfig':
+        logins = values.get(_PARTNER_PRODUCT_LOGINS)
+        return cls(
+            partner_product_logins=frozenset(
+                json.loads(logins) if logins else (),
+            ),
+            loaded_at=loaded_at,
+        )
+
+
+def _is_fresh(runtime: tp.Optional[RuntimeConfig], ctx) -> bool:
+    return runtime is not None and (
+        time.monotonic() - runtime.loaded_at
+        < ctx.config.runtime_config_ttl.total_seconds()
+    )
+
+
+async def get_runtime_config(ctx) -> RuntimeConfig:
+    if not _is_fresh(ctx.runtime_config, ctx):
+        async with ctx.pool.acquire() as conn:
+            values = await storage.get_key_values(KEYS, conn)
+        ctx.runtime_config = RuntimeConfig.from_values(
+            values, time.monotonic(),
+        )
+        logger.info(
+            'runtime config loaded, %s partner product logins',
+            len(ctx.runtime_config.partner_product_logins),
+        )
+    return ctx.runtime_config
+
+
+# on ctx.conn, it stays open for the whole run
+async def listen(ctx) -> None:
+    def _on_notify(conn, pid, channel, key) -> None:
+        if key in KEYS:
+            logger.info('runtime config key %s changed', key)
+            ctx.runtime_config = None
+
+    await ctx.conn.add_listener(CHANNEL, _on_notify)
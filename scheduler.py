@@ -0,0 +1,271 @@
+import asyncio
+import datetime as dt
+import logging
+import random
+import time
+import typing as tp
+
+import metrics
+import tracing
+
+
+logger = logging.getLogger()
+
+
+# fires at multiples of delta counted from the local midnight
+class IntervalTrigger:
+    def __init__(
+            self, delta: dt.timedelta, offset: dt.timedelta = dt.timedelta(),
+    ):
+        self.delta = delta
+        self.offset = offset
+
+    def next_fire(self, after: dt.datetime) -> dt.datetime:
+        midnight = after.replace(hour=0, minute=0, second=0, microsecond=0)
+        rounds = (after - midnight - self.offset) // self.delta + 1
+        return midnight + self.offset + rounds * self.delta
+
+    def __str__(self):
+        return f'each {self.delta}'
+
+
+# weekday/hour/minute, None means "any", like in crontab
+class CronTrigger:
+    def __init__(
+            self,
+            *,
+            weekday: tp.Optional[int] = None,
+            hour: tp.Optional[int] = None,
+            minute: int = 0,
+    ):
+        self.weekday = weekday
+        self.hour = hour
+        self.minute = minute
+
+    def next_fire(self, after: dt.datetime) -> dt.datetime:
+        result = after.replace(second=0, microsecond=0)
+        result = result.replace(minute=self.minute)
+        if result <= after:
+            result += dt.timedelta(hours=1)
+        # at most a week of hourly steps
+        for _ in range(24 * 8):
+            if (self.hour is None or result.hour == self.hour) and (
+                self.weekday is None or result.weekday() == self.weekday
+            ):
+                return result
+            result += dt.timedelta(hours=1)
+        raise ValueError(f'no fire time for {self}')
+
+    def __str__(self):
+        return (
+            f'cron weekday={self.weekday}, hour={self.hour}'
+            f', minute={self.minute}'
+        )
+
+
+class JobStats:
+    __slots__ = (
+        'runs',
+        'failures',
+        'skipped',
+        'missed',
+        'running',
+        'last_duration',
+        'max_duration',
+        'total_duration',
+        'last_lag',
+        'max_lag',
+        'last_error',
+    )
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0  # the previous run was still in progress
+        self.missed = 0  # woke up later than misfire_grace
+        self.running = False
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_error: tp.Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class Job:
+    def __init__(
+            self,
+            func: tp.Callable[[tp.Any], tp.Awaitable[None]],
+            trigger: tp.Optional[tp.Union[IntervalTrigger, CronTrigger]],
+            jitter: dt.timedelta,
+            misfire_grace: dt.timedelta,
+            catch_up: bool,
+    ):
+        self.name = func.__name__
+        self.func = func
+        self.trigger = trigger  # None for back-to-back runs (long polling)
+        self.jitter = jitter
+        self.misfire_grace = misfire_grace
+        self.catch_up = catch_up
+        self.stats = JobStats()
+
+
+class Scheduler:
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self._config = ctx.config
+        self.jobs: tp.List[Job] = []
+
+    def add_job(
+            self,
+            func: tp.Callable[[tp.Any], tp.Awaitable[None]],
+            trigger: tp.Optional[tp.Union[IntervalTrigger, CronTrigger]],
+            *,
+            jitter: dt.timedelta = dt.timedelta(),
+            misfire_grace: tp.Optional[dt.timedelta] = None,
+            catch_up: bool = False,
+    ) -> Job:
+        job = Job(
+            func,
+            trigger,
+            jitter,
+            (
+                misfire_grace
+                if misfire_grace is not None
+                else self._config.scheduler_misfire_grace
+            ),
+            catch_up,
+        )
+        self.jobs.append(job)
+        return job
+
+    def get_stats(self) -> tp.Dict[str, dict]:
+        return {job.name: job.stats.to_dict() for job in self.jobs}
+
+    def _now(self) -> dt.datetime:
+        return dt.datetime.now(self._config.timezone)
+
+    async def _sleep_until(self, moment: dt.datetime) -> None:
+        # asyncio.sleep may wake up a bit early, wall clock may jump
+        while True:
+            secs = (moment - self._now()).total_seconds()
+            if secs <= 0:
+                return
+            await asyncio.sleep(secs)
+
+    async def _invoke(self, job: Job, lag: float) -> bool:
+        stats = job.stats
+        stats.running = True
+        stats.last_lag = lag
+        stats.max_lag = max(stats.max_lag, lag)
+        started = time.monotonic()
+        status = 'ok'
+        try:
+            with tracing.span(f'job {job.name}'):
+                await job.func(self._ctx)
+            return True
+        except asyncio.CancelledError:
+            status = 'cancelled'
+            raise
+        except Exception as exc:
+            status = 'error'
+            stats.failures += 1
+            stats.last_error = repr(exc)
+            logger.exception(f'Exception during {job.name} iteration.')
+            return False
+        finally:
+            duration = time.monotonic() - started
+            metrics.JOB_RUNS.inc(job.name, status)
+            metrics.JOB_DURATION.observe(duration, job.name)
+            stats.running = False
+            stats.runs += 1
+            stats.last_duration = duration
+            stats.max_duration = max(stats.max_duration, duration)
+            stats.total_duration += duration
+            if job.trigger is not None:
+                logger.info(
+                    f'job {job.name} finished in {duration:.1f}s'
+                    f', lag {lag:.1f}s, failures {stats.failures}'
+                    f', skipped {stats.skipped}, missed {stats.missed}',
+                )
+
+    async def _run_continuous(self, job: Job) -> None:
+        retry = self._config.scheduler_retry_delay
+        while True:
+            if await self._invoke(job, 0.0):
+                retry = self._config.scheduler_retry_delay
+                continue
+            await asyncio.sleep(retry.total_seconds())
+            retry = min(retry * 2, self._config.scheduler_retry_delay_max)
+
+    async def _run_scheduled(self, job: Job) -> None:
+        trigger = job.trigger
+        assert trigger is not None
+        stats = job.stats
+        running: tp.Optional[asyncio.Future] = None
+        pending_catch_up = False
+
+        scheduled = trigger.next_fire(self._now())
+        while True:
+            delay = dt.timedelta(
+                seconds=random.uniform(0, job.jitter.total_seconds()),
+            )
+            await self._sleep_until(scheduled + delay)
+
+            if running is not None and not running.done():
+                if job.catch_up and not pending_catch_up:
+                    pending_catch_up = True
+                    running = asyncio.ensure_future(
+                        self._catch_up(job, running, scheduled + delay),
+                    )
+                elif job.catch_up:
+                    # coalesced into the already pending catch-up run
+                    stats.skipped += 1
+                    logger.info(
+                        f'job {job.name} catch-up is pending'
+                        f', slot {scheduled.isoformat()} coalesced',
+                    )
+                else:
+                    stats.skipped += 1
+                    logger.warning(
+                        f'job {job.name} is still running'
+                        f', slot {scheduled.isoformat()} skipped',
+                    )
+            else:
+                pending_catch_up = False
+                lag = (self._now() - scheduled - delay).total_seconds()
+                if lag > job.misfire_grace.total_seconds() and not job.catch_up:
+                    stats.missed += 1
+                    logger.warning(
+                        f'job {job.name} misfired by {lag:.1f}s'
+                        f', slot {scheduled.isoformat()} skipped',
+                    )
+                else:
+                    running = asyncio.ensure_future(self._invoke(job, lag))
+
+            now = self._now()
+            next_scheduled = trigger.next_fire(scheduled)
+            # the loop itself was blocked for longer than a period
+            while next_scheduled < now - job.misfire_grace:
+                stats.missed += 1
+                next_scheduled = trigger.next_fire(next_scheduled)
+            scheduled = next_scheduled
+
+    async def _catch_up(
+            self, job: Job, running: asyncio.Future, scheduled: dt.datetime,
+    ) -> None:
+        await asyncio.wait([running])
+        await self._invoke(job, (self._now() - scheduled).total_seconds())
+
+    async def _run_job(self, job: Job) -> None:
+        logger.info(f'job {job.name} scheduled: {job.trigger or "loop"}')
+        if job.trigger is None:
+            await self._run_continuous(job)
+        else:
+            await self._run_scheduled(job)
+
+    async def run(self) -> None:
+        await asyncio.gather(*[self._run_job(job) for job in self.jobs])
@@ -24,6 +24,10 @@ CREATE TABLE IF NOT EXISTS reviews.processed_prs (
   PRIMARY KEY(owner, repo, number)
 );
 
+-- monthly partitions review_stats_pYYYYMM by review_at, created ahead and
+-- moved to reviews_archive past the retention by loop_partitions.py; an
+-- existing unpartitioned table stays as it is here, migrate_stats.py
+-- converts it online
 CREATE TABLE IF NOT EXISTS reviews.review_stats (
   owner     TEXT NOT NULL,
   repo      TEXT NOT NULL,
@@ -33,15 +37,65 @@ CREATE TABLE IF NOT EXISTS reviews.review_stats (
   review_at TIMESTAMPTZ,
   event_at  TIMESTAMPTZ DEFAULT NOW() AT TIME ZONE 'UTC',
   PRIMARY KEY(owner, repo, number, review_at)
+) PARTITION BY RANGE (review_at);
+
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1
+    FROM pg_partitioned_table
+    WHERE partrelid = 'reviews.review_stats'::regclass
+  ) THEN
+    -- the rows of the months without a partition yet
+    CREATE TABLE IF NOT EXISTS reviews.review_stats_default
+      PARTITION OF reviews.review_stats DEFAULT;
+    -- get_times and friends, an index-only scan of the months in the range
+    CREATE INDEX IF NOT EXISTS idx_stats_by_reviewer_time ON reviews.review_stats (reviewer, review_at) INCLUDE (minutes);
+  ELSE
+    -- not migrated yet, the index name is taken by migrate_stats.py
+    CREATE INDEX IF NOT EXISTS idx_stats_by_reviewers ON reviews.review_stats (reviewer, event_at);
+    RAISE NOTICE 'reviews.review_stats is not partitioned, run migrate_stats.py';
+  END IF;
+END;
+$$;
+
+CREATE SCHEMA IF NOT EXISTS reviews_archive;
+
+-- parsed timeline events per pr, the arrays are parallel
+CREATE TABLE IF NOT EXISTS reviews.pr_events (
+  owner         TEXT NOT NULL,
+  repo          TEXT NOT NULL,
+  number        INTEGER NOT NULL,
+  types         SMALLINT[] NOT NULL,
+  reviewers     TEXT[] NOT NULL,
+  event_ats     TIMESTAMPTZ[] NOT NULL,
+  last_event_at TIMESTAMPTZ,
+  PRIMARY KEY(owner, repo, number)
 );
 
-CREATE INDEX IF NOT EXISTS idx_stats_by_reviewers ON reviews.review_stats (reviewer, event_at);
+CREATE INDEX IF NOT EXISTS idx_pr_events_by_time ON reviews.pr_events (owner, repo, last_event_at);
 
 CREATE TABLE IF NOT EXISTS reviews.key_value (
   key       TEXT PRIMARY KEY,
   value     TEXT NOT NULL
 );
 
+-- runtime_config.py reloads on these, tg_update_offset changes too often
+CREATE OR REPLACE FUNCTION reviews.notify_key_value() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF COALESCE(NEW.key, OLD.key) <> 'tg_update_offset' THEN
+    PERFORM pg_notify('reviews_key_value', COALESCE(NEW.key, OLD.key));
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS notify_key_value ON reviews.key_value;
+CREATE TRIGGER notify_key_value
+AFTER INSERT OR UPDATE OR DELETE ON reviews.key_value
+FOR EACH ROW EXECUTE FUNCTION reviews.notify_key_value();
+
 CREATE TABLE IF NOT EXISTS reviews.users_logins (
   staff_login     TEXT PRIMARY KEY,
   telegram_login  TEXT NOT NULL UNIQUE
@@ -64,13 +118,51 @@ CREATE TABLE IF NOT EXISTS reviews.users_settings (
 
 CREATE TABLE IF NOT EXISTS reviews.cache_gaps (
   staff_login   TEXT PRIMARY KEY,
-  gaps          JSONB NOT NULL DEFAULT '[]'::JSONB
+  gaps          JSONB NOT NULL DEFAULT '[]'::JSONB,
+  gaps_hash     TEXT
+);
+
+ALTER TABLE reviews.cache_gaps ADD COLUMN IF NOT EXISTS gaps_hash TEXT;
+
+-- the last hourly digest sent to each user, loop_notify skips or edits the
+-- ones with the same prs and last reviewed commits
+CREATE TABLE IF NOT EXISTS reviews.notify_digests (
+  staff_login   TEXT PRIMARY KEY,
+  chat_id       TEXT NOT NULL,
+  fingerprint   TEXT NOT NULL,
+  text_hash     TEXT NOT NULL,
+  message_id    BIGINT,
+  sent_at       TIMESTAMPTZ NOT NULL
+);
+
+-- the instance that inserted (staff_login, hour_start) sends that digest,
+-- the others skip it while they disagree on the cluster membership
+CREATE TABLE IF NOT EXISTS reviews.notify_claims (
+  staff_login   TEXT NOT NULL,
+  hour_start    TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY(staff_login, hour_start)
 );
 
-CREATE TABLE IF NOT EXISTS reviews.subordinated (
+-- the whole organization, rewritten by loop_chiefs
+CREATE TABLE IF NOT EXISTS reviews.staff_chiefs (
   staff_login   TEXT PRIMARY KEY,
-  nearest       TEXT[],
-  all           TEXT[]
+  chief_login   TEXT
+);
+
+-- recursive subordinates lookups in storage.py go down from a chief
+CREATE INDEX IF NOT EXISTS idx_staff_chiefs_by_chief ON reviews.staff_chiefs (chief_login, staff_login);
+
+-- chains of chiefs (nearest first) of the persons missing in staff_chiefs
+CREATE TABLE IF NOT EXISTS reviews.chiefs_cache (
+  staff_login   TEXT PRIMARY KEY,
+  chiefs        TEXT[] NOT NULL,
+  updated_at    TIMESTAMPTZ NOT NULL
+);
+
+-- running bot instances, see cluster.py
+CREATE TABLE IF NOT EXISTS reviews.instances (
+  instance_id    TEXT PRIMARY KEY,
+  heartbeat_at   TIMESTAMPTZ NOT NULL
 );
 
 CREATE TABLE IF NOT EXISTS reviews.nda_links (
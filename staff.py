@@ -1,14 +1,20 @@
+import asyncio
 import datetime as dt
 import itertools
 import logging
 import typing as tp
 
+import metrics
+import orgtree
+import runtime_config
 import storage
 
 _STAFF_API_PREFIX = 'https://nda.ya.ru/t/OkwP-QZh5pPZcd'
 _CHUNK_SIZE = 30
+_DUMP_CHUNK_SIZE = 1000
 
 _GAP_API_PREFIX = 'https://nda.ya.ru/t/4QEPWJCG5pPZdp'
+metrics.register_service('staff', _STAFF_API_PREFIX, _GAP_API_PREFIX)
 
 
 logger = logging.getLogger()
@@ -32,38 +38,111 @@ async def _get_staff_login_api(telegram_login: str, ctx) -> str:
     return response_json['login']
 
 
-async def get_subordinated_nearest(staff_login: str, ctx) -> tp.List[str]:
-    response = await ctx.session.get(
-        f'{_STAFF_API_PREFIX}/persons',
-        params={
-            'chief.login': staff_login,
-            'official.is_dismissed': 'false',
-            '_fields': 'login',
-        },
-        headers={'Authorization': f'OAuth {ctx.staff_token}'},
-    )
-    response_json = await response.json()
-    return [item['login'] for item in response_json['result']]
+async def _get_page(
+        url: str,
+        params: tp.Optional[dict],
+        semaphore: asyncio.Semaphore,
+        ctx,
+) -> dict:
+    async with semaphore:
+        response = await ctx.session.get(
+            url,
+            params=params,
+            headers={'Authorization': f'OAuth {ctx.staff_token}'},
+        )
+        return await response.json()
+
 
+class StaffPaginationError(Exception):
+    pass
 
-async def get_subordinated_all(staff_login: str, ctx) -> tp.List[str]:
-    result: tp.List[str] = []
 
-    next_link: tp.Optional[str] = (
-        f'{_STAFF_API_PREFIX}/persons'
-        f'?_fields=login'
-        f'&chiefs.login={staff_login}'
-        f'&official.is_dismissed=false'
-        f'&_limit={_CHUNK_SIZE}'
+# the same person may come twice if the data changed between the pages
+def _unique(items: tp.List[dict]) -> tp.List[dict]:
+    return list({item['login']: item for item in items}.values())
+
+
+async def _follow_links(
+        url: str, params: dict, semaphore: asyncio.Semaphore, ctx,
+) -> tp.Tuple[tp.List[dict], int]:
+    response_json = await _get_page(
+        url, {**params, '_page': 1}, semaphore, ctx,
     )
+    result: tp.List[dict] = list(response_json['result'])
+    total: int = response_json.get('total') or 0
+    next_link = response_json.get('links', {}).get('next', None)
     while next_link is not None:
-        response = await ctx.session.get(
-            next_link, headers={'Authorization': f'OAuth {ctx.staff_token}'},
-        )
-        response_json = await response.json()
-        result.extend([item['login'] for item in response_json['result']])
+        response_json = await _get_page(next_link, None, semaphore, ctx)
+        result.extend(response_json['result'])
+        next_link = response_json.get('links', {}).get('next', None)
+    return result, total
+
+
+# reads the number of pages from the first one, the rest go in parallel;
+# short of the total, walks the next links from the first page once more
+# and raises StaffPaginationError if it is still short
+async def _get_all_pages(
+        params: dict, semaphore: asyncio.Semaphore, ctx,
+) -> tp.List[dict]:
+    url = f'{_STAFF_API_PREFIX}/persons'
+    first = await _get_page(url, {**params, '_page': 1}, semaphore, ctx)
+    result: tp.List[dict] = list(first['result'])
+
+    pages: int = first.get('pages') or 1
+    responses = await asyncio.gather(
+        *[
+            _get_page(url, {**params, '_page': page}, semaphore, ctx)
+            for page in range(2, pages + 1)
+        ],
+    )
+    for response_json in responses:
+        result.extend(response_json['result'])
+
+    # the data grew between the requests, more pages after the last one
+    last = responses[-1] if responses else first
+    next_link = last.get('links', {}).get('next', None)
+    if next_link:
+        logger.warning(f'staff pagination has more pages: {next_link}')
+    while next_link is not None:
+        response_json = await _get_page(next_link, None, semaphore, ctx)
+        result.extend(response_json['result'])
         next_link = response_json.get('links', {}).get('next', None)
 
+    items = _unique(result)
+    total: int = first.get('total') or 0
+    if len(items) < total:
+        # a page came truncated
+        logger.warning(
+            f'staff pagination got {len(items)} of {total}'
+            ', walk the next links from the first page',
+        )
+        result, total = await _follow_links(url, params, semaphore, ctx)
+        items = _unique(result)
+        if len(items) < total:
+            raise StaffPaginationError(
+                f'staff pagination got {len(items)} of {total}',
+            )
+
+    return items
+
+
+# staff_login -> chief_login for the whole organization
+async def get_all_chiefs(ctx) -> tp.Dict[str, tp.Optional[str]]:
+    semaphore = asyncio.Semaphore(ctx.config.staff_concurrency)
+    items = await _get_all_pages(
+        {
+            '_fields': 'login,chief.login',
+            'official.is_dismissed': 'false',
+            '_limit': _DUMP_CHUNK_SIZE,
+        },
+        semaphore,
+        ctx,
+    )
+
+    result: tp.Dict[str, tp.Optional[str]] = {}
+    for item in items:
+        chief = item.get('chief')
+        result[item['login']] = chief['login'] if chief else None
     return result
 
 
@@ -137,13 +216,16 @@ async def get_telegram_login(staff_login: str, ctx) -> tp.Optional[str]:
 async def get_telegram_login_with_pg(
         staff_login: str, ctx,
 ) -> tp.Optional[str]:
-    tg_login_pg = await storage.get_telegram_login_pg(staff_login, ctx.conn)
+    # concurrent callers, ctx.conn can't be shared
+    async with ctx.pool.acquire() as conn:
+        tg_login_pg = await storage.get_telegram_login_pg(staff_login, conn)
     if tg_login_pg:
         return tg_login_pg
 
     tg_login = await get_telegram_login(staff_login, ctx)
     if tg_login:
-        await storage.save_user_mappings(staff_login, tg_login, None, ctx.conn)
+        async with ctx.pool.acquire() as conn:
+            await storage.save_user_mappings(staff_login, tg_login, None, conn)
 
     return tg_login
 
@@ -152,37 +234,41 @@ async def get_telegram_logins(
         staff_logins: tp.Iterable[str], ctx,
 ) -> tp.Dict[str, tp.Set[str]]:
     result: tp.Dict[str, tp.Set[str]] = {}
+    semaphore = asyncio.Semaphore(ctx.config.staff_concurrency)
 
     chunks = [iter(staff_logins)] * _CHUNK_SIZE
-    for chunk in itertools.zip_longest(*chunks):
-        response = await ctx.session.get(
-            f'{_STAFF_API_PREFIX}/persons',
-            params={
-                'login': ','.join(
-                    [item for item in chunk if item is not None],
-                ),
-                'official.is_dismissed': 'false',
-                '_fields': 'login,telegram_accounts',
-            },
-            headers={'Authorization': f'OAuth {ctx.staff_token}'},
-        )
-        response_json = await response.json()
-        for item in response_json['result']:
+    responses = await asyncio.gather(
+        *[
+            _get_all_pages(
+                {
+                    'login': ','.join(
+                        [item for item in chunk if item is not None],
+                    ),
+                    'official.is_dismissed': 'false',
+                    '_fields': 'login,telegram_accounts',
+                    '_limit': _CHUNK_SIZE,
+                },
+                semaphore,
+                ctx,
+            )
+            for chunk in itertools.zip_longest(*chunks)
+        ],
+    )
+    for items in responses:
+        for item in items:
             tg_logins: tp.Set[str] = set()
             for tg_item in item['telegram_accounts']:
                 tg_logins.add(tg_item['value_lower'])
             result[item['login']] = tg_logins
 
-        # TODO - backup pagination plan
-        # next_link = response_json.get('links', {}).get('next', '')
-
     return result
 
 
+# None if the gaps api failed, don't overwrite the cache then
 async def get_absent_time(
         staff_login: str, date_from: dt.date, date_to: dt.date, ctx,
-) -> tp.List[tp.Tuple[dt.datetime, dt.datetime]]:
-    try:
+) -> tp.Optional[tp.List[tp.Tuple[dt.datetime, dt.datetime]]]:
+    async def _request() -> dict:
         response = await ctx.session.get(
             f'{_GAP_API_PREFIX}/api/gaps_find/',
             params={
@@ -192,53 +278,73 @@ async def get_absent_time(
             },
             headers={'Authorization': f'OAuth {ctx.staff_token}'},
         )
-    except BaseException:
-        logger.warning('error during gaps api request')
-        return []
+        return await response.json()
 
-    response_json = await response.json()
-    gaps = response_json['gaps']
+    try:
+        response_json = await asyncio.wait_for(
+            _request(), ctx.config.gaps_request_timeout.total_seconds(),
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.warning(f'error during gaps api request for {staff_login}')
+        return None
 
     result: tp.List[tp.Tuple[dt.datetime, dt.datetime]] = []
-    for gap in gaps:
-        if gap.get('work_in_absence'):
-            continue
-
-        result.append(
-            (
-                dt.datetime.fromisoformat(gap['date_from']),
-                dt.datetime.fromisoformat(gap['date_to']),
-            ),
+    try:
+        for gap in response_json['gaps']:
+            if gap.get('work_in_absence'):
+                continue
+
+            result.append(
+                (
+                    dt.datetime.fromisoformat(gap['date_from']),
+                    dt.datetime.fromisoformat(gap['date_to']),
+                ),
+            )
+    except (KeyError, TypeError, ValueError, AttributeError):
+        logger.warning(
+            f'malformed gaps api response for {staff_login}: {response_json}',
         )
+        return None
 
     return result
 
 
-async def get_fellow_authors(staff_login: str, rng: int, ctx) -> tp.Set[str]:
-    subs_both = await storage.get_subordinated(staff_login, ctx.conn)
-
-    if subs_both:
-        if rng == 0:
-            subs_both[1].discard(staff_login)
-            return subs_both[1]
-
-        rng -= 1
-
+# nearest first
+async def _get_chiefs_api(staff_login: str, ctx) -> tp.List[str]:
     response = await ctx.session.get(
         f'{_STAFF_API_PREFIX}/persons',
         params={'login': staff_login, '_fields': 'chiefs.login'},
         headers={'Authorization': f'OAuth {ctx.staff_token}'},
     )
     response_json = await response.json()
-    chief_login = response_json['result'][0]['chiefs'][rng]['login']
+    if not response_json.get('result'):
+        logger.warning(f'no chiefs found for {staff_login}')
+        return []
+    return [chief['login'] for chief in response_json['result'][0]['chiefs']]
+
 
-    subs_both = await storage.get_subordinated(chief_login, ctx.conn)
-    if not subs_both:
-        return set()
+# the org tree first, the staff api only for the persons missing there,
+# cached in the tree and in pg till the next loop_chiefs dump
+async def get_chiefs(staff_login: str, ctx) -> tp.Tuple[str, ...]:
+    tree = await orgtree.get_tree(ctx)
+    if staff_login in tree:
+        return tree.get_chiefs(staff_login)
 
-    subs_both[1].discard(staff_login)
-    return subs_both[1]
+    chiefs = await _get_chiefs_api(staff_login, ctx)
+    async with ctx.pool.acquire() as conn:
+        await storage.save_chiefs_cache(staff_login, chiefs, conn)
+    tree.add_person(staff_login, chiefs)
+    return tuple(chiefs)
+
+
+async def get_fellow_authors(staff_login: str, rng: int, ctx) -> tp.Set[str]:
+    await get_chiefs(staff_login, ctx)
+    tree = await orgtree.get_tree(ctx)
+    return tree.get_team(staff_login, rng)
 
 
-async def is_partner_product(staff_login: str, conn) -> bool:
-    return staff_login in await storage.get_partner_product_logins(conn)
+async def is_partner_product(staff_login: str, ctx) -> bool:
+    runtime = await runtime_config.get_runtime_config(ctx)
+    return staff_login in runtime.partner_product_logins
@@ -0,0 +1,143 @@
+# the storage.py queries, each one declared once with register(); the pool
+# init hook adds a query logger to the connections, so every statement gets
+# its latency histogram and errors in metrics.py and the slow ones are
+# logged with a captured plan, EXPLAIN ANALYZE for the reads only
+#
+# asyncpg already prepares a query once per connection and reuses it from
+# its statement cache by the text, so the texts here are constant
+import asyncio
+import json
+import logging
+import re
+import time
+import typing as tp
+
+import metrics
+
+logger = logging.getLogger()
+
+# query text -> statement name
+_NAMES: tp.Dict[str, str] = {}
+
+
+def register(name: str, query: str) -> str:
+    if query in _NAMES or name in _NAMES.values():
+        raise ValueError(f'statement {name} is already registered')
+    _NAMES[query] = name
+    return query
+
+
+# a write anywhere, also in a cte or as a row lock
+_WRITE = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|SHARE)\b', re.IGNORECASE)
+
+
+def _is_read_only(query: str) -> bool:
+    return (
+        query.lstrip().upper().startswith(('SELECT', 'WITH'))
+        and not _WRITE.search(query)
+    )
+
+
+class _SlowLog:
+    def __init__(
+            self,
+            pool,
+            threshold: float,
+            explain_interval: float,
+            explain_timeout: float,
+    ):
+        self._pool = pool
+        self.threshold = threshold
+        self._explain_interval = explain_interval
+        self._explain_timeout = explain_timeout
+        # statement name -> time.monotonic() of the last plan
+        self._explained_at: tp.Dict[str, float] = {}
+
+    def _should_explain(self, name: str) -> bool:
+        now = time.monotonic()
+        explained_at = self._explained_at.get(name)
+        if explained_at is not None and (
+                now - explained_at < self._explain_interval
+        ):
+            return False
+        self._explained_at[name] = now
+        return True
+
+    # another connection, the one of the query is still busy with its caller
+    async def explain(self, query: str, args: tuple) -> tp.Any:
+        # ANALYZE runs the statement once more: not the writes, they would
+        # repeat the work and take the row locks on a path already slow
+        if _is_read_only(query):
+            explain = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)'
+        else:
+            explain = 'EXPLAIN (FORMAT JSON)'
+        async with self._pool.acquire() as conn:
+            # nothing is kept
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                await conn.execute(
+                    f'SET LOCAL statement_timeout = '
+                    f'{int(self._explain_timeout * 1000)};',
+                )
+                plan = await conn.fetchval(
+                    f'{explain} {query}', *args,
+                )
+            finally:
+                await transaction.rollback()
+        return json.loads(plan)
+
+    async def log(self, name: str, record) -> None:
+        plan = None
+        if self._should_explain(name):
+            try:
+                plan = await self.explain(record.query, record.args)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('failed to explain statement %s', name)
+        logger.warning(
+            'slow statement %s: %.3f s, plan = %s',
+            name,
+            record.elapsed,
+            json.dumps(plan, separators=(',', ':')) if plan else None,
+        )
+
+
+_slow_log: tp.Optional[_SlowLog] = None
+# the running slow logs, the loop keeps only weak references to tasks
+_log_tasks: tp.Set[asyncio.Future] = set()
+
+
+def _on_query(record) -> None:
+    name = _NAMES.get(record.query)
+    if name is None:
+        return  # not from storage.py, e.g. the explains themselves
+    metrics.STATEMENT_DURATION.observe(record.elapsed, name)
+    if record.exception is not None:
+        metrics.STATEMENT_ERRORS.inc(name)
+    elif _slow_log is not None and record.elapsed >= _slow_log.threshold:
+        metrics.SLOW_STATEMENTS.inc(name)
+        task = asyncio.ensure_future(_slow_log.log(name, record))
+        _log_tasks.add(task)
+        task.add_done_callback(_log_tasks.discard)
+
+
+# asyncpg.create_pool(init=...), also for the connections out of the pool
+async def init_connection(conn) -> None:
+    conn.add_query_logger(_on_query)
+
+
+# threshold None disables the slow-query log
+def setup(
+        pool,
+        threshold: tp.Optional[float],
+        explain_interval: float,
+        explain_timeout: float,
+) -> None:
+    global _slow_log
+    _slow_log = (
+        _SlowLog(pool, threshold, explain_interval, explain_timeout)
+        if threshold is not None
+        else None
+    )
@@ -12,94 +12,90 @@ import storage
 logger = logging.getLogger()
 
 
-def _convert_to_events(
-        pr_events: tp.List[tp.Dict], author: str,
-) -> tp.List[events.Event]:
-    result: tp.List[events.Event] = []
-
-    for event in pr_events:
-        my_event = events.Event(event, author)
-        if my_event.is_ok:
-            result.append(my_event)
-            if my_event.is_terminal:
-                break
-
-    return result
-
-
-async def _get_review_events(
+async def get_review_events(
         pull_request: github.PullRequest, ctx,
-) -> tp.List[events.Event]:
+) -> events.EventBatch:
     author, pr_events = await github.get_timeline(pull_request, ctx)
-
-    result: tp.List[events.Event] = _convert_to_events(pr_events, author)
-
-    return result
+    return events.parse_timeline(pr_events, author)
 
 
 # reviewer_name -> minutes
-async def _get_review_times(
-        pull_request: github.PullRequest, ctx,
+def _get_review_times(
+        pull_request: github.PullRequest,
+        review_events: events.EventBatch,
+        config,
 ) -> tp.Dict[str, tp.List[tp.Dict]]:
     result: tp.Dict[
         str, tp.List[tp.Dict],
     ] = {}  # reviewer_login -> [{minutes: elapsed, review_at: submitted}, ...]
-    stacks: tp.Dict[str, dt.datetime] = {}  # reviewer_login -> last_requested
-
-    review_events = await _get_review_events(pull_request, ctx)
-
-    for event in review_events:
-        if not event or not event.reviewer:
+    stacks: tp.Dict[int, int] = {}  # reviewer_id -> last_requested timestamp
+
+    for event_type, reviewer_id, timestamp in zip(
+            review_events.types,
+            review_events.reviewers,
+            review_events.timestamps,
+    ):
+        if reviewer_id < 0:
             continue
-        if event.is_requested:
+        if event_type == events.REQUESTED:
             # it may be already there, will replace
-            stacks[event.reviewer] = event.event_at
+            stacks[reviewer_id] = timestamp
 
-        if event.is_removed:
+        elif event_type == events.REMOVED:
             # keep silence if it's not there
-            stacks.pop(event.reviewer, None)
+            stacks.pop(reviewer_id, None)
 
-        if event.is_reviewed:
-            begin = stacks.pop(event.reviewer, None)
-            if begin:
-                review_time: dt.timedelta = calendarm.get_working_time_between(
-                    begin, event.event_at, event.reviewer,
+        elif event_type == events.REVIEWED:
+            reviewer = review_events.logins[reviewer_id]
+            begin = stacks.pop(reviewer_id, None)
+            if begin is None:
+                logger.info(
+                    'non-requested review from %s on %s',
+                    reviewer,
+                    pull_request.get_short_slug(),
                 )
-                review_minutes = review_time // dt.timedelta(minutes=1)
-                if review_minutes == 0:
-                    logger.info(
-                        f'non-working-time review from {event.reviewer} '
-                        f'on {pull_request.get_short_slug()}, excluded',
-                    )
-                    continue
-                if (
-                        review_minutes < 15 or review_minutes > 5 * 9 * 60
-                ):  # config
-                    logger.info(
-                        f'outlier from {event.reviewer} '
-                        f'on {pull_request.get_short_slug()} : '
-                        f'{review_minutes} minutes',
-                    )
-                    continue
-                if event.reviewer not in result:
-                    result[event.reviewer] = []
-                result[event.reviewer].append(
-                    {'minutes': review_minutes, 'review_at': event.event_at},
+                continue
+
+            review_at = events.to_datetime(timestamp)
+            review_time: dt.timedelta = calendarm.get_working_time_between(
+                events.to_datetime(begin), review_at, reviewer,
+            )
+            review_minutes = review_time // dt.timedelta(minutes=1)
+            if review_minutes == 0:
+                logger.info(
+                    'non-working-time review from %s on %s, excluded',
+                    reviewer,
+                    pull_request.get_short_slug(),
                 )
-            else:
+                continue
+            if (
+                    review_minutes < config.min_review_minutes
+                    or review_minutes > config.max_review_minutes
+            ):
                 logger.info(
-                    f'non-requested review from {event.reviewer} '
-                    f'on {pull_request.get_short_slug()}',
+                    'outlier from %s on %s : %s minutes',
+                    reviewer,
+                    pull_request.get_short_slug(),
+                    review_minutes,
                 )
+                continue
+            if reviewer not in result:
+                result[reviewer] = []
+            result[reviewer].append(
+                {'minutes': review_minutes, 'review_at': review_at},
+            )
 
     return result
 
 
-async def get_review_stats(
-        pull_request: github.PullRequest, ctx,
+# no I/O here, used by both loop_stats and replay
+def get_review_stats(
+        pull_request: github.PullRequest,
+        review_events: events.EventBatch,
+        config,
 ) -> tp.List[tp.Dict]:
     result: tp.List[tp.Dict] = []
-    review_times = await _get_review_times(pull_request, ctx)
+    review_times = _get_review_times(pull_request, review_events, config)
     for reviewer, reviews in review_times.items():
         for review in reviews:
             result.append(
@@ -127,27 +123,31 @@ async def get_stats_to_show(
     times: tp.List[int] = await storage.get_times(
         staff_login, date_from, date_to, ctx.conn,
     )
-    logger.debug(f'{staff_login}: len(times) = {len(times)}')
+    logger.debug('%s: len(times) = %s', staff_login, len(times))
     if len(times) < 2:
         return None
 
     result = _calculate_stats(times)
-    logger.debug(f'{staff_login}: stats = {result}')
+    logger.debug('%s: stats = %s', staff_login, result)
 
     return result
 
 
-# TODO improve
 async def get_subordinated_stats_to_show(
-        subordinates: tp.Iterable[str],
+        staff_login: str,
+        is_nearest: bool,
         date_from: dt.datetime,
         date_to: dt.datetime,
-        ctx,
+        conn,
 ) -> dict:
+    times_by_login = await storage.get_subordinates_times(
+        staff_login, is_nearest, date_from, date_to, conn,
+    )
+
     result: dict = {}
-    for sub in sorted(subordinates):
-        stats = await get_stats_to_show(sub, date_from, date_to, ctx)
-        if stats:
-            result[sub] = stats
+    for sub in sorted(times_by_login):
+        times = times_by_login[sub]
+        if len(times) >= 2:
+            result[sub] = _calculate_stats(times)
 
     return result
@@ -1,46 +1,91 @@
 import datetime as dt
+import functools
 import json
+import re
 import typing as tp
 
+import events
 import github
+import metrics
+import statements
 
 
-async def get_cursor(owner: str, repo: str, conn) -> str:
-    _get_cursor_query = """
+# the conn of the functions below is either an asyncpg connection, then the
+# queries run, or a Backend with an async method per function taking the
+# same arguments without the conn, e.g. storage_memory.MemoryStorage
+class Backend:
+    pass
+
+
+def _dispatched(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if 'conn' in kwargs:
+            conn = kwargs.pop('conn')
+        else:
+            conn, args = args[-1], args[:-1]
+        if isinstance(conn, Backend):
+            return await getattr(conn, func.__name__)(*args, **kwargs)
+        return await func(*args, conn, **kwargs)
+
+    return wrapper
+
+
+_GET_CURSOR_QUERY = statements.register(
+    'get_cursor',
+    """
     SELECT cursor
     FROM reviews.cursors
     WHERE owner = $1 AND repo = $2;
-    """
-    row = await conn.fetchrow(_get_cursor_query, owner, repo)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_cursor(owner: str, repo: str, conn) -> str:
+    row = await conn.fetchrow(_GET_CURSOR_QUERY, owner, repo)
     return row.get('cursor') if row else None
 
 
-async def save_cursor(
-        cursor: str,
-        pull_request: github.PullRequest,
-        merged_at: dt.datetime,
-        conn,
-) -> None:
-    _save_cursor_query = """
+_SAVE_CURSOR_QUERY = statements.register(
+    'save_cursor',
+    """
     INSERT INTO reviews.cursors (owner, repo, cursor)
     VALUES ($1, $2, $3)
     ON CONFLICT (owner, repo) DO UPDATE
       SET cursor = $3
       WHERE reviews.cursors.owner = $1
         AND reviews.cursors.repo = $2;
-    """
-    await conn.execute(
-        _save_cursor_query, pull_request.owner, pull_request.repo, cursor,
-    )
+    """,
+)
 
-    _save_cursor_query_history = """
+
+_SAVE_CURSOR_QUERY_HISTORY = statements.register(
+    'save_cursor_history',
+    """
     INSERT INTO reviews.cursors_history
       (owner, repo, number, cursor, merged_at)
     VALUES ($1, $2, $3, $4, $5)
     ON CONFLICT DO NOTHING;
-    """
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def save_cursor(
+        cursor: str,
+        pull_request: github.PullRequest,
+        merged_at: dt.datetime,
+        conn,
+) -> None:
+    await conn.execute(
+        _SAVE_CURSOR_QUERY, pull_request.owner, pull_request.repo, cursor,
+    )
+
     await conn.execute(
-        _save_cursor_query_history,
+        _SAVE_CURSOR_QUERY_HISTORY,
         pull_request.owner,
         pull_request.repo,
         pull_request.number,
@@ -49,31 +94,45 @@ async def save_cursor(
     )
 
 
-async def mark_as_processed(pull_request: github.PullRequest, conn) -> None:
-    _set_pr_processed_query = """
+_SET_PR_PROCESSED_QUERY = statements.register(
+    'set_pr_processed',
+    """
     INSERT INTO reviews.processed_prs
       (owner, repo, number, event_at)
     VALUES ($1, $2, $3, NOW() AT TIME ZONE 'UTC')
     ON CONFLICT DO NOTHING;
-    """
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def mark_as_processed(pull_request: github.PullRequest, conn) -> None:
     await conn.execute(
-        _set_pr_processed_query,
+        _SET_PR_PROCESSED_QUERY,
         pull_request.owner,
         pull_request.repo,
         pull_request.number,
     )
 
 
-async def is_pr_processed(pull_request: github.PullRequest, conn) -> bool:
-    _check_pr_processed_query = """
+_CHECK_PR_PROCESSED_QUERY = statements.register(
+    'check_pr_processed',
+    """
     SELECT COUNT(*) = 1
     FROM reviews.processed_prs
     WHERE owner = $1
       AND repo = $2
       AND number = $3;
-    """
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def is_pr_processed(pull_request: github.PullRequest, conn) -> bool:
     row = await conn.fetchrow(
-        _check_pr_processed_query,
+        _CHECK_PR_PROCESSED_QUERY,
         pull_request.owner,
         pull_request.repo,
         pull_request.number,
@@ -81,10 +140,9 @@ async def is_pr_processed(pull_request: github.PullRequest, conn) -> bool:
     return row[0]
 
 
-async def save_times(
-        pull_request: github.PullRequest, pr_stats: tp.List[tp.Dict], conn,
-) -> None:
-    _save_stats_query = """
+_SAVE_STATS_QUERY = statements.register(
+    'save_stats',
+    """
     INSERT INTO reviews.review_stats
       (owner, repo, number, reviewer, minutes, review_at)
     VALUES (
@@ -96,7 +154,15 @@ async def save_times(
       UNNEST($6::TIMESTAMPTZ[])
     )
     ON CONFLICT DO NOTHING;
-    """
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def save_times(
+        pull_request: github.PullRequest, pr_stats: tp.List[tp.Dict], conn,
+) -> None:
     reviewers: list = []
     minutes: list = []
     review_ats: list = []
@@ -106,7 +172,7 @@ async def save_times(
         review_ats.append(item['review_at'])
 
     await conn.execute(
-        _save_stats_query,
+        _SAVE_STATS_QUERY,
         pull_request.owner,
         pull_request.repo,
         pull_request.number,
@@ -116,70 +182,390 @@ async def save_times(
     )
 
 
-async def get_partner_product_logins(conn) -> tp.List[str]:
-    _get_partner_product_logins = """
-    SELECT value
-    FROM reviews.key_value
-    WHERE reviews.key_value.key = 'partner_product_logins';
+_SAVE_EVENTS_QUERY = statements.register(
+    'save_events',
     """
-    row = await conn.fetchrow(_get_partner_product_logins)
-    if not row:
-        return []
+    INSERT INTO reviews.pr_events
+      (owner, repo, number, types, reviewers, event_ats, last_event_at)
+    VALUES ($1, $2, $3, $4::SMALLINT[], $5::TEXT[], $6::TIMESTAMPTZ[], $7)
+    ON CONFLICT (owner, repo, number) DO UPDATE
+      SET types = $4::SMALLINT[],
+          reviewers = $5::TEXT[],
+          event_ats = $6::TIMESTAMPTZ[],
+          last_event_at = $7
+    WHERE reviews.pr_events.owner = $1
+      AND reviews.pr_events.repo = $2
+      AND reviews.pr_events.number = $3;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def save_events(
+        pull_request: github.PullRequest,
+        review_events: events.EventBatch,
+        conn,
+) -> None:
+    await conn.execute(
+        _SAVE_EVENTS_QUERY,
+        pull_request.owner,
+        pull_request.repo,
+        pull_request.number,
+        list(review_events.types),
+        review_events.get_reviewers(),
+        review_events.get_event_ats(),
+        (
+            events.to_datetime(review_events.timestamps[-1])
+            if review_events
+            else None
+        ),
+    )
 
-    return json.loads(row['value'])
 
+_GET_EVENTS_QUERY = statements.register(
+    'get_events',
+    """
+    SELECT number, types, reviewers, event_ats
+    FROM reviews.pr_events
+    WHERE owner = $1
+      AND repo = $2
+      AND last_event_at BETWEEN $3 AND $4
+    ORDER BY number;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_events(
+        owner: str,
+        repo: str,
+        date_from: dt.datetime,
+        date_to: dt.datetime,
+        conn,
+) -> tp.List[tp.Tuple[int, tp.List[int], tp.List[str], tp.List[dt.datetime]]]:
+    rows = await conn.fetch(_GET_EVENTS_QUERY, owner, repo, date_from, date_to)
+    return [
+        (row['number'], row['types'], row['reviewers'], row['event_ats'])
+        for row in rows
+    ]
 
-async def get_tg_update_offset(conn) -> tp.Optional[int]:
-    _get_tg_update_offset = """
+
+_DELETE_STATS_QUERY = statements.register(
+    'delete_stats',
+    """
+    DELETE FROM reviews.review_stats
+    WHERE owner = $1
+      AND repo = $2
+      AND number = ANY($3::INTEGER[]);
+    """,
+)
+
+
+_INSERT_STATS_QUERY = statements.register(
+    'insert_stats',
+    """
+    INSERT INTO reviews.review_stats
+      (owner, repo, number, reviewer, minutes, review_at)
+    VALUES (
+      $1,
+      $2,
+      UNNEST($3::INTEGER[]),
+      UNNEST($4::TEXT[]),
+      UNNEST($5::INTEGER[]),
+      UNNEST($6::TIMESTAMPTZ[])
+    )
+    ON CONFLICT DO NOTHING;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def replace_times(
+        owner: str,
+        repo: str,
+        prs_stats: tp.List[tp.Tuple[int, tp.List[tp.Dict]]],
+        conn,
+) -> None:
+    numbers: list = []
+    reviewers: list = []
+    minutes: list = []
+    review_ats: list = []
+    for number, pr_stats in prs_stats:
+        for item in pr_stats:
+            numbers.append(number)
+            reviewers.append(item['reviewer'])
+            minutes.append(item['minutes'])
+            review_ats.append(item['review_at'])
+
+    async with conn.transaction():
+        await conn.execute(
+            _DELETE_STATS_QUERY,
+            owner,
+            repo,
+            [number for number, _ in prs_stats],
+        )
+        await conn.execute(
+            _INSERT_STATS_QUERY,
+            owner,
+            repo,
+            numbers,
+            reviewers,
+            minutes,
+            review_ats,
+        )
+
+
+# review_stats is partitioned by month of review_at (utc), the rows out of
+# the partitions go to review_stats_default
+_STATS_PARTITION = re.compile(r'^review_stats_p(\d{4})(\d{2})$')
+
+
+def _get_month_start(value: dt.datetime) -> dt.datetime:
+    value = value.astimezone(dt.timezone.utc)
+    return dt.datetime(value.year, value.month, 1, tzinfo=dt.timezone.utc)
+
+
+def _get_next_month(month_start: dt.datetime) -> dt.datetime:
+    return (month_start + dt.timedelta(days=32)).replace(day=1)
+
+
+# names and [begin, end) of the months from date_from to date_to
+def get_stats_partitions(
+        date_from: dt.datetime, date_to: dt.datetime,
+) -> tp.List[tp.Tuple[str, dt.datetime, dt.datetime]]:
+    result: tp.List[tp.Tuple[str, dt.datetime, dt.datetime]] = []
+    month_start = _get_month_start(date_from)
+    while month_start <= date_to:
+        next_month = _get_next_month(month_start)
+        result.append(
+            (f'review_stats_p{month_start:%Y%m}', month_start, next_month),
+        )
+        month_start = next_month
+    return result
+
+
+_GET_STATS_PARTITIONS_QUERY = statements.register(
+    'get_stats_partitions',
+    """
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+    JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+    WHERE pg_namespace.nspname = 'reviews'
+      AND parent.relname = $1;
+    """,
+)
+
+
+_IS_STATS_PARTITIONED_QUERY = statements.register(
+    'is_stats_partitioned',
+    """
+    SELECT EXISTS (
+      SELECT 1
+      FROM pg_partitioned_table
+      WHERE partrelid = 'reviews.review_stats'::regclass
+    );
+    """,
+)
+
+
+# false until migrate_stats.py has swapped in the partitioned table
+@metrics.timed_query
+@_dispatched
+async def is_stats_partitioned(conn) -> bool:
+    return await conn.fetchval(_IS_STATS_PARTITIONED_QUERY)
+
+
+# the missing monthly partitions of reviews.<table> (review_stats, or the
+# new table during migrate_stats.py), the rows of these months already in
+# the default partition are moved into them
+@metrics.timed_query
+@_dispatched
+async def create_stats_partitions(
+        table: str, date_from: dt.datetime, date_to: dt.datetime, conn,
+) -> tp.List[str]:
+    existing = {
+        row['relname']
+        for row in await conn.fetch(_GET_STATS_PARTITIONS_QUERY, table)
+    }
+    created: tp.List[str] = []
+    # ddl takes no parameters, the names and bounds come from the dates
+    for name, begin, end in get_stats_partitions(date_from, date_to):
+        if name in existing:
+            continue
+        bounds = f"FROM ('{begin.isoformat()}') TO ('{end.isoformat()}')"
+        async with conn.transaction():
+            await conn.execute(
+                f'CREATE TABLE reviews.{name}'
+                f' (LIKE reviews.{table} INCLUDING DEFAULTS);',
+            )
+            await conn.execute(
+                f"""
+                WITH moved AS (
+                  DELETE FROM reviews.{table}_default
+                  WHERE review_at >= $1 AND review_at < $2
+                  RETURNING *
+                )
+                INSERT INTO reviews.{name}
+                SELECT * FROM moved;
+                """,
+                begin,
+                end,
+            )
+            await conn.execute(
+                f'ALTER TABLE reviews.{table}'
+                f' ATTACH PARTITION reviews.{name} FOR VALUES {bounds};',
+            )
+        created.append(name)
+    return created
+
+
+# detaches the monthly partitions ending before `before` and moves them to
+# the reviews_archive schema, out of the stats queries
+#
+# DETACH takes ACCESS EXCLUSIVE on review_stats itself, every stats read
+# and write waits for it (CONCURRENTLY is not allowed with a default
+# partition): the job runs at night and gives up after lock_timeout
+# instead of queueing the others behind a long query
+@metrics.timed_query
+@_dispatched
+async def archive_stats_partitions(
+        before: dt.datetime, lock_timeout: float, conn,
+) -> tp.List[str]:
+    archived: tp.List[str] = []
+    for row in await conn.fetch(_GET_STATS_PARTITIONS_QUERY, 'review_stats'):
+        match = _STATS_PARTITION.match(row['relname'])
+        if not match:
+            continue
+        month_start = dt.datetime(
+            int(match.group(1)),
+            int(match.group(2)),
+            1,
+            tzinfo=dt.timezone.utc,
+        )
+        if _get_next_month(month_start) > before:
+            continue
+        name = row['relname']
+        async with conn.transaction():
+            await conn.execute('CREATE SCHEMA IF NOT EXISTS reviews_archive;')
+            await conn.execute(
+                f'SET LOCAL lock_timeout = {int(lock_timeout * 1000)};',
+            )
+            await conn.execute(
+                f'ALTER TABLE reviews.review_stats'
+                f' DETACH PARTITION reviews.{name};',
+            )
+            await conn.execute(
+                f'ALTER TABLE reviews.{name} SET SCHEMA reviews_archive;',
+            )
+        archived.append(name)
+    return archived
+
+
+_GET_KEY_VALUES_QUERY = statements.register(
+    'get_key_values',
+    """
+    SELECT key, value
+    FROM reviews.key_value
+    WHERE key = ANY($1::TEXT[]);
+    """,
+)
+
+
+# the raw values, runtime_config.py parses them
+@metrics.timed_query
+@_dispatched
+async def get_key_values(
+        keys: tp.Sequence[str], conn,
+) -> tp.Dict[str, str]:
+    return {
+        row['key']: row['value']
+        for row in await conn.fetch(_GET_KEY_VALUES_QUERY, list(keys))
+    }
+
+
+_GET_TG_UPDATE_OFFSET = statements.register(
+    'get_tg_update_offset',
+    """
     SELECT value
     FROM reviews.key_value
     WHERE reviews.key_value.key = 'tg_update_offset';
-    """
-    row = await conn.fetchrow(_get_tg_update_offset)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_tg_update_offset(conn) -> tp.Optional[int]:
+    row = await conn.fetchrow(_GET_TG_UPDATE_OFFSET)
     return int(row['value']) if row and 'value' in row else None
 
 
-async def set_tg_update_offset(value: str, conn) -> None:
-    _set_tg_update_offset = """
+_SET_TG_UPDATE_OFFSET = statements.register(
+    'set_tg_update_offset',
+    """
     INSERT INTO reviews.key_value (key, value)
     VALUES ('tg_update_offset', $1)
     ON CONFLICT (key) DO UPDATE
       SET value = $1
       WHERE reviews.key_value.key = 'tg_update_offset';
-    """
-    await conn.execute(_set_tg_update_offset, value)
+    """,
+)
 
 
-async def get_times(
-        login: str, date_from: dt.datetime, date_to: dt.datetime, conn,
-) -> tp.List[int]:
-    _get_reviewer_times_query = """
+@metrics.timed_query
+@_dispatched
+async def set_tg_update_offset(value: str, conn) -> None:
+    await conn.execute(_SET_TG_UPDATE_OFFSET, value)
+
+
+_GET_REVIEWER_TIMES_QUERY = statements.register(
+    'get_reviewer_times',
+    """
     SELECT ARRAY(
       SELECT minutes
       FROM reviews.review_stats
       WHERE reviewer = $1
         AND review_at BETWEEN $2 AND $3
     );
-    """
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_times(
+        login: str, date_from: dt.datetime, date_to: dt.datetime, conn,
+) -> tp.List[int]:
     result = await conn.fetchrow(
-        _get_reviewer_times_query, login, date_from, date_to,
+        _GET_REVIEWER_TIMES_QUERY, login, date_from, date_to,
     )
     return result['array'] if result and 'array' in result else []
 
 
-async def save_user_chat_id(telegram_login: str, chat_id: str, conn) -> None:
-    _save_chat_id_query = """
+_SAVE_CHAT_ID_QUERY = statements.register(
+    'save_chat_id',
+    """
     INSERT INTO reviews.users_telegrams (telegram_login, chat_id)
     VALUES ($1, $2)
     ON CONFLICT DO NOTHING;
-    """
-    await conn.execute(_save_chat_id_query, telegram_login, int(chat_id))
+    """,
+)
 
 
-async def save_user_mappings(
-        staff_login: str, telegram_login: str, chat_id: tp.Optional[str], conn,
-) -> None:
-    _save_user_mappings_query = """
+@metrics.timed_query
+@_dispatched
+async def save_user_chat_id(telegram_login: str, chat_id: str, conn) -> None:
+    await conn.execute(_SAVE_CHAT_ID_QUERY, telegram_login, int(chat_id))
+
+
+_SAVE_USER_MAPPINGS_QUERY = statements.register(
+    'save_user_mappings',
+    """
     WITH logins_query AS (
       INSERT INTO reviews.users_logins (staff_login, telegram_login)
       VALUES ($1, $2)
@@ -191,29 +577,41 @@ async def save_user_mappings(
     INSERT INTO reviews.users_telegrams (telegram_login, chat_id)
     VALUES ($2, $3)
     ON CONFLICT DO NOTHING;
-    """
+    """,
+)
+
 
-    _save_login_mappings_query = """
+_SAVE_LOGIN_MAPPINGS_QUERY = statements.register(
+    'save_login_mappings',
+    """
     INSERT INTO reviews.users_logins (staff_login, telegram_login)
     VALUES ($1, $2)
     ON CONFLICT (staff_login) DO NOTHING;
-    """
+    """,
+)
+
 
+@metrics.timed_query
+@_dispatched
+async def save_user_mappings(
+        staff_login: str, telegram_login: str, chat_id: tp.Optional[str], conn,
+) -> None:
     if chat_id:
         await conn.execute(
-            _save_user_mappings_query,
+            _SAVE_USER_MAPPINGS_QUERY,
             staff_login,
             telegram_login,
             int(chat_id),
         )
     else:
         await conn.execute(
-            _save_login_mappings_query, staff_login, telegram_login,
+            _SAVE_LOGIN_MAPPINGS_QUERY, staff_login, telegram_login,
         )
 
 
-async def delete_user_mappings(telegram_login: str, conn) -> None:
-    _delete_user_mappings_query = """
+_DELETE_USER_MAPPINGS_QUERY = statements.register(
+    'delete_user_mappings',
+    """
     WITH logins_query AS (
       DELETE FROM reviews.users_logins
       WHERE telegram_login = $1
@@ -221,12 +619,19 @@ async def delete_user_mappings(telegram_login: str, conn) -> None:
 
     DELETE FROM reviews.users_telegrams
     WHERE telegram_login = $1;
-    """
-    await conn.execute(_delete_user_mappings_query, telegram_login)
+    """,
+)
 
 
-async def delete_users_mappings(staff_logins: tp.Iterable[str], conn) -> None:
-    _delete_users_mappings_query = """
+@metrics.timed_query
+@_dispatched
+async def delete_user_mappings(telegram_login: str, conn) -> None:
+    await conn.execute(_DELETE_USER_MAPPINGS_QUERY, telegram_login)
+
+
+_DELETE_USERS_MAPPINGS_QUERY = statements.register(
+    'delete_users_mappings',
+    """
     WITH
     telegram_logins AS (
       SELECT telegram_login
@@ -249,17 +654,30 @@ async def delete_users_mappings(staff_logins: tp.Iterable[str], conn) -> None:
     )
     DELETE FROM reviews.users_settings
     WHERE staff_login = ANY($1::TEXT[]);
-    """
-    await conn.execute(_delete_users_mappings_query, staff_logins)
+    """,
+)
 
 
-async def get_chat_id(telegram_login: str, conn) -> tp.Optional[str]:
-    _get_chat_id_query = """
+@metrics.timed_query
+@_dispatched
+async def delete_users_mappings(staff_logins: tp.Iterable[str], conn) -> None:
+    await conn.execute(_DELETE_USERS_MAPPINGS_QUERY, staff_logins)
+
+
+_GET_CHAT_ID_QUERY = statements.register(
+    'get_chat_id',
+    """
     SELECT chat_id
     FROM reviews.users_telegrams
     WHERE telegram_login = $1;
-    """
-    row = await conn.fetchrow(_get_chat_id_query, telegram_login)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_chat_id(telegram_login: str, conn) -> tp.Optional[str]:
+    row = await conn.fetchrow(_GET_CHAT_ID_QUERY, telegram_login)
     if not row:
         return None
     as_int = row.get('chat_id')
@@ -268,73 +686,123 @@ async def get_chat_id(telegram_login: str, conn) -> tp.Optional[str]:
     return str(as_int)
 
 
-async def get_staff_login_pg(telegram_login: str, conn) -> str:
-    _get_staff_login_query = """
+_GET_STAFF_LOGIN_QUERY = statements.register(
+    'get_staff_login',
+    """
     SELECT staff_login
     FROM reviews.users_logins
     WHERE telegram_login = $1;
-    """
-    row = await conn.fetchrow(_get_staff_login_query, telegram_login)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_staff_login_pg(telegram_login: str, conn) -> str:
+    row = await conn.fetchrow(_GET_STAFF_LOGIN_QUERY, telegram_login)
     return row.get('staff_login') if row else None
 
 
-async def get_all_staff_logins(conn) -> dict:
-    _get_all_staff_logins_query = """
+_GET_ALL_STAFF_LOGINS_QUERY = statements.register(
+    'get_all_staff_logins',
+    """
     SELECT staff_login, telegram_login
     FROM reviews.users_logins;
-    """
-    rows = await conn.fetch(_get_all_staff_logins_query)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_all_staff_logins(conn) -> dict:
+    rows = await conn.fetch(_GET_ALL_STAFF_LOGINS_QUERY)
     return {row['staff_login']: row['telegram_login'] for row in rows}
 
 
-async def get_telegram_login_pg(staff_login: str, conn) -> str:
-    _get_telegram_login_query = """
+_GET_TELEGRAM_LOGIN_QUERY = statements.register(
+    'get_telegram_login',
+    """
     SELECT telegram_login
     FROM reviews.users_logins
     WHERE staff_login = $1;
-    """
-    row = await conn.fetchrow(_get_telegram_login_query, staff_login)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_telegram_login_pg(staff_login: str, conn) -> str:
+    row = await conn.fetchrow(_GET_TELEGRAM_LOGIN_QUERY, staff_login)
     return row.get('telegram_login') if row else None
 
 
-async def disable_notifications(staff_login: str, conn) -> None:
-    _disable_notifications_query = """
+_DISABLE_NOTIFICATIONS_QUERY = statements.register(
+    'disable_notifications',
+    """
     UPDATE reviews.users_settings
        SET review_notify_enabled = FALSE
      WHERE staff_login = $1;
-    """
-    await conn.execute(_disable_notifications_query, staff_login)
+    """,
+)
 
 
-async def set_myprs(value: bool, staff_login: str, conn) -> None:
-    _set_myprs_query = """
+@metrics.timed_query
+@_dispatched
+async def disable_notifications(staff_login: str, conn) -> None:
+    await conn.execute(_DISABLE_NOTIFICATIONS_QUERY, staff_login)
+
+
+_SET_MYPRS_QUERY = statements.register(
+    'set_myprs',
+    """
     UPDATE reviews.users_settings
        SET my_prs = $1
      WHERE staff_login = $2;
-    """
-    await conn.execute(_set_myprs_query, value, staff_login)
+    """,
+)
 
 
-async def set_wipprs(value: bool, staff_login: str, conn) -> None:
-    _set_wipprs_query = """
+@metrics.timed_query
+@_dispatched
+async def set_myprs(value: bool, staff_login: str, conn) -> None:
+    await conn.execute(_SET_MYPRS_QUERY, value, staff_login)
+
+
+_SET_WIPPRS_QUERY = statements.register(
+    'set_wipprs',
+    """
     UPDATE reviews.users_settings
        SET wip_prs = $1
      WHERE staff_login = $2;
-    """
-    await conn.execute(_set_wipprs_query, value, staff_login)
+    """,
+)
 
 
-async def set_startrek(value: bool, staff_login: str, conn) -> None:
-    _set_startrek_query = """
+@metrics.timed_query
+@_dispatched
+async def set_wipprs(value: bool, staff_login: str, conn) -> None:
+    await conn.execute(_SET_WIPPRS_QUERY, value, staff_login)
+
+
+_SET_STARTREK_QUERY = statements.register(
+    'set_startrek',
+    """
     UPDATE reviews.users_settings
        SET startrek = $1
      WHERE staff_login = $2;
-    """
-    await conn.execute(_set_startrek_query, value, staff_login)
+    """,
+)
 
 
-async def set_hours(hours: tp.Iterable[int], staff_login: str, conn) -> None:
-    _set_hours_query = """
+@metrics.timed_query
+@_dispatched
+async def set_startrek(value: bool, staff_login: str, conn) -> None:
+    await conn.execute(_SET_STARTREK_QUERY, value, staff_login)
+
+
+_SET_HOURS_QUERY = statements.register(
+    'set_hours',
+    """
     INSERT INTO reviews.users_settings
       (staff_login, review_notify_hours, review_notify_enabled)
     VALUES ($1, $2, TRUE)
@@ -342,17 +810,30 @@ async def set_hours(hours: tp.Iterable[int], staff_login: str, conn) -> None:
       SET review_notify_enabled = TRUE,
           review_notify_hours = $2
     WHERE reviews.users_settings.staff_login = $1;
-    """
-    await conn.execute(_set_hours_query, staff_login, hours)
+    """,
+)
 
 
-async def get_reviewers_settings(conn) -> tp.Dict[str, tp.Dict]:
-    _get_reviewers_query = """
+@metrics.timed_query
+@_dispatched
+async def set_hours(hours: tp.Iterable[int], staff_login: str, conn) -> None:
+    await conn.execute(_SET_HOURS_QUERY, staff_login, hours)
+
+
+_GET_REVIEWERS_QUERY = statements.register(
+    'get_reviewers',
+    """
     SELECT staff_login, review_notify_hours, my_prs, wip_prs, startrek
     FROM reviews.users_settings
     WHERE review_notify_enabled;
-    """
-    rows = await conn.fetch(_get_reviewers_query)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_reviewers_settings(conn) -> tp.Dict[str, tp.Dict]:
+    rows = await conn.fetch(_GET_REVIEWERS_QUERY)
     return {
         login: {
             'hours': hours,
@@ -364,51 +845,225 @@ async def get_reviewers_settings(conn) -> tp.Dict[str, tp.Dict]:
     }
 
 
-async def get_reviewer_settings(
-        staff_login: str, conn,
-) -> tp.Optional[tp.Dict]:
-    _get_reviewer_query = """
+_GET_REVIEWER_QUERY = statements.register(
+    'get_reviewer',
+    """
     SELECT review_notify_hours, my_prs, wip_prs
     FROM reviews.users_settings
     WHERE staff_login = $1;
-    """
-    row = await conn.fetchrow(_get_reviewer_query, staff_login)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_reviewer_settings(
+        staff_login: str, conn,
+) -> tp.Optional[tp.Dict]:
+    row = await conn.fetchrow(_GET_REVIEWER_QUERY, staff_login)
     if not row:
         return None
 
     return {'hours': row[0], 'my': row[1], 'wip': row[2]}
 
 
+def gaps_to_json(gaps: tp.List[tp.Tuple[dt.datetime, dt.datetime]]) -> str:
+    return json.dumps(
+        [
+            {'begin': begin.isoformat(), 'end': end.isoformat()}
+            for begin, end in gaps
+        ],
+    )
+
+
+_GET_GAPS_HASHES_QUERY = statements.register(
+    'get_gaps_hashes',
+    """
+    SELECT staff_login, gaps_hash
+    FROM reviews.cache_gaps;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_gaps_hashes(conn) -> tp.Dict[str, tp.Optional[str]]:
+    rows = await conn.fetch(_GET_GAPS_HASHES_QUERY)
+    return {row['staff_login']: row['gaps_hash'] for row in rows}
+
+
+_SET_GAPS_QUERY = statements.register(
+    'set_gaps',
+    """
+    INSERT INTO reviews.cache_gaps
+      (staff_login, gaps, gaps_hash)
+    SELECT staff_login, gaps::JSONB, gaps_hash
+    FROM UNNEST($1::TEXT[], $2::TEXT[], $3::TEXT[])
+      AS t(staff_login, gaps, gaps_hash)
+    ON CONFLICT (staff_login) DO UPDATE
+      SET gaps = EXCLUDED.gaps,
+          gaps_hash = EXCLUDED.gaps_hash;
+    """,
+)
+
+
+# staff_login -> (json_gaps, gaps_hash)
+@metrics.timed_query
+@_dispatched
 async def set_gaps(
-        staff_login: str,
-        gaps: tp.List[tp.Tuple[dt.datetime, dt.datetime]],
-        conn,
+        gaps_by_login: tp.Dict[str, tp.Tuple[str, str]], conn,
 ) -> None:
-    json_gaps = [
-        {'begin': begin.isoformat(), 'end': end.isoformat()}
-        for begin, end in gaps
-    ]
+    logins = list(gaps_by_login)
+    await conn.execute(
+        _SET_GAPS_QUERY,
+        logins,
+        [gaps_by_login[login][0] for login in logins],
+        [gaps_by_login[login][1] for login in logins],
+    )
 
-    _set_gaps_query = """
-    INSERT INTO reviews.cache_gaps
-      (staff_login, gaps)
-    VALUES ($1, $2::JSONB)
+
+_GET_NOTIFY_DIGESTS_QUERY = statements.register(
+    'get_notify_digests',
+    """
+    SELECT staff_login, chat_id, fingerprint, text_hash, message_id, sent_at
+    FROM reviews.notify_digests
+    WHERE staff_login = ANY($1::TEXT[]);
+    """,
+)
+
+
+# staff_login -> the last sent hourly digest
+@metrics.timed_query
+@_dispatched
+async def get_notify_digests(
+        staff_logins: tp.Iterable[str], conn,
+) -> tp.Dict[str, tp.Dict]:
+    rows = await conn.fetch(_GET_NOTIFY_DIGESTS_QUERY, list(staff_logins))
+    return {
+        row['staff_login']: {
+            'chat_id': row['chat_id'],
+            'fingerprint': row['fingerprint'],
+            'text_hash': row['text_hash'],
+            'message_id': row['message_id'],
+            'sent_at': row['sent_at'],
+        }
+        for row in rows
+    }
+
+
+_SAVE_NOTIFY_DIGESTS_QUERY = statements.register(
+    'save_notify_digests',
+    """
+    INSERT INTO reviews.notify_digests
+      (staff_login, chat_id, fingerprint, text_hash, message_id, sent_at)
+    SELECT *
+    FROM UNNEST(
+      $1::TEXT[],
+      $2::TEXT[],
+      $3::TEXT[],
+      $4::TEXT[],
+      $5::BIGINT[],
+      $6::TIMESTAMPTZ[]
+    )
     ON CONFLICT (staff_login) DO UPDATE
-      SET gaps = $2::JSONB
-    WHERE reviews.cache_gaps.staff_login = $1;
+      SET chat_id = EXCLUDED.chat_id,
+          fingerprint = EXCLUDED.fingerprint,
+          text_hash = EXCLUDED.text_hash,
+          message_id = EXCLUDED.message_id,
+          sent_at = EXCLUDED.sent_at;
+    """,
+)
+
+
+# staff_login -> (chat_id, fingerprint, text_hash, message_id, sent_at)
+@metrics.timed_query
+@_dispatched
+async def save_notify_digests(
+        digests: tp.Dict[
+            str,
+            tp.Tuple[str, str, str, tp.Optional[int], dt.datetime],
+        ],
+        conn,
+) -> None:
+    logins = list(digests)
+    await conn.execute(
+        _SAVE_NOTIFY_DIGESTS_QUERY,
+        logins,
+        *[
+            [digests[login][index] for login in logins]
+            for index in range(5)
+        ],
+    )
+
+
+_DELETE_NOTIFY_DIGESTS_QUERY = statements.register(
+    'delete_notify_digests',
     """
-    await conn.execute(_set_gaps_query, staff_login, json.dumps(json_gaps))
+    DELETE FROM reviews.notify_digests
+    WHERE staff_login = ANY($1::TEXT[]);
+    """,
+)
 
 
-async def get_gaps(
-        staff_login: str, conn,
-) -> tp.List[tp.Tuple[dt.datetime, dt.datetime]]:
-    _get_gaps_query = """
+# nothing to send to them, the next digest is a new message
+@metrics.timed_query
+@_dispatched
+async def delete_notify_digests(
+        staff_logins: tp.Iterable[str], conn,
+) -> None:
+    await conn.execute(_DELETE_NOTIFY_DIGESTS_QUERY, list(staff_logins))
+
+
+_DELETE_NOTIFY_CLAIMS_QUERY = statements.register(
+    'delete_notify_claims',
+    """
+    DELETE FROM reviews.notify_claims
+    WHERE hour_start < $1;
+    """,
+)
+
+_CLAIM_NOTIFY_DIGESTS_QUERY = statements.register(
+    'claim_notify_digests',
+    """
+    INSERT INTO reviews.notify_claims (staff_login, hour_start)
+    SELECT UNNEST($1::TEXT[]), $2
+    ON CONFLICT DO NOTHING
+    RETURNING staff_login;
+    """,
+)
+
+
+# the logins of the hour not claimed by another instance yet, the claims of
+# the previous hours are dropped
+@metrics.timed_query
+@_dispatched
+async def claim_notify_digests(
+        staff_logins: tp.Iterable[str], hour_start: dt.datetime, conn,
+) -> tp.Set[str]:
+    async with conn.transaction():
+        await conn.execute(_DELETE_NOTIFY_CLAIMS_QUERY, hour_start)
+        rows = await conn.fetch(
+            _CLAIM_NOTIFY_DIGESTS_QUERY, list(staff_logins), hour_start,
+        )
+    return {row['staff_login'] for row in rows}
+
+
+_GET_GAPS_QUERY = statements.register(
+    'get_gaps',
+    """
     SELECT gaps
     FROM reviews.cache_gaps
     WHERE staff_login = $1;
-    """
-    row = await conn.fetchrow(_get_gaps_query, staff_login)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_gaps(
+        staff_login: str, conn,
+) -> tp.List[tp.Tuple[dt.datetime, dt.datetime]]:
+    row = await conn.fetchrow(_GET_GAPS_QUERY, staff_login)
     if not row:
         return []
 
@@ -421,55 +1076,276 @@ async def get_gaps(
     ]
 
 
-async def set_subordinated(
+_SUBORDINATES_CTE = """
+    WITH RECURSIVE subordinates AS (
+      SELECT staff_login
+      FROM reviews.staff_chiefs
+      WHERE chief_login = $1
+      UNION
+      SELECT reviews.staff_chiefs.staff_login
+      FROM reviews.staff_chiefs
+      JOIN subordinates
+        ON reviews.staff_chiefs.chief_login = subordinates.staff_login
+      WHERE NOT $2
+    )
+"""
+
+
+_GET_SUBORDINATES_QUERY = statements.register(
+    'get_subordinates',
+    _SUBORDINATES_CTE
+    + """
+    SELECT staff_login
+    FROM subordinates;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_subordinates(
+        staff_login: str, is_nearest: bool, conn,
+) -> tp.Set[str]:
+    rows = await conn.fetch(_GET_SUBORDINATES_QUERY, staff_login, is_nearest)
+    return {row['staff_login'] for row in rows}
+
+
+_GET_SUBORDINATES_TIMES_QUERY = statements.register(
+    'get_subordinates_times',
+    _SUBORDINATES_CTE
+    + """
+    SELECT subordinates.staff_login, ARRAY_AGG(review_stats.minutes)
+    FROM subordinates
+    JOIN reviews.review_stats
+      ON review_stats.reviewer = subordinates.staff_login
+    WHERE review_stats.review_at BETWEEN $3 AND $4
+    GROUP BY subordinates.staff_login;
+    """,
+)
+
+
+# subordinate -> minutes
+@metrics.timed_query
+@_dispatched
+async def get_subordinates_times(
         staff_login: str,
-        sub_nearest: tp.List[str],
-        sub_all: tp.List[str],
+        is_nearest: bool,
+        date_from: dt.datetime,
+        date_to: dt.datetime,
         conn,
+) -> tp.Dict[str, tp.List[int]]:
+    rows = await conn.fetch(
+        _GET_SUBORDINATES_TIMES_QUERY,
+        staff_login,
+        is_nearest,
+        date_from,
+        date_to,
+    )
+    return {login: minutes for login, minutes in rows}
+
+
+_DELETE_STAFF_CHIEFS_QUERY = statements.register(
+    'delete_staff_chiefs',
+    """
+    DELETE FROM reviews.staff_chiefs;
+    """,
+)
+
+
+_INSERT_STAFF_CHIEFS_QUERY = statements.register(
+    'insert_staff_chiefs',
+    """
+    INSERT INTO reviews.staff_chiefs (staff_login, chief_login)
+    SELECT staff_login, chief_login
+    FROM UNNEST($1::TEXT[], $2::TEXT[]) AS t(staff_login, chief_login);
+    """,
+)
+
+
+_SET_STAFF_CHIEFS_VERSION_QUERY = statements.register(
+    'set_staff_chiefs_version',
+    """
+    INSERT INTO reviews.key_value (key, value)
+    VALUES ('staff_chiefs_version', $1)
+    ON CONFLICT (key) DO UPDATE
+      SET value = EXCLUDED.value;
+    """,
+)
+
+
+# the version goes with the dump, the other instances reload on its change
+@metrics.timed_query
+@_dispatched
+async def set_staff_chiefs(
+        chiefs: tp.Dict[str, tp.Optional[str]], version: str, conn,
 ) -> None:
-    _set_subordinated_query = """
-    INSERT INTO reviews.subordinated
-      (staff_login, sub_nearest, sub_all)
-    VALUES ($1, $2, $3)
+    logins = list(chiefs)
+    async with conn.transaction():
+        await conn.execute(_DELETE_STAFF_CHIEFS_QUERY)
+        await conn.execute(
+            _INSERT_STAFF_CHIEFS_QUERY,
+            logins,
+            [chiefs[login] for login in logins],
+        )
+        await conn.execute(_SET_STAFF_CHIEFS_VERSION_QUERY, version)
+
+
+_GET_STAFF_CHIEFS_QUERY = statements.register(
+    'get_staff_chiefs',
+    """
+    SELECT staff_login, chief_login
+    FROM reviews.staff_chiefs;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_staff_chiefs(conn) -> tp.Dict[str, tp.Optional[str]]:
+    rows = await conn.fetch(_GET_STAFF_CHIEFS_QUERY)
+    return {row['staff_login']: row['chief_login'] for row in rows}
+
+
+_GET_CHIEFS_CACHE_QUERY = statements.register(
+    'get_chiefs_cache',
+    """
+    SELECT staff_login, chiefs
+    FROM reviews.chiefs_cache
+    WHERE updated_at > $1;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_chiefs_cache(
+        updated_after: dt.datetime, conn,
+) -> tp.Dict[str, tp.List[str]]:
+    rows = await conn.fetch(_GET_CHIEFS_CACHE_QUERY, updated_after)
+    return {row['staff_login']: row['chiefs'] for row in rows}
+
+
+_SAVE_CHIEFS_CACHE_QUERY = statements.register(
+    'save_chiefs_cache',
+    """
+    INSERT INTO reviews.chiefs_cache (staff_login, chiefs, updated_at)
+    VALUES ($1, $2, NOW())
     ON CONFLICT (staff_login) DO UPDATE
-      SET sub_nearest = $2::TEXT[],
-          sub_all = $3::TEXT[]
-    WHERE reviews.subordinated.staff_login = $1;
+      SET chiefs = $2,
+          updated_at = NOW()
+    WHERE reviews.chiefs_cache.staff_login = $1;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def save_chiefs_cache(
+        staff_login: str, chiefs: tp.List[str], conn,
+) -> None:
+    await conn.execute(_SAVE_CHIEFS_CACHE_QUERY, staff_login, chiefs)
+
+
+_CLEAR_CHIEFS_CACHE_QUERY = statements.register(
+    'clear_chiefs_cache',
     """
+    DELETE FROM reviews.chiefs_cache
+    WHERE staff_login = ANY($1::TEXT[])
+       OR updated_at < $2;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def clear_chiefs_cache(
+        staff_logins: tp.Iterable[str], updated_before: dt.datetime, conn,
+) -> None:
     await conn.execute(
-        _set_subordinated_query, staff_login, sub_nearest, sub_all,
+        _CLEAR_CHIEFS_CACHE_QUERY, list(staff_logins), updated_before,
     )
 
 
-async def get_subordinated(
-        staff_login: str, conn,
-) -> tp.Optional[tp.Tuple[tp.Set[str], tp.Set[str]]]:
-    _get_subordinated_query = """
-    SELECT sub_nearest, sub_all
-    FROM reviews.subordinated
-    WHERE staff_login = $1;
+_SAVE_HEARTBEAT_QUERY = statements.register(
+    'save_heartbeat',
     """
-    result = await conn.fetchrow(_get_subordinated_query, staff_login)
-    if not result:
-        return None
+    INSERT INTO reviews.instances (instance_id, heartbeat_at)
+    VALUES ($1, NOW())
+    ON CONFLICT (instance_id) DO UPDATE
+      SET heartbeat_at = NOW()
+    WHERE reviews.instances.instance_id = $1;
+    """,
+)
 
-    return set(result['sub_nearest']), set(result['sub_all'])
 
+@metrics.timed_query
+@_dispatched
+async def save_heartbeat(instance_id: str, conn) -> None:
+    await conn.execute(_SAVE_HEARTBEAT_QUERY, instance_id)
 
-async def get_nda_link(link: str, conn) -> tp.Optional[str]:
-    _get_nda_link_query = """
+
+_GET_LIVE_INSTANCES_QUERY = statements.register(
+    'get_live_instances',
+    """
+    SELECT instance_id
+    FROM reviews.instances
+    WHERE heartbeat_at > NOW() - $1::INTERVAL
+    ORDER BY instance_id;
+    """,
+)
+
+
+# pg clock for both the writes and the reads, instances may drift
+@metrics.timed_query
+@_dispatched
+async def get_live_instances(ttl: dt.timedelta, conn) -> tp.List[str]:
+    rows = await conn.fetch(_GET_LIVE_INSTANCES_QUERY, ttl)
+    return [row['instance_id'] for row in rows]
+
+
+_DELETE_HEARTBEAT_QUERY = statements.register(
+    'delete_heartbeat',
+    """
+    DELETE FROM reviews.instances
+    WHERE instance_id = $1;
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def delete_heartbeat(instance_id: str, conn) -> None:
+    await conn.execute(_DELETE_HEARTBEAT_QUERY, instance_id)
+
+
+_GET_NDA_LINK_QUERY = statements.register(
+    'get_nda_link',
+    """
     SELECT nda
     FROM reviews.nda_links
     WHERE url = $1;
-    """
-    row = await conn.fetchrow(_get_nda_link_query, link)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def get_nda_link(link: str, conn) -> tp.Optional[str]:
+    row = await conn.fetchrow(_GET_NDA_LINK_QUERY, link)
     return row[0] if row else None
 
 
-async def save_nda_link(link: str, nda: str, conn) -> None:
-    _save_nda_link_query = """
+_SAVE_NDA_LINK_QUERY = statements.register(
+    'save_nda_link',
+    """
     INSERT INTO reviews.nda_links (url, nda)
     VALUES ($1, $2)
     ON CONFLICT DO NOTHING;
-    """
-    return await conn.execute(_save_nda_link_query, link, nda)
+    """,
+)
+
+
+@metrics.timed_query
+@_dispatched
+async def save_nda_link(link: str, nda: str, conn) -> None:
+    return await conn.execute(_SAVE_NDA_LINK_QUERY, link, nda)
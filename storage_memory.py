@@ -0,0 +1,571 @@
+# storage.py without postgresql: the same functions as methods over indexed
+# dicts and sorted arrays, for the db-free benchmarks (bench/bench_paths.py
+# --backend memory). An instance is both ctx.conn and ctx.pool.
+# Nothing awaits inside a method, so each one is atomic like a transaction.
+import bisect
+import collections
+import dataclasses
+import datetime as dt
+import json
+import typing as tp
+
+import events
+import github
+import storage
+
+_StatsKey = tp.Tuple[str, str, int, tp.Optional[dt.datetime]]
+
+
+def _now() -> dt.datetime:
+    return dt.datetime.now(dt.timezone.utc)
+
+
+# asyncpg takes naive datetimes for TIMESTAMPTZ as utc
+def _utc(value: tp.Optional[dt.datetime]) -> tp.Optional[dt.datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=dt.timezone.utc)
+    return value
+
+
+@dataclasses.dataclass
+class _Settings:
+    hours: tp.List[int] = dataclasses.field(default_factory=list)
+    enabled: bool = False
+    my: bool = True
+    wip: bool = True
+    startrek: bool = True
+
+
+# review_at of one reviewer sorted, with the review_stats keys in parallel
+class _ReviewerTimes:
+    __slots__ = ('review_ats', 'keys')
+
+    def __init__(self):
+        self.review_ats: tp.List[dt.datetime] = []
+        self.keys: tp.List[_StatsKey] = []
+
+    def add(self, key: _StatsKey) -> None:
+        index = bisect.bisect_right(self.review_ats, key[3])
+        self.review_ats.insert(index, key[3])
+        self.keys.insert(index, key)
+
+    def remove(self, key: _StatsKey) -> None:
+        begin = bisect.bisect_left(self.review_ats, key[3])
+        end = bisect.bisect_right(self.review_ats, key[3])
+        index = self.keys.index(key, begin, end)
+        del self.review_ats[index]
+        del self.keys[index]
+
+    def between(
+            self, date_from: dt.datetime, date_to: dt.datetime,
+    ) -> tp.List[_StatsKey]:
+        begin = bisect.bisect_left(self.review_ats, _utc(date_from))
+        end = bisect.bisect_right(self.review_ats, _utc(date_to))
+        return self.keys[begin:end]
+
+
+class _Acquire:
+    def __init__(self, memory: 'MemoryStorage'):
+        self._memory = memory
+
+    async def __aenter__(self) -> 'MemoryStorage':
+        return self._memory
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+class MemoryStorage(storage.Backend):
+    def __init__(self):
+        # (owner, repo) -> cursor, (owner, repo, number) -> cursor, merged_at
+        self._cursors: tp.Dict[tp.Tuple[str, str], str] = {}
+        self._cursors_history: tp.Dict[
+            tp.Tuple[str, str, int], tp.Tuple[str, dt.datetime],
+        ] = {}
+        self._processed: tp.Set[tp.Tuple[str, str, int]] = set()
+        # (owner, repo, number, review_at) -> reviewer, minutes
+        self._stats: tp.Dict[_StatsKey, tp.Tuple[str, int]] = {}
+        self._stats_by_reviewer: tp.Dict[str, _ReviewerTimes] = (
+            collections.defaultdict(_ReviewerTimes)
+        )
+        self._stats_by_pr: tp.Dict[
+            tp.Tuple[str, str, int], tp.List[_StatsKey],
+        ] = collections.defaultdict(list)
+        # (owner, repo) -> number -> types, reviewers, event_ats, last_event_at
+        self._events: tp.Dict[tp.Tuple[str, str], tp.Dict[int, tuple]] = (
+            collections.defaultdict(dict)
+        )
+        self._key_value: tp.Dict[str, str] = {}
+        self._telegram_by_staff: tp.Dict[str, str] = {}
+        self._staff_by_telegram: tp.Dict[str, str] = {}
+        self._chat_ids: tp.Dict[str, int] = {}
+        self._settings: tp.Dict[str, _Settings] = {}
+        # staff_login -> gaps, gaps_hash
+        self._gaps: tp.Dict[
+            str,
+            tp.Tuple[tp.List[tp.Tuple[dt.datetime, dt.datetime]], str],
+        ] = {}
+        # staff_login -> the last sent hourly digest
+        self._notify_digests: tp.Dict[str, tp.Dict] = {}
+        self._notify_claims: tp.Set[tp.Tuple[str, dt.datetime]] = set()
+        self._chiefs: tp.Dict[str, tp.Optional[str]] = {}
+        self._subordinates: tp.Dict[str, tp.Set[str]] = (
+            collections.defaultdict(set)
+        )
+        # staff_login -> chiefs, updated_at
+        self._chiefs_cache: tp.Dict[
+            str, tp.Tuple[tp.List[str], dt.datetime],
+        ] = {}
+        self._instances: tp.Dict[str, dt.datetime] = {}
+        self._nda_links: tp.Dict[str, str] = {}
+
+    # the pool interface, one shared "connection"
+    def acquire(self) -> _Acquire:
+        return _Acquire(self)
+
+    # cursors
+
+    async def get_cursor(self, owner: str, repo: str) -> tp.Optional[str]:
+        return self._cursors.get((owner, repo))
+
+    async def save_cursor(
+            self,
+            cursor: str,
+            pull_request: github.PullRequest,
+            merged_at: dt.datetime,
+    ) -> None:
+        self._cursors[(pull_request.owner, pull_request.repo)] = cursor
+        self._cursors_history.setdefault(
+            (pull_request.owner, pull_request.repo, pull_request.number),
+            (cursor, merged_at),
+        )
+
+    async def mark_as_processed(
+            self, pull_request: github.PullRequest,
+    ) -> None:
+        self._processed.add(
+            (pull_request.owner, pull_request.repo, pull_request.number),
+        )
+
+    async def is_pr_processed(self, pull_request: github.PullRequest) -> bool:
+        return (
+            pull_request.owner,
+            pull_request.repo,
+            pull_request.number,
+        ) in self._processed
+
+    # stats
+
+    def _insert_stats(
+            self, owner: str, repo: str, number: int, item: tp.Dict,
+    ) -> None:
+        key = (owner, repo, number, _utc(item['review_at']))
+        if key in self._stats:
+            return  # ON CONFLICT DO NOTHING
+        self._stats[key] = (item['reviewer'], item['minutes'])
+        self._stats_by_pr[(owner, repo, number)].append(key)
+        if key[3] is not None:
+            self._stats_by_reviewer[item['reviewer']].add(key)
+
+    async def save_times(
+            self, pull_request: github.PullRequest, pr_stats: tp.List[tp.Dict],
+    ) -> None:
+        for item in pr_stats:
+            self._insert_stats(
+                pull_request.owner,
+                pull_request.repo,
+                pull_request.number,
+                item,
+            )
+
+    async def replace_times(
+            self,
+            owner: str,
+            repo: str,
+            prs_stats: tp.List[tp.Tuple[int, tp.List[tp.Dict]]],
+    ) -> None:
+        for number, _ in prs_stats:
+            for key in self._stats_by_pr.pop((owner, repo, number), ()):
+                reviewer, _ = self._stats.pop(key)
+                if key[3] is not None:
+                    self._stats_by_reviewer[reviewer].remove(key)
+        for number, pr_stats in prs_stats:
+            for item in pr_stats:
+                self._insert_stats(owner, repo, number, item)
+
+    # one sorted array per reviewer, there is nothing to partition
+    async def is_stats_partitioned(self) -> bool:
+        return True
+
+    async def create_stats_partitions(
+            self, table: str, date_from: dt.datetime, date_to: dt.datetime,
+    ) -> tp.List[str]:
+        return []
+
+    # the rows of the months ending before `before` are dropped
+    async def archive_stats_partitions(
+            self, before: dt.datetime, lock_timeout: float,
+    ) -> tp.List[str]:
+        archived: tp.Set[str] = set()
+        for key in list(self._stats):
+            if key[3] is None:
+                continue
+            [(name, _, end)] = storage.get_stats_partitions(key[3], key[3])
+            if end > _utc(before):
+                continue
+            reviewer, _ = self._stats.pop(key)
+            self._stats_by_reviewer[reviewer].remove(key)
+            self._stats_by_pr[key[:3]].remove(key)
+            archived.add(name)
+        return sorted(archived)
+
+    def _get_minutes(
+            self, login: str, date_from: dt.datetime, date_to: dt.datetime,
+    ) -> tp.List[int]:
+        times = self._stats_by_reviewer.get(login)
+        if times is None:
+            return []
+        return [
+            self._stats[key][1] for key in times.between(date_from, date_to)
+        ]
+
+    async def get_times(
+            self, login: str, date_from: dt.datetime, date_to: dt.datetime,
+    ) -> tp.List[int]:
+        return self._get_minutes(login, date_from, date_to)
+
+    async def save_events(
+            self,
+            pull_request: github.PullRequest,
+            review_events: events.EventBatch,
+    ) -> None:
+        self._events[(pull_request.owner, pull_request.repo)][
+            pull_request.number
+        ] = (
+            list(review_events.types),
+            review_events.get_reviewers(),
+            review_events.get_event_ats(),
+            (
+                events.to_datetime(review_events.timestamps[-1])
+                if review_events
+                else None
+            ),
+        )
+
+    async def get_events(
+            self,
+            owner: str,
+            repo: str,
+            date_from: dt.datetime,
+            date_to: dt.datetime,
+    ) -> tp.List[
+        tp.Tuple[int, tp.List[int], tp.List[str], tp.List[dt.datetime]]
+    ]:
+        prs = self._events.get((owner, repo), {})
+        date_from, date_to = _utc(date_from), _utc(date_to)
+        return [
+            (number, types, reviewers, event_ats)
+            for number, (types, reviewers, event_ats, last_event_at) in sorted(
+                prs.items(),
+            )
+            if last_event_at is not None
+            and date_from <= last_event_at <= date_to
+        ]
+
+    # key_value
+
+    async def get_key_values(
+            self, keys: tp.Sequence[str],
+    ) -> tp.Dict[str, str]:
+        return {
+            key: self._key_value[key] for key in keys if key in self._key_value
+        }
+
+    async def get_tg_update_offset(self) -> tp.Optional[int]:
+        value = self._key_value.get('tg_update_offset')
+        return int(value) if value is not None else None
+
+    async def set_tg_update_offset(self, value: str) -> None:
+        self._key_value['tg_update_offset'] = str(value)
+
+    # users
+
+    def _set_telegram_login(
+            self, staff_login: str, telegram_login: str,
+    ) -> None:
+        previous = self._telegram_by_staff.get(staff_login)
+        if previous is not None:
+            self._staff_by_telegram.pop(previous, None)
+        self._telegram_by_staff[staff_login] = telegram_login
+        self._staff_by_telegram[telegram_login] = staff_login
+
+    async def save_user_chat_id(
+            self, telegram_login: str, chat_id: str,
+    ) -> None:
+        self._chat_ids.setdefault(telegram_login, int(chat_id))
+
+    async def save_user_mappings(
+            self,
+            staff_login: str,
+            telegram_login: str,
+            chat_id: tp.Optional[str],
+    ) -> None:
+        if chat_id:
+            self._set_telegram_login(staff_login, telegram_login)
+            self._chat_ids.setdefault(telegram_login, int(chat_id))
+        elif staff_login not in self._telegram_by_staff:
+            self._set_telegram_login(staff_login, telegram_login)
+
+    async def delete_user_mappings(self, telegram_login: str) -> None:
+        staff_login = self._staff_by_telegram.pop(telegram_login, None)
+        if staff_login is not None:
+            del self._telegram_by_staff[staff_login]
+        self._chat_ids.pop(telegram_login, None)
+
+    async def delete_users_mappings(
+            self, staff_logins: tp.Iterable[str],
+    ) -> None:
+        for staff_login in staff_logins:
+            telegram_login = self._telegram_by_staff.pop(staff_login, None)
+            if telegram_login is not None:
+                del self._staff_by_telegram[telegram_login]
+                self._chat_ids.pop(telegram_login, None)
+            self._settings.pop(staff_login, None)
+
+    async def get_chat_id(self, telegram_login: str) -> tp.Optional[str]:
+        chat_id = self._chat_ids.get(telegram_login)
+        return str(chat_id) if chat_id else None
+
+    async def get_staff_login_pg(
+            self, telegram_login: str,
+    ) -> tp.Optional[str]:
+        return self._staff_by_telegram.get(telegram_login)
+
+    async def get_all_staff_logins(self) -> dict:
+        return dict(self._telegram_by_staff)
+
+    async def get_telegram_login_pg(
+            self, staff_login: str,
+    ) -> tp.Optional[str]:
+        return self._telegram_by_staff.get(staff_login)
+
+    # settings
+
+    async def disable_notifications(self, staff_login: str) -> None:
+        if staff_login in self._settings:
+            self._settings[staff_login].enabled = False
+
+    async def set_myprs(self, value: bool, staff_login: str) -> None:
+        if staff_login in self._settings:
+            self._settings[staff_login].my = value
+
+    async def set_wipprs(self, value: bool, staff_login: str) -> None:
+        if staff_login in self._settings:
+            self._settings[staff_login].wip = value
+
+    async def set_startrek(self, value: bool, staff_login: str) -> None:
+        if staff_login in self._settings:
+            self._settings[staff_login].startrek = value
+
+    async def set_hours(
+            self, hours: tp.Iterable[int], staff_login: str,
+    ) -> None:
+        settings = self._settings.setdefault(staff_login, _Settings())
+        settings.hours = list(hours)
+        settings.enabled = True
+
+    async def get_reviewers_settings(self) -> tp.Dict[str, tp.Dict]:
+        return {
+            login: {
+                'hours': list(settings.hours),
+                'my': settings.my,
+                'wip': settings.wip,
+                'startrek': settings.startrek,
+            }
+            for login, settings in self._settings.items()
+            if settings.enabled
+        }
+
+    async def get_reviewer_settings(
+            self, staff_login: str,
+    ) -> tp.Optional[tp.Dict]:
+        settings = self._settings.get(staff_login)
+        if settings is None:
+            return None
+        return {
+            'hours': list(settings.hours),
+            'my': settings.my,
+            'wip': settings.wip,
+        }
+
+    # gaps
+
+    async def get_gaps_hashes(self) -> tp.Dict[str, tp.Optional[str]]:
+        return {
+            login: gaps_hash for login, (_, gaps_hash) in self._gaps.items()
+        }
+
+    async def set_gaps(
+            self, gaps_by_login: tp.Dict[str, tp.Tuple[str, str]],
+    ) -> None:
+        for login, (json_gaps, gaps_hash) in gaps_by_login.items():
+            # parsed once here and not on every read as in pg
+            gaps = [
+                (
+                    dt.datetime.fromisoformat(gap['begin']),
+                    dt.datetime.fromisoformat(gap['end']),
+                )
+                for gap in json.loads(json_gaps)
+            ]
+            self._gaps[login] = (gaps, gaps_hash)
+
+    async def get_gaps(
+            self, staff_login: str,
+    ) -> tp.List[tp.Tuple[dt.datetime, dt.datetime]]:
+        gaps = self._gaps.get(staff_login)
+        return list(gaps[0]) if gaps else []
+
+    # notify digests
+
+    async def get_notify_digests(
+            self, staff_logins: tp.Iterable[str],
+    ) -> tp.Dict[str, tp.Dict]:
+        return {
+            login: dict(self._notify_digests[login])
+            for login in staff_logins
+            if login in self._notify_digests
+        }
+
+    async def save_notify_digests(
+            self,
+            digests: tp.Dict[
+                str,
+                tp.Tuple[str, str, str, tp.Optional[int], dt.datetime],
+            ],
+    ) -> None:
+        for login, digest in digests.items():
+            chat_id, fingerprint, text_hash, message_id, sent_at = digest
+            self._notify_digests[login] = {
+                'chat_id': chat_id,
+                'fingerprint': fingerprint,
+                'text_hash': text_hash,
+                'message_id': message_id,
+                'sent_at': _utc(sent_at),
+            }
+
+    async def delete_notify_digests(
+            self, staff_logins: tp.Iterable[str],
+    ) -> None:
+        for login in staff_logins:
+            self._notify_digests.pop(login, None)
+
+    async def claim_notify_digests(
+            self, staff_logins: tp.Iterable[str], hour_start: dt.datetime,
+    ) -> tp.Set[str]:
+        hour_start = _utc(hour_start)
+        self._notify_claims = {
+            claim for claim in self._notify_claims if claim[1] >= hour_start
+        }
+        claimed: tp.Set[str] = set()
+        for login in staff_logins:
+            if (login, hour_start) not in self._notify_claims:
+                self._notify_claims.add((login, hour_start))
+                claimed.add(login)
+        return claimed
+
+    # subordinates
+
+    def _get_subordinates(
+            self, staff_login: str, is_nearest: bool,
+    ) -> tp.Set[str]:
+        result = set(self._subordinates.get(staff_login, ()))
+        if is_nearest:
+            return result
+        queue = collections.deque(result)
+        while queue:
+            for subordinate in self._subordinates.get(queue.popleft(), ()):
+                if subordinate not in result:
+                    result.add(subordinate)
+                    queue.append(subordinate)
+        return result
+
+    async def get_subordinates(
+            self, staff_login: str, is_nearest: bool,
+    ) -> tp.Set[str]:
+        return self._get_subordinates(staff_login, is_nearest)
+
+    async def get_subordinates_times(
+            self,
+            staff_login: str,
+            is_nearest: bool,
+            date_from: dt.datetime,
+            date_to: dt.datetime,
+    ) -> tp.Dict[str, tp.List[int]]:
+        result: tp.Dict[str, tp.List[int]] = {}
+        for login in self._get_subordinates(staff_login, is_nearest):
+            minutes = self._get_minutes(login, date_from, date_to)
+            if minutes:
+                result[login] = minutes
+        return result
+
+    async def set_staff_chiefs(
+            self, chiefs: tp.Dict[str, tp.Optional[str]], version: str,
+    ) -> None:
+        self._key_value['staff_chiefs_version'] = version
+        self._chiefs = dict(chiefs)
+        self._subordinates.clear()
+        for login, chief in self._chiefs.items():
+            if chief is not None:
+                self._subordinates[chief].add(login)
+
+    async def get_staff_chiefs(self) -> tp.Dict[str, tp.Optional[str]]:
+        return dict(self._chiefs)
+
+    async def get_chiefs_cache(
+            self, updated_after: dt.datetime,
+    ) -> tp.Dict[str, tp.List[str]]:
+        return {
+            login: list(chiefs)
+            for login, (chiefs, updated_at) in self._chiefs_cache.items()
+            if updated_at > _utc(updated_after)
+        }
+
+    async def save_chiefs_cache(
+            self, staff_login: str, chiefs: tp.List[str],
+    ) -> None:
+        self._chiefs_cache[staff_login] = (list(chiefs), _now())
+
+    async def clear_chiefs_cache(
+            self, staff_logins: tp.Iterable[str], updated_before: dt.datetime,
+    ) -> None:
+        staff_logins = set(staff_logins)
+        updated_before = _utc(updated_before)
+        self._chiefs_cache = {
+            login: (chiefs, updated_at)
+            for login, (chiefs, updated_at) in self._chiefs_cache.items()
+            if login not in staff_logins and updated_at >= updated_before
+        }
+
+    # cluster.py
+
+    async def save_heartbeat(self, instance_id: str) -> None:
+        self._instances[instance_id] = _now()
+
+    async def get_live_instances(self, ttl: dt.timedelta) -> tp.List[str]:
+        since = _now() - ttl
+        return sorted(
+            instance_id
+            for instance_id, heartbeat_at in self._instances.items()
+            if heartbeat_at > since
+        )
+
+    async def delete_heartbeat(self, instance_id: str) -> None:
+        self._instances.pop(instance_id, None)
+
+    # links
+
+    async def get_nda_link(self, link: str) -> tp.Optional[str]:
+        return self._nda_links.get(link)
+
+    async def save_nda_link(self, link: str, nda: str) -> None:
+        self._nda_links.setdefault(link, nda)
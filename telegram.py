@@ -1,14 +1,29 @@
 import datetime as dt
 import json
 import logging
+import os
 import re
 import typing as tp
 
 import github
+import metrics
 import nda
 import startrek
+import tracing
 
-ENDPOINT = 'https://api.telegram.org/bot'
+# e.g. bench/fake_telegram.py for the load tests
+ENDPOINT = os.environ.get(
+    'TELEGRAM_API_ENDPOINT', 'https://api.telegram.org/bot',
+)
+metrics.register_service('telegram', ENDPOINT)
+
+MAX_MESSAGE_LENGTH = 4096
+# kept free on the pages of pr lists
+_PAGE_MARGIN = 64
+
+# send_message result when the user has blocked the bot (403), sending again
+# does not help; message ids start at 1
+BOT_BLOCKED = -1
 
 # 'GITHUB_HOST/pulls/review-requested'
 REQUESTED = 'https://nda.ya.ru/t/NVrtFNDk3bm54Z'
@@ -37,7 +52,7 @@ class Update:
 
     def __init__(self, update: dict):
         self.update_id = update['update_id']
-        logger.debug(f'update_id = {self.update_id}')
+        logger.debug('update_id = %s', self.update_id)
 
         message: dict = {}
         if 'message' in update:
@@ -46,30 +61,30 @@ class Update:
         elif 'callback_query' in update:
             self.update_type = 1
             callback_query = update.get('callback_query', {})
-            logger.debug(f'callback_query = {callback_query}')
+            logger.debug('callback_query = %s', callback_query)
 
             self.callback_data = callback_query.get('data', {})
             message = callback_query.get('message', {})
         else:
-            logger.error(f'unexpected update = {update}')
+            logger.error('unexpected update = %s', update)
             self.chat_id = ''  # crutch for loop_telegram
             return
 
-        logger.debug(f'message = {message}')
+        logger.debug('message = %s', message)
 
         chat = message.get('chat', {})
 
         self.telegram_login = chat.get('username', '').lower()
-        logger.debug(f'telegram_login = {self.telegram_login}')
+        logger.debug('telegram_login = %s', self.telegram_login)
 
         self.chat_id = str(chat['id'])
-        logger.debug(f'chat_id = {self.chat_id}')
+        logger.debug('chat_id = %s', self.chat_id)
 
         self.text = message['text']
-        logger.debug(f'text = {self.text}')
+        logger.debug('text = %s', self.text)
 
         date = message.get('date')
-        logger.debug(f'date = {date}')
+        logger.debug('date = %s', date)
         self.event_at = dt.datetime.fromtimestamp(date) if date else None
 
     def __bool__(self):
@@ -112,21 +127,73 @@ async def _staff_link(staff_login: str, ctx) -> str:
     return f'[{_escape(staff_login)}]({staff_link})'
 
 
-async def send_message(message: str, chat_id: str, ctx) -> None:
+def _message_params(
+        message: str,
+        chat_id: str,
+        inline_keyboard: tp.Optional[tp.List[tp.List[dict]]],
+) -> dict:
+    params = {'chat_id': chat_id, 'text': message, 'parse_mode': 'MarkdownV2'}
+    if inline_keyboard is not None:
+        params['reply_markup'] = json.dumps(
+            {'inline_keyboard': inline_keyboard},
+        )
+    return params
+
+
+# the message_id of the sent message, BOT_BLOCKED or None if it was not sent
+@tracing.traced
+async def send_message(
+        message: str,
+        chat_id: str,
+        ctx,
+        inline_keyboard: tp.Optional[tp.List[tp.List[dict]]] = None,
+) -> tp.Optional[int]:
     response = await ctx.session.post(
         f'{ENDPOINT}{ctx.tg_token}/sendMessage',
-        params={
-            'chat_id': chat_id,
-            'text': message,
-            'parse_mode': 'MarkdownV2',
-        },
+        params=_message_params(message, chat_id, inline_keyboard),
     )
     response_json = await response.json()
 
-    if not response_json['ok'] and response_json['error_code'] != 403:
+    if not response_json['ok']:
+        if response_json['error_code'] == 403:
+            return BOT_BLOCKED
         logger.error(
             f'response = {response_json}, request_message = {message}',
         )
+        return None
+    return response_json['result'].get('message_id')
+
+
+# replaces the text of a sent message, no new notification for the user
+@tracing.traced
+async def edit_message(
+        message: str,
+        chat_id: str,
+        message_id: int,
+        ctx,
+        inline_keyboard: tp.Optional[tp.List[tp.List[dict]]] = None,
+) -> bool:
+    response = await ctx.session.post(
+        f'{ENDPOINT}{ctx.tg_token}/editMessageText',
+        params={
+            **_message_params(message, chat_id, inline_keyboard),
+            'message_id': message_id,
+        },
+    )
+    response_json = await response.json()
+
+    if not response_json['ok']:
+        if 'message is not modified' in response_json.get('description', ''):
+            return True  # the same text after the markdown
+        # e.g. the message was deleted by the user
+        logger.warning(
+            'failed to edit message %s in chat %s: %s',
+            message_id,
+            chat_id,
+            response_json.get('description'),
+        )
+        return False
+    return True
 
 
 async def get_updates(offset: int, ctx) -> tp.List[Update]:
@@ -144,8 +211,9 @@ async def get_updates(offset: int, ctx) -> tp.List[Update]:
 
     if response.status != 200:
         logger.debug(
-            f'bad telegram updates status {response.status}'
-            f', response = {response_json}',
+            'bad telegram updates status %s, response = %s',
+            response.status,
+            response_json,
         )
         return []
 
@@ -251,27 +319,54 @@ async def hourly_notification(
     return result
 
 
-async def want_review_message(
-        pull_requests: tp.List[github.PullRequest], ctx,
-) -> str:
-    result: str = 'You can review the following prs\\:\n'
-    for pull_request in pull_requests:
-        result += f'{await _pr_string(pull_request, ctx)}\n'
-    return result
+WANT_REVIEW_HEADER = 'You can review the following prs\\:\n'
+REVIEWED_HEADER = 'You have reviewed the following prs\\:\n'
 
 
-async def show_reviewed_message(
-        reviewed: tp.List[github.PullRequest], github_login: str, ctx,
-) -> str:
-    result: str = ''
-    if not reviewed:
-        result = 'You have no reviewed prs this week'
-    else:
-        result += 'You have reviewed the following prs\\:\n'
-        for pull_request in reviewed:
-            result += f'{await _pr_string(pull_request, ctx)}\n'
+def no_reviewed_message() -> str:
+    return 'You have no reviewed prs this week'
 
-    return result
+
+def expired_list_message() -> str:
+    return 'This list has expired, request it again'
+
+
+# telegram counts the length in utf-16 code units, an emoji is two of them
+def _get_length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+# at most page_size prs from start that fit into one message, rendered only
+# here (the nda links); the text and the end of the page
+async def pr_list_page(
+        header: str,
+        pull_requests: tp.Sequence[github.PullRequest],
+        start: int,
+        page_size: int,
+        ctx,
+) -> tp.Tuple[str, int]:
+    total = len(pull_requests)
+    # the markdown is longer than the text telegram counts, and a margin
+    limit = (
+        MAX_MESSAGE_LENGTH
+        - _PAGE_MARGIN
+        - len(f'{total}\\-{total} of {total}')
+    )
+    result: str = header
+    length = _get_length(header)
+    end = start
+    for pull_request in pull_requests[start : start + page_size]:
+        pr_string = f'{await _pr_string(pull_request, ctx)}\n'
+        pr_length = _get_length(pr_string)
+        if end > start and length + pr_length > limit:
+            break
+        result += pr_string
+        length += pr_length
+        end += 1
+
+    if start > 0 or end < total:
+        result += _escape(f'{start + 1}-{end} of {total}')
+    return result, end
 
 
 def no_stats_message() -> str:
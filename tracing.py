@@ -0,0 +1,135 @@
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import time
+import typing as tp
+
+import aiohttp
+
+import logs
+import metrics
+
+
+logger = logging.getLogger()
+
+# one json line per finished span, see setup()
+_exporter = logging.getLogger('tracing')
+_exporter.propagate = False
+_enabled = False
+
+
+class Span:
+    __slots__ = (
+        'trace_id',
+        'span_id',
+        'parent_id',
+        'name',
+        'attrs',
+        'started_at',
+        '_started',
+        '_token',
+    )
+
+    def __init__(
+            self,
+            name: str,
+            attrs: tp.Dict[str, tp.Any],
+            parent: tp.Optional['Span'],
+    ):
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self._token: tp.Optional[contextvars.Token] = None
+
+    def set(self, key: str, value: tp.Any) -> None:
+        self.attrs[key] = value
+
+    def finish(self, error: tp.Optional[BaseException] = None) -> None:
+        if error is not None:
+            self.attrs['error'] = repr(error)
+        if not _enabled:
+            return
+        _exporter.info(
+            json.dumps(
+                {
+                    'trace_id': self.trace_id,
+                    'span_id': self.span_id,
+                    'parent_id': self.parent_id,
+                    'name': self.name,
+                    'start': round(self.started_at, 6),
+                    'duration': round(time.monotonic() - self._started, 6),
+                    'attrs': self.attrs,
+                },
+                default=str,
+            ),
+        )
+
+    def __enter__(self) -> 'Span':
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        _current.reset(self._token)
+        self.finish(exc)
+
+
+# asyncio tasks copy the context, so gather()-ed children find their parent
+_current: 'contextvars.ContextVar[tp.Optional[Span]]' = (
+    contextvars.ContextVar('tracing_span', default=None)
+)
+
+
+def span(name: str, **attrs: tp.Any) -> Span:
+    return Span(name, attrs, _current.get())
+
+
+def traced(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+# no urls in the attributes, the telegram one contains the token
+async def _on_request_start(session, trace_ctx, params) -> None:
+    trace_ctx.span = span(
+        f'http {metrics.get_service(str(params.url))}', method=params.method,
+    )
+
+
+async def _on_request_end(session, trace_ctx, params) -> None:
+    trace_ctx.span.set('status', params.response.status)
+    trace_ctx.span.finish()
+
+
+async def _on_request_exception(session, trace_ctx, params) -> None:
+    trace_ctx.span.finish(params.exception)
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_request_end.append(_on_request_end)
+    config.on_request_exception.append(_on_request_exception)
+    return config
+
+
+def setup(filename: str, max_bytes: int, backup_count: int) -> None:
+    global _enabled
+    handler = logging.handlers.RotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backup_count,
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _exporter.addHandler(logs.queued(handler))
+    _exporter.setLevel(logging.INFO)
+    _enabled = True
+    logger.info(f'tracing spans are written to {filename}')